@@ -0,0 +1,217 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli'))
+
+from utils import (find_soft_clips, find_high_support_sites, align_soft_clips, generate_final_results,
+                   rank_candidates, materialize_alignments, AlignmentEngine, ReferenceAlignmentCache)
+from file_interaction import load_bam, save_results_sv, save_results_txt
+from alignment_models import SiteTable
+from reference_store import ReferenceGenome
+from synthetic_data import simulate_dataset
+
+STAGES = ['find_soft_clips', 'find_high_support_sites', 'align_soft_clips', 'generate_final_results',
+          'rank_candidates', 'save_results_sv', 'save_results_txt']
+
+FIELDNAMES = ['reads', 'contig_length', 'junctions', 'stage', 'repeats', 'median_s', 'q1_s', 'q3_s', 'items']
+
+def get_args():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the pipeline stages on synthetic data')
+    parser.add_argument('--read_counts',
+                        type=int,
+                        nargs='+',
+                        default=[10000, 50000, 200000],
+                        help='Background read counts to benchmark (default: 10000 50000 200000)')
+    parser.add_argument('--coverage',
+                        type=float,
+                        default=2.0,
+                        help='Background coverage, which sets the contig length for each read count (default: 2.0)')
+    parser.add_argument('--junctions_per_mb',
+                        type=float,
+                        default=200.0,
+                        help='Planted junctions per megabase of reference (default: 200)')
+    parser.add_argument('--clip_rate',
+                        type=float,
+                        default=0.1,
+                        help='Fraction of background reads carrying a random soft-clip (default: 0.1)')
+    parser.add_argument('--read_length',
+                        type=int,
+                        default=42,
+                        help='Read length (default: 42)')
+    parser.add_argument('--repeats',
+                        type=int,
+                        default=3,
+                        help='Timed runs of the pipeline per size (default: 3)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the generated data (default: 0)')
+    parser.add_argument('--data_dir',
+                        type=str,
+                        default=None,
+                        help='Directory for the generated BAM and FASTA files (default: a temporary directory)')
+    parser.add_argument('--output',
+                        type=str,
+                        default='pipeline_results',
+                        help='Output prefix for the .csv and .json files (default: pipeline_results)')
+    parser.add_argument('--baseline',
+                        type=str,
+                        default=None,
+                        help='JSON results of an earlier run to check for regressions against')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.25,
+                        help='Allowed relative slowdown of a stage median before a regression is reported (default: 0.25)')
+    return parser.parse_args()
+
+def _timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+def run_pipeline(bam_path: str, fasta_path: str, out_dir: str) -> tuple[dict[str, float], dict[str, int]]:
+    """Runs the pipeline once, materializing the output of every stage so each one is timed on its own.
+    The status_message wrappers are bypassed, since in dots mode their thread adds up to half a second per stage.
+
+    Args:
+        bam_path (str): sorted, indexed BAM file
+        fasta_path (str): reference FASTA file
+        out_dir (str): directory the output files are written to
+
+    Returns:
+        tuple[dict[str, float], dict[str, int]]: seconds spent in each stage, and the number of items each stage produced
+    """
+    timings = {}
+    counts = {}
+    bam = load_bam(bam_path)
+    reference = ReferenceGenome(fasta_path)
+    name = reference.names[0]
+    contig = reference.contig(name)
+    start_sc, end_sc, scan_stats = _timed(timings, 'find_soft_clips', find_soft_clips.__wrapped__, bam, None, name)
+    counts['find_soft_clips'] = scan_stats.reads
+    start = time.perf_counter()
+    start_hsc = find_high_support_sites.__wrapped__(start_sc)
+    end_hsc = find_high_support_sites.__wrapped__(end_sc)
+    start_sites = SiteTable.from_sites(start_hsc, name)
+    end_sites = SiteTable.from_sites(end_hsc, name)
+    timings['find_high_support_sites'] = time.perf_counter() - start
+    counts['find_high_support_sites'] = len(start_sites) + len(end_sites)
+    with AlignmentEngine() as engine:
+        aligned = _timed(timings, 'align_soft_clips', lambda: list(align_soft_clips(start_sites, end_sites, engine=engine)))
+        counts['align_soft_clips'] = sum(len(table) for table in aligned)
+        final = _timed(timings, 'generate_final_results',
+                       lambda: list(generate_final_results(aligned, contig, ReferenceAlignmentCache(), engine)))
+        counts['generate_final_results'] = sum(len(table) for table in final)
+    ranked = _timed(timings, 'rank_candidates', rank_candidates.__wrapped__, final, start_sites, end_sites)
+    counts['rank_candidates'] = len(ranked)
+    counts['save_results_sv'] = _timed(timings, 'save_results_sv', save_results_sv.__wrapped__,
+                                       ranked.records(), os.path.join(out_dir, 'results.csv'))
+    counts['save_results_txt'] = _timed(timings, 'save_results_txt', save_results_txt.__wrapped__,
+                                        materialize_alignments(ranked.records(), reference), os.path.join(out_dir, 'results.txt'))
+    bam.close()
+    return timings, counts
+
+def recovered_junctions(out_dir: str, planted: list[tuple[str, int, int]]) -> int:
+    with open(os.path.join(out_dir, 'results.csv'), newline='') as f:
+        found = {(r['contig'], int(r['start_pos']), int(r['end_pos'])) for r in csv.DictReader(f)}
+    return sum(junction in found for junction in planted)
+
+def run_benchmarks(args, data_dir):
+    results = []
+    for n_reads in args.read_counts:
+        contig_length = max(int(n_reads * args.read_length / args.coverage), 10 * args.read_length + 1000)
+        n_junctions = max(1, round(args.junctions_per_mb * contig_length / 1e6))
+        prefix = os.path.join(data_dir, f"synthetic_{n_reads}")
+        dataset = simulate_dataset(prefix,
+                                   n_reads=n_reads,
+                                   contig_length=contig_length,
+                                   read_length=args.read_length,
+                                   clip_rate=args.clip_rate,
+                                   n_junctions=n_junctions,
+                                   seed=args.seed)
+        runs = []
+        for _ in range(args.repeats):
+            timings, counts = run_pipeline(dataset['bam'], dataset['fasta'], data_dir)
+            runs.append(timings)
+        recovered = recovered_junctions(data_dir, dataset['planted'])
+        print(f"{dataset['reads']} reads, {contig_length} bp, {n_junctions} junctions "
+              f"({recovered} recovered):")
+        for stage in STAGES:
+            times = [run[stage] for run in runs]
+            q1, median, q3 = statistics.quantiles(times, n=4, method='inclusive') if len(times) > 1 else (times[0],) * 3
+            results.append({
+                'reads': dataset['reads'],
+                'contig_length': contig_length,
+                'junctions': n_junctions,
+                'stage': stage,
+                'repeats': args.repeats,
+                'median_s': median,
+                'q1_s': q1,
+                'q3_s': q3,
+                'items': counts[stage],
+            })
+            print(f"  {stage}: median {median:.4f} s, {counts[stage]} items")
+    return results
+
+def save_results(results, prefix):
+    with open(f"{prefix}.csv", 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for r in results:
+            writer.writerow({field: r[field] for field in FIELDNAMES})
+    with open(f"{prefix}.json", 'w') as f:
+        json.dump({
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2)
+
+def load_baseline(baseline_path):
+    with open(baseline_path) as f:
+        return {(r['reads'], r['stage']): r for r in json.load(f)['results']}
+
+def check_regressions(results, baseline, tolerance):
+    """Compares the stage medians against an earlier run
+
+    Returns:
+        list[str]: a description of every stage and size whose median grew by more than the tolerance
+    """
+    regressions = []
+    for r in results:
+        base = baseline.get((r['reads'], r['stage']))
+        if base is None or base['median_s'] <= 0:
+            continue
+        ratio = r['median_s'] / base['median_s']
+        if ratio > 1 + tolerance:
+            regressions.append(f"{r['stage']} | {r['reads']} reads: "
+                               f"{base['median_s']:.4f} s -> {r['median_s']:.4f} s ({ratio:.2f}x)")
+    return regressions
+
+def main():
+    args = get_args()
+    # Read the baseline first, since it may be the file this run overwrites
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+        results = run_benchmarks(args, args.data_dir)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            results = run_benchmarks(args, data_dir)
+    save_results(results, args.output)
+    if baseline is not None:
+        regressions = check_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
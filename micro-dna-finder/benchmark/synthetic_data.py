@@ -0,0 +1,148 @@
+import argparse
+import random
+import pysam
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Generate a synthetic reference and sorted, indexed BAM with planted microDNA junctions')
+    parser.add_argument('-o',
+                        '--output_prefix',
+                        type=str,
+                        required=True,
+                        help='Prefix of the .fa and .bam files to write')
+    parser.add_argument('--n_reads',
+                        type=int,
+                        default=20000,
+                        help='Number of background reads (default: 20000)')
+    parser.add_argument('--contig_length',
+                        type=int,
+                        default=200000,
+                        help='Length of each contig (default: 200000)')
+    parser.add_argument('--n_contigs',
+                        type=int,
+                        default=1,
+                        help='Number of contigs (default: 1)')
+    parser.add_argument('--read_length',
+                        type=int,
+                        default=42,
+                        help='Read length (default: 42)')
+    parser.add_argument('--clip_rate',
+                        type=float,
+                        default=0.1,
+                        help='Fraction of background reads carrying a random soft-clip (default: 0.1)')
+    parser.add_argument('--n_junctions',
+                        type=int,
+                        default=40,
+                        help='Number of planted circle junctions (default: 40)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed (default: 0)')
+    return parser.parse_args()
+
+def _random_seq(rng, length):
+    return ''.join(rng.choices('ACGT', k=length))
+
+def _make_read(name, contig_id, pos, seq, cigar):
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.query_sequence = seq
+    read.flag = 0
+    read.reference_id = contig_id
+    read.reference_start = pos
+    read.mapping_quality = 60
+    read.cigartuples = cigar
+    read.query_qualities = pysam.qualitystring_to_array('I' * len(seq))
+    return read
+
+def simulate_dataset(output_prefix: str, n_reads: int = 20000, contig_length: int = 200000, n_contigs: int = 1,
+                     read_length: int = 42, clip_rate: float = 0.1, n_junctions: int = 40,
+                     min_support: int = 10, max_support: int = 25, min_span: int = 150, max_span: int = 600,
+                     seed: int = 0) -> dict:
+    """Writes a random reference and a coordinate-sorted, indexed BAM of reads drawn from it. Planted circles
+    contribute start soft-clipped reads at the circle start and end soft-clipped reads ending at the circle end,
+    with clipped bases taken from the other side of the junction, which is what the pipeline looks for.
+
+    Args:
+        output_prefix (str): prefix of the .fa and .bam files to write
+        n_reads (int, optional): number of background reads, spread evenly over the contigs. Defaults to 20000.
+        contig_length (int, optional): length of each contig. Defaults to 200000.
+        n_contigs (int, optional): number of contigs. Defaults to 1.
+        read_length (int, optional): read length. Defaults to 42.
+        clip_rate (float, optional): fraction of background reads carrying a random soft-clip. Defaults to 0.1.
+        n_junctions (int, optional): number of planted circle junctions, spread evenly over the contigs. Defaults to 40.
+        min_support (int, optional): minimum number of reads on each side of a planted junction. Defaults to 10.
+        max_support (int, optional): maximum number of reads on each side of a planted junction. Defaults to 25.
+        min_span (int, optional): minimum circle length. Defaults to 150.
+        max_span (int, optional): maximum circle length. Defaults to 600.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict: paths of the written files and the planted junctions as (contig, 1-based start site, 1-based end site),
+        in the coordinates the pipeline reports
+    """
+    rng = random.Random(seed)
+    contigs = {f"chrS{i + 1}": _random_seq(rng, contig_length) for i in range(n_contigs)}
+    fasta_path = f"{output_prefix}.fa"
+    with open(fasta_path, 'w') as f:
+        for name, seq in contigs.items():
+            f.write(f">{name}\n")
+            for i in range(0, len(seq), 60):
+                f.write(seq[i:i + 60] + "\n")
+    pysam.faidx(fasta_path)
+
+    reads = []
+    planted = []
+    for contig_id, (name, ref) in enumerate(contigs.items()):
+        for _ in range(n_reads // n_contigs):
+            pos = rng.randint(0, contig_length - read_length)
+            seq = ref[pos:pos + read_length]
+            cigar = [(0, read_length)]
+            if rng.random() < clip_rate:
+                clip = rng.randint(5, read_length // 2)
+                if rng.random() < 0.5:
+                    seq = _random_seq(rng, clip) + seq[clip:]
+                    cigar = [(4, clip), (0, read_length - clip)]
+                else:
+                    seq = seq[:read_length - clip] + _random_seq(rng, clip)
+                    cigar = [(0, read_length - clip), (4, clip)]
+            reads.append(_make_read(f"r{len(reads)}", contig_id, pos, seq, cigar))
+        for _ in range(n_junctions // n_contigs):
+            start = rng.randint(read_length, contig_length - max_span - read_length)
+            end = start + rng.randint(min_span, max_span)
+            circle = ref[start:end]
+            # End soft-clipped reads at a junction share their start, so they land on the same site
+            end_clip = rng.randint(8, read_length - 12)
+            end_read_start = end - (read_length - end_clip)
+            for _ in range(rng.randint(min_support, max_support)):
+                clip = rng.randint(8, read_length - 12)
+                seq = circle[-clip:] + circle[:read_length - clip]
+                reads.append(_make_read(f"r{len(reads)}", contig_id, start, seq, [(4, clip), (0, read_length - clip)]))
+                seq = ref[end_read_start:end] + circle[:end_clip]
+                reads.append(_make_read(f"r{len(reads)}", contig_id, end_read_start, seq, [(0, read_length - end_clip), (4, end_clip)]))
+            planted.append((name, start + 1, end_read_start + 1))
+
+    reads.sort(key=lambda r: (r.reference_id, r.reference_start))
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': name, 'LN': len(seq)} for name, seq in contigs.items()]}
+    bam_path = f"{output_prefix}.bam"
+    with pysam.AlignmentFile(bam_path, 'wb', header=header) as out:
+        for read in reads:
+            out.write(read)
+    pysam.index(bam_path)
+    return {'bam': bam_path, 'fasta': fasta_path, 'reads': len(reads), 'planted': planted}
+
+def main():
+    args = get_args()
+    dataset = simulate_dataset(args.output_prefix,
+                               n_reads=args.n_reads,
+                               contig_length=args.contig_length,
+                               n_contigs=args.n_contigs,
+                               read_length=args.read_length,
+                               clip_rate=args.clip_rate,
+                               n_junctions=args.n_junctions,
+                               seed=args.seed)
+    print(f"Wrote {dataset['reads']} reads to {dataset['bam']} and the reference to {dataset['fasta']} "
+          f"with {len(dataset['planted'])} planted junctions")
+
+if __name__ == '__main__':
+    main()
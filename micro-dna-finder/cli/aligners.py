@@ -0,0 +1,392 @@
+import time
+import numpy as np
+from Bio import Align
+from alignment_models import AlignerDetails
+from typing import Iterable
+
+try:
+    from skbio.alignment import pair_align
+except ImportError:
+    pair_align = None
+
+# Score of every position of a gap at either end of the second sequence of a soft-clip pair (sc=True)
+SC_END_GAP_SCORE = -0.1
+
+def aligner_init(match_score: int = 2, mismatch_score: int = -1, open_gap_score: int = -0.5, extend_gap_score: int = -0.1, mode: str = 'global', sc: bool = False) -> Align.PairwiseAligner:
+    """Initializes the pairwise aligner with the specified parameters
+
+    Args:
+        match_score (int, optional): match score defined in BioPython. Defaults to 2.
+        mismatch_score (int, optional): mismatch score defined in BioPython. Defaults to -1.
+        open_gap_score (int, optional): open gap score defined in BioPython. Defaults to -0.5.
+        extend_gap_score (int, optional): extend gap score defined in BioPython. Defaults to -0.1.
+        mode (str, optional): 'global' or 'local' mode which determines the aligner methods. Defaults to 'global'.
+        sc (bool, optional): flag to determine if the alignment is on two soft-clips. Defaults to False.
+
+    Returns:
+        Align.PairwiseAligner: the initialized pairwise aligner
+    """
+    aligner = Align.PairwiseAligner()
+    aligner.mode = mode
+    aligner.match_score = match_score
+    aligner.mismatch_score = mismatch_score
+    aligner.open_gap_score = open_gap_score
+    aligner.extend_gap_score = extend_gap_score
+    if sc:
+        aligner.query_left_open_gap_score = SC_END_GAP_SCORE
+        aligner.query_right_open_gap_score = SC_END_GAP_SCORE
+        aligner.query_left_extend_gap_score = SC_END_GAP_SCORE
+        aligner.query_right_extend_gap_score = SC_END_GAP_SCORE
+    # logger.info(f"Pairwise sequence alignment initialized using the {Fore.BLUE}{aligner.algorithm}{Fore.RESET} with {Fore.BLUE}{aligner.mode}{Fore.RESET} mode.")
+    return aligner
+
+def align_strs(aligner: Align.PairwiseAligner, query: str, target: str) -> AlignerDetails:
+    """Aligns two sequences in string format using the specified aligner
+
+    Args:
+        aligner (Align.PairwiseAligner): the pairwise aligner
+        query (str): the query sequence
+        target (str): the target sequence (another soft-clip or the reference genome)
+
+    Returns:
+        AlignerDetails: the alignment details including the alignment sequence and score
+    """
+    alignments = aligner.align(query, target)
+    # If no alignments are found, return None and a score of -inf to make evidence score calculation alter
+    if not alignments:
+        return AlignerDetails(None, float("-inf"))
+    alignment = alignments[0]
+    score = alignment.score
+    return AlignerDetails(alignment, score)
+
+def score_strs(aligner: Align.PairwiseAligner, query: str, target: str) -> float:
+    """Scores the best alignment of two sequences in string format without building the traceback
+
+    Args:
+        aligner (Align.PairwiseAligner): the pairwise aligner
+        query (str): the query sequence
+        target (str): the target sequence (another soft-clip or the reference genome)
+
+    Returns:
+        float: the score of the best alignment
+    """
+    return aligner.score(query, target)
+
+class AlignerBackend:
+    """Interface of the pairwise aligners the pipeline can score with. A backend is built for one set of aligner_init
+    parameters and must give the scores of the Biopython aligner those parameters describe; backends that can only
+    approximate a scheme say so through supports, and autotune_backend checks the scores they actually produce, for
+    autotuned and pinned backends alike (see AlignmentEngine).
+
+    Args:
+        params (dict): keyword arguments for aligner_init
+    """
+    name = ""
+
+    def __init__(self, params: dict):
+        self.params = params
+
+    @classmethod
+    def available(cls) -> bool:
+        """Returns whether the libraries the backend needs are installed"""
+        return True
+
+    @classmethod
+    def supports(cls, params: dict) -> bool:
+        """Returns whether the backend can score the scheme described by a set of aligner_init parameters"""
+        return True
+
+    def score(self, query: str, target: str) -> float:
+        """Scores the best alignment of two sequences without building the traceback"""
+        raise NotImplementedError
+
+    def align(self, query: str, target: str) -> AlignerDetails:
+        """Builds the best alignment of two sequences"""
+        raise NotImplementedError
+
+    def score_batch(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """Scores a batch of (query, target) pairs, in order. Backends with a per-call overhead override it to share that overhead"""
+        return [self.score(query, target) for query, target in pairs]
+
+# Backends by name, in the order autotuning tries them
+BACKENDS: dict[str, type[AlignerBackend]] = {}
+
+def register_backend(cls: type[AlignerBackend]) -> type[AlignerBackend]:
+    """Class decorator adding a backend to BACKENDS under its name"""
+    BACKENDS[cls.name] = cls
+    return cls
+
+@register_backend
+class BiopythonBackend(AlignerBackend):
+    """Biopython's PairwiseAligner, the reference every other backend is checked against"""
+    name = "biopython"
+
+    def __init__(self, params: dict):
+        super().__init__(params)
+        self.aligner = aligner_init(**params)
+
+    def score(self, query: str, target: str) -> float:
+        return score_strs(self.aligner, query, target)
+
+    def align(self, query: str, target: str) -> AlignerDetails:
+        return align_strs(self.aligner, query, target)
+
+@register_backend
+class SkbioBackend(AlignerBackend):
+    """scikit-bio's pair_align (scikit-bio 0.7 or later). Its affine gaps cost o + e * k for k positions and end gaps are either
+    scored like inner gaps or free, so it supports the schemes without the soft-clip end gap scores (sc=True)"""
+    name = "skbio"
+
+    @classmethod
+    def available(cls) -> bool:
+        return pair_align is not None
+
+    @classmethod
+    def supports(cls, params: dict) -> bool:
+        return not params.get("sc") and params.get("mode", "global") in ("global", "local")
+
+    def __init__(self, params: dict):
+        super().__init__(params)
+        p = {**_defaults(), **params}
+        self._kwargs = {
+            "mode": p["mode"],
+            "sub_score": (p["match_score"], p["mismatch_score"]),
+            "gap_cost": (p["extend_gap_score"] - p["open_gap_score"], -p["extend_gap_score"]),
+            "free_ends": False,
+        }
+
+    def score(self, query: str, target: str) -> float:
+        return float(pair_align(_as_str(query), _as_str(target), max_paths=0, **self._kwargs).score)
+
+    def align(self, query: str, target: str) -> AlignerDetails:
+        query, target = _as_str(query), _as_str(target)
+        result = pair_align(query, target, **self._kwargs)
+        if not result.paths:
+            return AlignerDetails(None, float("-inf"))
+        aligned = result.paths[0].to_aligned((query, target))
+        return AlignerDetails("\n".join(aligned), float(result.score))
+
+@register_backend
+class NumpyBackend(AlignerBackend):
+    """Gotoh dynamic programming vectorized with NumPy over a whole batch of pairs at once, see gotoh_scores.
+    Pairs of similar lengths are scored together, so little work is spent on padding. Tracebacks are left to Biopython.
+    Scores are summed in another order than Biopython's, so schemes with fractional scores can differ from it in the
+    last bits, which the agreement check of the engine catches"""
+    name = "numpy"
+
+    # Pairs scored together, sorted by length so each group is padded to similar sizes
+    group_size = 256
+
+    @classmethod
+    def supports(cls, params: dict) -> bool:
+        p = {**_defaults(), **params}
+        end_gap = SC_END_GAP_SCORE if p["sc"] else p["open_gap_score"]
+        # The running maximum over horizontal gaps never reopens a gap, which is only optimal when opening costs at least as much as extending
+        return p["mode"] in ("global", "local") and p["open_gap_score"] <= p["extend_gap_score"] <= 0 and end_gap <= 0
+
+    def __init__(self, params: dict):
+        super().__init__(params)
+        self._biopython = BiopythonBackend(params)
+
+    def score(self, query: str, target: str) -> float:
+        return self.score_batch([(query, target)])[0]
+
+    def align(self, query: str, target: str) -> AlignerDetails:
+        return self._biopython.align(query, target)
+
+    def score_batch(self, pairs: list[tuple[str, str]]) -> list[float]:
+        scores = np.empty(len(pairs), dtype=np.float64)
+        # Empty sequences have no cells to fill, so Biopython scores them
+        lengths = np.array([(len(q), len(t)) for q, t in pairs], dtype=np.int64).reshape(-1, 2)
+        empty = (lengths == 0).any(axis=1)
+        for i in np.flatnonzero(empty).tolist():
+            scores[i] = self._biopython.score(*pairs[i])
+        order = np.flatnonzero(~empty)
+        order = order[np.lexsort((lengths[order, 1], lengths[order, 0]))]
+        for group_start in range(0, len(order), self.group_size):
+            group = order[group_start:group_start + self.group_size]
+            scores[group] = gotoh_scores([pairs[i][0] for i in group.tolist()], [pairs[i][1] for i in group.tolist()], self.params)
+        return scores.tolist()
+
+def _defaults() -> dict:
+    return {"match_score": 2, "mismatch_score": -1, "open_gap_score": -0.5, "extend_gap_score": -0.1, "mode": "global", "sc": False}
+
+def _as_str(seq: str | bytes) -> str:
+    return seq.decode("ascii") if isinstance(seq, bytes) else seq
+
+def _encode(seqs: list[str | bytes], width: int, pad: int) -> np.ndarray:
+    encoded = np.full((len(seqs), width), pad, dtype=np.uint8)
+    for row, seq in enumerate(seqs):
+        encoded[row, :len(seq)] = np.frombuffer(seq.encode("ascii") if isinstance(seq, str) else seq, dtype=np.uint8)
+    return encoded
+
+def gotoh_scores(queries: list[str | bytes], targets: list[str | bytes], params: dict) -> np.ndarray:
+    """Scores pairs with the affine-gap scheme of a set of aligner_init parameters, like Biopython's aligner.score(query, target).
+    The matrix is filled one query base (row) at a time for every target base and every pair at once: vertical gaps only
+    need the previous row, and the chain of horizontal gaps, E[j] = max_k(V[k] + open + extend * (j - 1 - k)), is a running
+    maximum. Global alignments score gaps at the ends of the target (the first and last column) with the soft-clip end gap
+    score when sc is set, as aligner_init does.
+
+    Args:
+        queries (list[str | bytes]): the first sequence of every pair, none of them empty
+        targets (list[str | bytes]): the second sequence of every pair, none of them empty
+        params (dict): keyword arguments for aligner_init
+
+    Returns:
+        np.ndarray: the best alignment score of every pair
+    """
+    p = {**_defaults(), **params}
+    match, mismatch = float(p["match_score"]), float(p["mismatch_score"])
+    gap_open, gap_extend = float(p["open_gap_score"]), float(p["extend_gap_score"])
+    local = p["mode"] == "local"
+    q_lens = np.array([len(q) for q in queries], dtype=np.int64)
+    t_lens = np.array([len(t) for t in targets], dtype=np.int64)
+    n_pairs, m, n = len(queries), int(q_lens.max()), int(t_lens.max())
+    # Padding bytes differ between the two sides so padded cells never match; they only feed cells past the end of a pair
+    q_codes = _encode(queries, m, 0)
+    t_codes = _encode(targets, n, 1)
+    rows = np.arange(n_pairs)
+    cols = np.arange(n + 1, dtype=np.float64)
+    # Vertical gap scores per column: gaps in the target before its first or after its last base are end gaps
+    v_open = np.full((n_pairs, n + 1), gap_open)
+    v_extend = np.full((n_pairs, n + 1), gap_extend)
+    if p["sc"] and not local:
+        v_open[:, 0] = v_extend[:, 0] = SC_END_GAP_SCORE
+        v_open[rows, t_lens] = v_extend[rows, t_lens] = SC_END_GAP_SCORE
+    ramp = gap_extend * cols
+    # Horizontal gaps ending at column j, from V[k] at k < j: max_k(V[k] - ramp[k]) + ramp[j - 1] + open
+    e_offset = ramp[:-1] + gap_open
+    H = np.zeros((n_pairs, n + 1))
+    if not local:
+        H[:, 1:] = gap_open + gap_extend * cols[:-1]
+    F = np.full_like(H, -np.inf)
+    V = np.full_like(H, -np.inf)
+    E = np.full_like(H, -np.inf)
+    tmp = np.empty_like(H)
+    same = np.empty((n_pairs, n), dtype=bool)
+    best = np.zeros(n_pairs)
+    valid = cols[1:] <= t_lens[:, None]
+    # Rows are updated in place, which saves allocating a matrix row for every intermediate step
+    for i in range(m):
+        np.add(F, v_extend, out=F)
+        np.add(H, v_open, out=tmp)
+        np.maximum(F, tmp, out=F)
+        np.equal(q_codes[:, i, None], t_codes, out=same)
+        np.multiply(same, match - mismatch, out=V[:, 1:])
+        V[:, 1:] += H[:, :-1]
+        V[:, 1:] += mismatch
+        np.maximum(V[:, 1:], F[:, 1:], out=V[:, 1:])
+        # Column 0 has no diagonal, only the vertical gap down the first column
+        V[:, 0] = F[:, 0]
+        if local:
+            np.maximum(V, 0, out=V)
+        np.subtract(V, ramp, out=tmp)
+        np.maximum.accumulate(tmp, axis=1, out=tmp)
+        np.add(tmp[:, :-1], e_offset, out=E[:, 1:])
+        np.maximum(V, E, out=H)
+        if local:
+            best = np.maximum(best, np.where(valid, H[:, 1:], 0).max(axis=1))
+        else:
+            done = q_lens == i + 1
+            best[done] = H[done, t_lens[done]]
+    return best
+
+def get_backend(name: str, params: dict | tuple) -> AlignerBackend:
+    """Builds a backend, reusing the one built earlier in this process for the same name and parameters.
+    Worker processes fill their own copy of the cache
+
+    Args:
+        name (str): name of a registered backend
+        params (dict | tuple): keyword arguments for aligner_init, as a dict or a tuple of (name, value) items
+
+    Returns:
+        AlignerBackend: the backend
+    """
+    params_key = tuple(params.items()) if isinstance(params, dict) else params
+    backend = _BACKEND_CACHE.get((name, params_key))
+    if backend is None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown aligner backend {name!r}, expected one of {', '.join(BACKENDS)}")
+        backend = _BACKEND_CACHE[(name, params_key)] = BACKENDS[name](dict(params_key))
+    return backend
+
+_BACKEND_CACHE: dict[tuple, AlignerBackend] = {}
+
+def usable_backends(params: dict) -> list[str]:
+    """Names of the installed backends that support a scheme, in registration order
+
+    Args:
+        params (dict): keyword arguments for aligner_init
+
+    Returns:
+        list[str]: the backend names
+    """
+    return [name for name, cls in BACKENDS.items() if cls.available() and cls.supports(params)]
+
+class BackendChoice:
+    """Outcome of autotune_backend for one scoring scheme
+
+    Args:
+        name (str): the backend picked
+        seconds (dict[str, float]): median time to score the sample, per backend timed
+        rejected (dict[str, str]): reason each skipped backend was not timed or not eligible
+        sample_size (int): number of pairs in the sample
+    """
+    def __init__(self, name: str, seconds: dict[str, float] | None = None, rejected: dict[str, str] | None = None, sample_size: int = 0):
+        self.name = name
+        self.seconds = seconds or {}
+        self.rejected = rejected or {}
+        self.sample_size = sample_size
+
+    def describe(self) -> str:
+        """Formats the choice for print_summary"""
+        if not self.seconds and not self.rejected:
+            return self.name
+        timed = ", ".join(f"{name} {seconds * 1e6 / max(self.sample_size, 1):.1f} us/pair" for name, seconds in self.seconds.items())
+        rejected = "".join(f", {name} rejected: {reason}" for name, reason in self.rejected.items())
+        # A pinned backend that failed the agreement check was never timed
+        details = f"{timed} on {self.sample_size} pairs" if timed else f"checked on {self.sample_size} pairs"
+        return f"{self.name} ({details}{rejected})"
+
+def autotune_backend(params: dict, pairs: list[tuple[str, str]], candidates: Iterable[str] | None = None,
+                     tolerance: float = 0.0, repeats: int = 3) -> BackendChoice:
+    """Picks the fastest backend for a scheme on a sample of the pairs it will score. Every candidate first scores the
+    sample once, and is only eligible if all its scores are within tolerance of Biopython's; the eligible ones are then
+    timed and the one with the lowest median time wins
+
+    Args:
+        params (dict): keyword arguments for aligner_init
+        pairs (list[tuple[str, str]]): the sample of (query, target) pairs, e.g. the first pairs of the run
+        candidates (Iterable[str] | None, optional): names of the backends to consider, or None for every usable one. Defaults to None.
+        tolerance (float, optional): largest accepted absolute difference from the Biopython score of any pair. Defaults to 0.0.
+        repeats (int, optional): timed runs per backend. Defaults to 3.
+
+    Returns:
+        BackendChoice: the backend picked, with the timings and rejections behind the choice
+    """
+    usable = usable_backends(params)
+    candidates = list(candidates) if candidates is not None else usable
+    choice = BackendChoice(BiopythonBackend.name, sample_size=len(pairs))
+    if not pairs:
+        return choice
+    expected = np.array(get_backend(BiopythonBackend.name, params).score_batch(pairs))
+    for name in candidates:
+        if name not in usable:
+            choice.rejected[name] = "not installed" if name in BACKENDS and not BACKENDS[name].available() else "unsupported scheme"
+            continue
+        backend = get_backend(name, params)
+        # The first run also warms up the backend
+        scores = np.array(backend.score_batch(pairs))
+        worst = float(np.max(np.abs(scores - expected)))
+        if not worst <= tolerance:
+            choice.rejected[name] = f"scores differ by up to {worst:g}"
+            continue
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            backend.score_batch(pairs)
+            times.append(time.perf_counter() - start)
+        choice.seconds[name] = float(np.median(times))
+    if choice.seconds:
+        choice.name = min(choice.seconds, key=choice.seconds.get)
+    return choice
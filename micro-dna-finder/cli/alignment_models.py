@@ -1,16 +1,184 @@
 from dataclasses import dataclass
+from typing import Iterator
+import numpy as np
+from seeding import encode_seq
 
 @dataclass(slots=True)
 class AlignmentDetails:
-    seq: str
+    seq: str | bytes
     sc_len: int = 0
     count: int = 1
+    # Only set when the soft-clip tables store clipped segments (ScanOptions.anchor_len):
+    # index of the clip junction within seq, 0-based reference start of the window seq is compared with,
+    # and per-column base counts (A, C, G, T, N) of all supporting reads for the consensus
+    junction: int = 0
+    ref_start: int = -1
+    profile: np.ndarray | None = None
     
-    def update_count(self):
-        self.count += 1
+    def update_count(self, amount: int = 1):
+        self.count += amount
+
+    def add_to_profile(self, segment: str | bytes, junction: int) -> None:
+        """Adds the bases of a supporting read's segment to the consensus profile, lined up on the clip junction
+
+        Args:
+            segment (str | bytes): the clipped segment of the read
+            junction (int): index of the clip junction within the segment
+        """
+        if self.profile is None:
+            self.profile = np.zeros((len(self.seq), 5), dtype=np.uint32)
+        codes = encode_seq(segment)
+        idx = np.arange(len(codes)) - junction + self.junction
+        keep = (idx >= 0) & (idx < len(self.seq))
+        np.add.at(self.profile, (idx[keep], codes[keep]), 1)
+
+    def best_seq(self) -> str:
+        """Returns the consensus of the supporting reads when a profile was collected, otherwise the stored sequence.
+        Columns where the stored base ties with the most frequent base keep the stored base
+
+        Returns:
+            str: the sequence to align
+        """
+        seq = self.seq.decode("ascii") if isinstance(self.seq, bytes) else self.seq
+        if self.profile is None:
+            return seq
+        counts = self.profile[:, :4]
+        top = counts.max(axis=1)
+        stored = encode_seq(seq)
+        stored_counts = np.where(stored < 4, counts[np.arange(len(stored)), np.minimum(stored, 3)], 0)
+        consensus = np.frombuffer(b"ACGT", dtype=np.uint8)[counts.argmax(axis=1)]
+        keep_stored = (stored_counts == top) | (top == 0)
+        return np.where(keep_stored, np.frombuffer(seq.encode("ascii"), dtype=np.uint8), consensus).tobytes().decode("ascii")
+
+    def merge(self, other: "AlignmentDetails") -> None:
+        """Adds the support of another record for the same position, found in a different scan region
+
+        Args:
+            other (AlignmentDetails): the other record, whose sequence is dropped
+        """
+        self.update_count(other.count)
+        if (self.profile is not None and other.profile is not None and self.profile.shape == other.profile.shape
+                and self.junction == other.junction and self.ref_start == other.ref_start):
+            self.profile += other.profile
+
+@dataclass(slots=True)
+class ScanOptions:
+    """Options of the BAM scan. With anchor_len set, the soft-clip tables store only the clipped bases plus
+    anchor_len aligned bases next to the junction, as bytes, instead of the whole first read. Reads with any
+    of exclude_flags set (e.g. 0xD04 for unmapped, secondary, duplicate and supplementary) or a mapping quality
+    below min_mapq are skipped. With sketch_width set, sites are first counted in a Count-Min sketch of
+    sketch_depth x sketch_width counters, and only sites whose estimate reaches sketch_min_count get a record"""
+    anchor_len: int | None = None
+    consensus: bool = False
+    exclude_flags: int = 0
+    min_mapq: int = 0
+    sketch_width: int = 0
+    sketch_depth: int = 4
+    sketch_min_count: int = 1
+    # Reads the reads a second time to count the sites that got a record exactly
+    sketch_exact: bool = False
 
 @dataclass(slots=True)
 class AlignerDetails:
     alignment: str
     score: float
 
+
+@dataclass(slots=True)
+class ScanStats:
+    reads: int = 0
+    seconds: float = 0.0
+    # Reads skipped for their flags or mapping quality, included in reads
+    filtered: int = 0
+
+    @property
+    def reads_per_sec(self) -> float:
+        return self.reads / self.seconds if self.seconds > 0 else 0.0
+
+@dataclass(slots=True)
+class SiteTable:
+    """Interned high-support soft-clip sites of one contig. Candidates refer to sites by their index in this table,
+    so each sequence is stored once however many pairs it takes part in"""
+    positions: np.ndarray
+    sc_lens: np.ndarray
+    ref_starts: np.ndarray
+    seqs: list[str]
+    contig: str = ""
+    # Positions of the sites each site stands for, when nearby sites were clustered
+    members: list[list[int]] | None = None
+
+    @classmethod
+    def from_sites(cls, sites: dict[int, AlignmentDetails], contig: str = "", members: dict[int, list[int]] | None = None) -> "SiteTable":
+        return cls(
+            positions=np.fromiter(sites.keys(), dtype=np.int64, count=len(sites)),
+            sc_lens=np.fromiter((d.sc_len for d in sites.values()), dtype=np.int64, count=len(sites)),
+            ref_starts=np.fromiter((d.ref_start for d in sites.values()), dtype=np.int64, count=len(sites)),
+            seqs=[d.best_seq() for d in sites.values()],
+            contig=contig,
+            members=[members[pos] for pos in sites] if members is not None else None,
+        )
+
+    def __len__(self) -> int:
+        return len(self.seqs)
+
+# Column layout of a candidate table. Scores stay float64 so reports match the aligner's scores exactly
+CANDIDATE_DTYPE = np.dtype([
+    ("start_pos", np.int64),
+    ("end_pos", np.int64),
+    ("start_site", np.int32),
+    ("end_site", np.int32),
+    ("read_read_score", np.float64),
+    ("start_ref_score", np.float64),
+    ("end_ref_score", np.float64),
+    ("evidence_score", np.float64),
+])
+
+@dataclass(slots=True)
+class CandidateTable:
+    """Columnar store of candidate soft-clip pairs, backed by a structured NumPy array of CANDIDATE_DTYPE rows"""
+    rows: np.ndarray
+    start_sites: SiteTable
+    end_sites: SiteTable
+
+    @classmethod
+    def empty(cls, start_sites: SiteTable, end_sites: SiteTable) -> "CandidateTable":
+        return cls(np.empty(0, dtype=CANDIDATE_DTYPE), start_sites, end_sites)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def take(self, index: np.ndarray) -> "CandidateTable":
+        return CandidateTable(self.rows[index], self.start_sites, self.end_sites)
+
+    def records(self, chunk_size: int = 4096) -> Iterator[dict]:
+        """Yields the candidates one at a time as dictionaries, for the report writers
+
+        Args:
+            chunk_size (int, optional): number of rows converted to Python objects at a time. Defaults to 4096.
+
+        Yields:
+            Iterator[dict]: the scores and positions of each candidate, along with its soft-clip sequences and,
+            when sites were clustered, the ;-separated member positions of both sites
+        """
+        clustered = self.start_sites.members is not None and self.end_sites.members is not None
+        for chunk_start in range(0, len(self.rows), chunk_size):
+            for row in self.rows[chunk_start:chunk_start + chunk_size].tolist():
+                start_pos, end_pos, start_site, end_site, read_read_score, start_ref_score, end_ref_score, evidence_score = row
+                record = {
+                    "contig": self.start_sites.contig,
+                    "start_pos": start_pos,
+                    "end_pos": end_pos,
+                    "read_read_score": read_read_score,
+                    "start_ref_score": start_ref_score,
+                    "end_ref_score": end_ref_score,
+                    "evidence_score": evidence_score,
+                    "start_seq": self.start_sites.seqs[start_site],
+                    "end_seq": self.end_sites.seqs[end_site],
+                    "start_len": int(self.start_sites.sc_lens[start_site]),
+                    "start_ref_start": int(self.start_sites.ref_starts[start_site]),
+                    "end_ref_start": int(self.end_sites.ref_starts[end_site]),
+                }
+                if clustered:
+                    record["start_members"] = ";".join(map(str, self.start_sites.members[start_site]))
+                    record["end_members"] = ";".join(map(str, self.end_sites.members[end_site]))
+                yield record
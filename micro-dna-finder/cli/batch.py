@@ -0,0 +1,161 @@
+from main import add_pipeline_args, check_pipeline_args, load_reference, run_sample
+from metrics import RunMetrics
+from reference_store import ReferenceGenome
+from beautiful_printer import print_summary, set_progress_mode
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from colorama import Fore
+
+SUMMARY_FIELDS = ['sample', 'bam_file', 'output_file', 'status', 'seconds', 'reads_scanned', 'reads_filtered', 'contigs_from_cache', 'high_support_sites', 'pairs_aligned', 'candidates_reported']
+
+# Reference sequence of a batch worker, set once per process by _init_worker
+_reference: ReferenceGenome | None = None
+
+class ManifestError(ValueError):
+    """Raised when the samples of a manifest cannot be run as one batch"""
+
+def get_args():
+    """Handles CLI arguments
+
+    Returns:
+        args: The CLI arguments as key-value pairs
+    """
+    parser = argparse.ArgumentParser(description='Run the pipeline for every BAM file of a manifest against one reference')
+    parser.add_argument('-m',
+                        '--manifest',
+                        type=str,
+                        required=True,
+                        help='Tab-separated file with a BAM path and optionally an output path per line; relative paths are relative to the manifest')
+    parser.add_argument('-ff',
+                        '--fasta_file',
+                        type=str,
+                        required=True,
+                        help='Fasta file')
+    parser.add_argument('-od',
+                        '--output_dir',
+                        type=str,
+                        default='.',
+                        help='Directory for outputs not named in the manifest, written as <BAM name>.csv (default: .)')
+    parser.add_argument('--jobs',
+                        default=1,
+                        type=int,
+                        help='Number of samples processed at the same time, each in its own process (default: 1)')
+    parser.add_argument('--summary_file',
+                        type=str,
+                        default=None,
+                        help='Combined per-sample summary in tsv format (default: batch_summary.tsv in --output_dir)')
+    add_pipeline_args(parser)
+    args = parser.parse_args()
+    check_pipeline_args(parser, args)
+    return args
+
+def read_manifest(manifest_path: str, output_dir: str) -> list[tuple[str, str]]:
+    """Reads the samples of a batch. Blank lines and lines starting with # are skipped
+
+    Args:
+        manifest_path (str): tab-separated file with a BAM path and optionally an output path per line
+        output_dir (str): directory for outputs not named in the manifest
+
+    Raises:
+        ManifestError: if two samples would write the same output file, e.g. BAM files of the same name in different directories
+
+    Returns:
+        list[tuple[str, str]]: (BAM path, output path) of every sample, in manifest order
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    samples = []
+    output_lines: dict[str, int] = {}
+    with open(manifest_path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            bam_file = os.path.join(base_dir, fields[0])
+            if len(fields) > 1 and fields[1]:
+                output_file = os.path.join(base_dir, fields[1])
+            else:
+                output_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(fields[0]))[0]}.csv")
+            # One sample would overwrite the other's results
+            first_line = output_lines.setdefault(os.path.abspath(output_file), line_number)
+            if first_line != line_number:
+                raise ManifestError(f"{manifest_path}: lines {first_line} and {line_number} both write {output_file}; "
+                                    f"name the output of one of them in the second column")
+            samples.append((bam_file, output_file))
+    return samples
+
+def _init_worker(reference: ReferenceGenome) -> None:
+    # Workers receive the reference once when they start instead of with every sample (only its paths are sent,
+    # and each worker opens the contigs itself), and keep their aligner backends (cached by aligners.get_backend) across samples
+    global _reference
+    _reference = reference
+    set_progress_mode("none")
+
+def _process_sample(args: argparse.Namespace, bam_file: str, output_file: str) -> dict:
+    """Runs one sample of the batch against the worker's reference. Failures are reported rather than raised,
+    so one bad BAM file does not stop the rest of the batch
+
+    Returns:
+        dict: the row of the sample in the combined summary
+    """
+    metrics = RunMetrics()
+    row = {'sample': os.path.splitext(os.path.basename(bam_file))[0], 'bam_file': bam_file, 'output_file': output_file}
+    start = time.perf_counter()
+    try:
+        run_sample(args, bam_file, output_file, _reference, metrics)
+        row['status'] = 'ok'
+    except Exception as e:
+        row['status'] = f"failed: {e}"
+    row['seconds'] = round(time.perf_counter() - start, 3)
+    for name in SUMMARY_FIELDS[5:]:
+        row[name] = metrics.totals.get(name, 0)
+    return row
+
+def main():
+    args = get_args()
+    try:
+        samples = read_manifest(args.manifest, args.output_dir)
+    except ManifestError as e:
+        print(f"{Fore.RED}{e}{Fore.RESET}")
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Loading reference {args.fasta_file}")
+    reference = load_reference(args, args.fasta_file)
+    start = time.perf_counter()
+    rows = []
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(reference,)) as executor:
+            futures = [executor.submit(_process_sample, args, bam_file, output_file) for bam_file, output_file in samples]
+            # Collected in manifest order, so the summary does not depend on scheduling
+            for future in futures:
+                rows.append(future.result())
+                print(f"{rows[-1]['sample']}: {rows[-1]['status']} in {rows[-1]['seconds']:.2f}s")
+    else:
+        _init_worker(reference)
+        for bam_file, output_file in samples:
+            rows.append(_process_sample(args, bam_file, output_file))
+            print(f"{rows[-1]['sample']}: {rows[-1]['status']} in {rows[-1]['seconds']:.2f}s")
+    summary_file = args.summary_file or os.path.join(args.output_dir, 'batch_summary.tsv')
+    with open(summary_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, delimiter='\t')
+        writer.writeheader()
+        writer.writerows(rows)
+    failed = [r for r in rows if r['status'] != 'ok']
+    print_summary("Batch summary", {
+        "Samples": f"{len(rows) - len(failed)} succeeded, {len(failed)} failed in {time.perf_counter() - start:.2f}s",
+        "Reads scanned": sum(r['reads_scanned'] for r in rows),
+        "Candidates reported": sum(r['candidates_reported'] for r in rows),
+        "Per-sample summary": summary_file,
+    })
+    for r in failed:
+        print(f"{Fore.RED}{r['sample']}: {r['status']}{Fore.RESET}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
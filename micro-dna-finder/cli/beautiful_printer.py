@@ -1,9 +1,30 @@
 import functools
 import threading
 import time
+from colorama import Fore
+
+PROGRESS_MODES = ("plain", "dots", "none")
+_progress_mode = "plain"
+# Set while a status line is open, e.g. while a writer consumes the lazy stages feeding it
+_status_open = False
+
+def set_progress_mode(mode: str) -> None:
+    """Selects how status_message reports progress: "plain" prints the message and its elapsed time
+    without any extra thread, "dots" animates dots from a background thread while the stage runs,
+    and "none" prints nothing.
+
+    Args:
+        mode (str): one of PROGRESS_MODES
+    """
+    global _progress_mode
+    if mode not in PROGRESS_MODES:
+        raise ValueError(f"Unknown progress mode {mode!r}, expected one of {', '.join(PROGRESS_MODES)}")
+    _progress_mode = mode
 
 def status_message(message: str, delay: float = 0.5):
-    """Decorator to print a status message with a loading animation.
+    """Decorator to print a status message while the function runs, as selected by set_progress_mode.
+    Stages that run while another stage's message is still open, e.g. lazy stages consumed by a writer
+    with --stream, print nothing, so their messages are not spliced into the open line.
 
     Args:
         message (str): Message to display while the function is running.
@@ -12,6 +33,24 @@ def status_message(message: str, delay: float = 0.5):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            global _status_open
+            if _progress_mode == "none" or _status_open:
+                return func(*args, **kwargs)
+            _status_open = True
+            try:
+                return _run(func, args, kwargs)
+            finally:
+                _status_open = False
+
+        def _run(func, args, kwargs):
+            if _progress_mode == "plain":
+                print(f"{message} ", end='', flush=True)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    print(f"✅ ({time.perf_counter() - start:.2f}s)")
+
             stop_event = threading.Event()
             def print_dots():
                 while not stop_event.is_set():
@@ -33,3 +72,23 @@ def status_message(message: str, delay: float = 0.5):
         return wrapper
     return decorator
 
+
+def print_summary(title: str, rows: dict[str, object]) -> None:
+    """Prints a titled block of name-value pairs, used for the end-of-run summary
+
+    Args:
+        title (str): heading of the block
+        rows (dict[str, object]): values to print, in order
+    """
+    print(f"{Fore.BLUE}{title}{Fore.RESET}")
+    for name, value in rows.items():
+        print(f"  {name}: {value}")
+
+def print_progress(message: str) -> None:
+    """Prints a progress line, e.g. the contig about to be processed, unless progress output is off
+
+    Args:
+        message (str): line to print
+    """
+    if _progress_mode != "none":
+        print(f"{Fore.BLUE}{message}{Fore.RESET}")
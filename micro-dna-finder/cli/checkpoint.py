@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+import numpy as np
+from typing import Iterable, Iterator
+from alignment_models import AlignmentDetails, ScanStats, CandidateTable, CANDIDATE_DTYPE
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of the cached arrays or the meaning of a stage changes, so old entries are ignored
+CACHE_VERSION = 2
+
+def _file_identity(path: str) -> dict | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"path": os.path.realpath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def bam_identity(bam_path: str) -> dict:
+    """Describes a BAM file and its index by path, size and modification time, so a cache entry
+    is invalidated whenever either file is rewritten
+
+    Args:
+        bam_path (str): path of the BAM file
+
+    Returns:
+        dict: identity of the BAM file and of the first index found next to it
+    """
+    index = None
+    for candidate in (f"{bam_path}.bai", f"{bam_path}.csi", f"{os.path.splitext(bam_path)[0]}.bai"):
+        index = _file_identity(candidate)
+        if index is not None:
+            break
+    return {"bam": _file_identity(bam_path), "index": index}
+
+def cache_key(*parts) -> str:
+    """Hashes the identity of the inputs and the parameters of a stage into a cache key
+
+    Returns:
+        str: hex digest identifying the stage result
+    """
+    encoded = json.dumps([CACHE_VERSION, *parts], sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:24]
+
+def _pack_sites(prefix: str, sites: dict[int, AlignmentDetails], arrays: dict[str, np.ndarray]) -> None:
+    details = list(sites.values())
+    seqs = [d.seq.encode("ascii") if isinstance(d.seq, str) else d.seq for d in details]
+    arrays[f"{prefix}_positions"] = np.fromiter(sites.keys(), dtype=np.int64, count=len(sites))
+    arrays[f"{prefix}_counts"] = np.fromiter((d.count for d in details), dtype=np.int64, count=len(details))
+    arrays[f"{prefix}_sc_lens"] = np.fromiter((d.sc_len for d in details), dtype=np.int64, count=len(details))
+    arrays[f"{prefix}_junctions"] = np.fromiter((d.junction for d in details), dtype=np.int64, count=len(details))
+    arrays[f"{prefix}_ref_starts"] = np.fromiter((d.ref_start for d in details), dtype=np.int64, count=len(details))
+    arrays[f"{prefix}_seq_lens"] = np.fromiter((len(s) for s in seqs), dtype=np.int64, count=len(seqs))
+    arrays[f"{prefix}_seqs"] = np.frombuffer(b"".join(seqs), dtype=np.uint8)
+    arrays[f"{prefix}_seqs_are_bytes"] = np.array(bool(details) and isinstance(details[0].seq, bytes))
+    # Consensus profiles have one row per base of the stored sequence, so they are concatenated in the same order
+    has_profile = np.fromiter((d.profile is not None for d in details), dtype=bool, count=len(details))
+    arrays[f"{prefix}_has_profile"] = has_profile
+    profiles = [d.profile for d in details if d.profile is not None]
+    arrays[f"{prefix}_profiles"] = np.concatenate(profiles) if profiles else np.empty((0, 5), dtype=np.uint32)
+
+def _unpack_sites(prefix: str, arrays) -> dict[int, AlignmentDetails]:
+    seq_lens = arrays[f"{prefix}_seq_lens"]
+    offsets = np.concatenate([[0], np.cumsum(seq_lens)]).tolist()
+    buffer = arrays[f"{prefix}_seqs"].tobytes()
+    as_bytes = bool(arrays[f"{prefix}_seqs_are_bytes"])
+    has_profile = arrays[f"{prefix}_has_profile"].tolist()
+    profiles = arrays[f"{prefix}_profiles"]
+    profile_offset = 0
+    sites: dict[int, AlignmentDetails] = {}
+    columns = zip(arrays[f"{prefix}_positions"].tolist(), arrays[f"{prefix}_counts"].tolist(),
+                  arrays[f"{prefix}_sc_lens"].tolist(), arrays[f"{prefix}_junctions"].tolist(),
+                  arrays[f"{prefix}_ref_starts"].tolist())
+    for i, (pos, count, sc_len, junction, ref_start) in enumerate(columns):
+        seq = buffer[offsets[i]:offsets[i + 1]]
+        profile = None
+        if has_profile[i]:
+            profile = profiles[profile_offset:profile_offset + len(seq)].copy()
+            profile_offset += len(seq)
+        sites[pos] = AlignmentDetails(seq if as_bytes else seq.decode("ascii"), sc_len, count, junction, ref_start, profile)
+    return sites
+
+class CheckpointCache:
+    """On-disk cache of intermediate stage results, stored as uncompressed .npz files named by their cache key.
+    Entries are written to a temporary file and renamed, so an interrupted run never leaves a partial entry behind.
+
+    Args:
+        cache_dir (str): directory holding the cache entries, created on first write
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{kind}-{key}.npz")
+
+    def _load(self, kind: str, key: str):
+        path = self.path(kind, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as arrays:
+                return {name: arrays[name] for name in arrays.files}
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            logger.warning("Ignoring unreadable cache entry %s: %s", path, e)
+            return None
+
+    def _save(self, kind: str, key: str, arrays: dict[str, np.ndarray]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(kind, key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_soft_clips(self, key: str) -> tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], ScanStats] | None:
+        """Loads the soft-clip tables of an earlier scan
+
+        Args:
+            key (str): cache key of the scan
+
+        Returns:
+            tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], ScanStats] | None: the start and end soft-clip
+            dictionaries and the stats of the original scan, or None if there is no usable entry
+        """
+        arrays = self._load("softclips", key)
+        if arrays is None:
+            return None
+        stats = ScanStats(int(arrays["scan_reads"]), float(arrays["scan_seconds"]), int(arrays["scan_filtered"]))
+        return _unpack_sites("start", arrays), _unpack_sites("end", arrays), stats
+
+    def save_soft_clips(self, key: str, start_scr: dict[int, AlignmentDetails], end_scr: dict[int, AlignmentDetails], stats: ScanStats) -> None:
+        """Stores the soft-clip tables of a scan
+
+        Args:
+            key (str): cache key of the scan
+            start_scr (dict[int, AlignmentDetails]): the starting soft-clips
+            end_scr (dict[int, AlignmentDetails]): the ending soft-clips
+            stats (ScanStats): read count and duration of the scan
+        """
+        arrays = {"scan_reads": np.array(stats.reads), "scan_seconds": np.array(stats.seconds), "scan_filtered": np.array(stats.filtered)}
+        _pack_sites("start", start_scr, arrays)
+        _pack_sites("end", end_scr, arrays)
+        self._save("softclips", key, arrays)
+
+    def load_pairs(self, key: str) -> np.ndarray | None:
+        """Loads the scored soft-clip pairs of an earlier run
+
+        Args:
+            key (str): cache key of the pairing and alignment stage
+
+        Returns:
+            np.ndarray | None: CANDIDATE_DTYPE rows in the order align_soft_clips yielded them, or None if there is no usable entry
+        """
+        arrays = self._load("pairs", key)
+        if arrays is None:
+            return None
+        return arrays["rows"].astype(CANDIDATE_DTYPE, copy=False)
+
+    def record_pairs(self, key: str, tables: Iterable[CandidateTable]) -> Iterator[CandidateTable]:
+        """Passes the scored pairs through unchanged and stores them once the stage has been fully consumed
+
+        Args:
+            key (str): cache key of the pairing and alignment stage
+            tables (Iterable[CandidateTable]): candidate tables yielded by align_soft_clips
+
+        Yields:
+            Iterator[CandidateTable]: the same tables
+        """
+        chunks = []
+        for table in tables:
+            chunks.append(table.rows.copy())
+            yield table
+        self._save("pairs", key, {"rows": np.concatenate(chunks) if chunks else np.empty(0, dtype=CANDIDATE_DTYPE)})
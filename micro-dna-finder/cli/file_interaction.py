@@ -1,17 +1,20 @@
 import pysam
 import csv
+from itertools import chain
+from typing import Iterable
 from beautiful_printer import status_message
 
-def load_bam(bam_path: str) -> pysam.AlignmentFile:
+def load_bam(bam_path: str, threads: int = 1) -> pysam.AlignmentFile:
     """Loads BAM file specified by user into memory
 
     Args:
         bam_path (str): path and filename to be loaded
+        threads (int, optional): number of htslib threads decompressing BGZF blocks. Defaults to 1.
 
     Returns:
         pysam.AlignmentFile: processed bam Alignment File
     """
-    return pysam.AlignmentFile(bam_path, "rb")
+    return pysam.AlignmentFile(bam_path, "rb", threads=threads)
 
 def load_fasta(fasta_path: str) -> str:
     """Loads Fasta file specified by user into memory
@@ -27,17 +30,24 @@ def load_fasta(fasta_path: str) -> str:
     return fasta.fetch(contig)
 
 @status_message("Saving results to txt file")
-def save_results_txt(results: list, filename: str) -> None:
-    """Writes results to a txt file in a human-readable format
+def save_results_txt(results: Iterable[dict], filename: str) -> int:
+    """Writes results to a txt file in a human-readable format, one candidate at a time as they arrive
 
     Args:
-        results (list): list of dictionaries containing high evidence of a circular DNA sequence
+        results (Iterable[dict]): dictionaries containing high evidence of a circular DNA sequence
         filename (str): path and filename to be saved (txt format)
+
+    Returns:
+        int: number of candidates written
     """
+    n_written = 0
     with open(filename, "w") as f:
         for r in results:
+            n_written += 1
             f.write("COMPARING SOFT CLIPS\n")
-            f.write(f"Start: {r['start_pos']} End: {r['end_pos']}\n")
+            f.write(f"Contig: {r['contig']} Start: {r['start_pos']} End: {r['end_pos']}\n")
+            if 'start_members' in r:
+                f.write(f"Start members: {r['start_members']} End members: {r['end_members']}\n")
             f.write(f"Score: {r['read_read_score']}\n")
             f.write(str(r['read_read_alignment']) + "\n")
 
@@ -50,17 +60,24 @@ def save_results_txt(results: list, filename: str) -> None:
             f.write(str(r['end_ref_alignment']) + "\n")
             f.write(f"Evidence Score: {r['evidence_score']}\n")
             f.write("-" * 75 + "\n\n")
-            
+    return n_written
+
 @status_message("Saving results to tsv/csv file")
-def save_results_sv(results: list, filename: str) -> None:
+def save_results_sv(results: Iterable[dict], filename: str) -> int:
     """Writes results to a tsv file in a human-readable format, but more optimized for machine readability.
     Doesn't include the alignment information, but includes the scores and positions.
+    Rows are written one at a time as they arrive.
 
     Args:
-        results (list): list of dictionaries containing high evidence of a circular DNA sequence
+        results (Iterable[dict]): dictionaries containing high evidence of a circular DNA sequence
         filename (str): path and filename to be saved (tsv or csv format)
+
+    Returns:
+        int: number of candidates written
     """
+    n_written = 0
     fieldnames = [
+        "contig",
         "start_pos",
         "end_pos",
         "read_read_score",
@@ -68,6 +85,13 @@ def save_results_sv(results: list, filename: str) -> None:
         "end_ref_score",
         "evidence_score",
     ]
+    # Candidates of clustered sites also list the positions each site stands for
+    results = iter(results)
+    first = next(results, None)
+    if first is not None:
+        results = chain([first], results)
+        if "start_members" in first:
+            fieldnames += ["start_members", "end_members"]
     # Write the results to a CSV or TSV file
     if filename.endswith('.csv'):
         with open(filename, "w", newline='') as csvfile:
@@ -75,12 +99,15 @@ def save_results_sv(results: list, filename: str) -> None:
             writer.writeheader()
             for r in results:
                 writer.writerow({field: r.get(field, "") for field in fieldnames})
+                n_written += 1
     else:
         with open(filename, "w", newline='') as tsvfile:
             writer = csv.DictWriter(tsvfile, fieldnames=fieldnames, delimiter='\t')
             writer.writeheader()
             for r in results:
                 writer.writerow({field: r.get(field, "") for field in fieldnames})
+                n_written += 1
+    return n_written
 
 def clear_file(filename: str) -> None:
     """Clears the contents of a file
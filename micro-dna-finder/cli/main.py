@@ -1,9 +1,204 @@
 from utils import *
 from file_interaction import *
+from seeding import SeedFilter
+from alignment_models import ScanOptions, ScanStats, SiteTable, CandidateTable
+from beautiful_printer import print_progress, print_summary, set_progress_mode, PROGRESS_MODES
+from metrics import RunMetrics
+from checkpoint import CheckpointCache, bam_identity, cache_key
+from reference_store import ReferenceGenome
+from online import OnlineJunctionDetector
+from aligners import BACKENDS, usable_backends
 
 import argparse
+import os
 from colorama import Fore
 
+def add_scan_args(parser: argparse.ArgumentParser) -> None:
+    """Adds the options controlling which reads are scanned and which soft-clip sites are kept
+
+    Args:
+        parser (argparse.ArgumentParser): the parser to extend
+    """
+    parser.add_argument('--bam_threads',
+                        default=1,
+                        type=int,
+                        help='Number of htslib threads decompressing the BAM file, per scanning process (default: 1)')
+    parser.add_argument('--exclude_flags',
+                        default=0,
+                        type=lambda value: int(value, 0),
+                        help='Skip reads with any of these SAM flag bits set, before their CIGAR is inspected, e.g. 0xD04 for unmapped, '
+                             'secondary, duplicate and supplementary reads, which also speeds up the scan (default: 0, keep every read)')
+    parser.add_argument('--min_mapq',
+                        default=0,
+                        type=int,
+                        help='Skip reads with a lower mapping quality (default: 0)')
+    parser.add_argument('--sketch_width',
+                        default=0,
+                        type=int,
+                        help='Count soft-clip sites in a Count-Min sketch of 4 rows of this many counters (a power of two, e.g. 4194304) and only '
+                             'store sites whose estimate reaches --min_support; counts may be overestimated where sites collide (default: 0, no sketch)')
+    parser.add_argument('--sketch_exact',
+                        action='store_true',
+                        help='With --sketch_width, read the BAM file a second time to count the stored sites exactly, so results match a scan without the sketch')
+    parser.add_argument('--anchor_len',
+                        default=None,
+                        type=int,
+                        help='Store only the clipped bases plus this many aligned bases per site instead of the whole read (default: whole read)')
+    parser.add_argument('--consensus',
+                        action='store_true',
+                        help='Align the consensus of all supporting reads at each site instead of the first read (requires --anchor_len)')
+    parser.add_argument('--min_support',
+                        default=10,
+                        type=int,
+                        help='Minimum number of reads supporting a soft-clip site (default: 10)')
+
+def add_pairing_args(parser: argparse.ArgumentParser) -> None:
+    """Adds the options controlling which soft-clip sites are paired
+
+    Args:
+        parser (argparse.ArgumentParser): the parser to extend
+    """
+    parser.add_argument('--cluster_tolerance',
+                        default=0,
+                        type=int,
+                        help='Merge high-support sites within this many bp of a neighbour into the best-supported one, which is aligned '
+                             'with the summed support and reports the member positions (default: 0, no clustering)')
+    parser.add_argument('--min_span',
+                        default=6,
+                        type=int,
+                        help='Minimum distance between paired start and end soft-clips (default: 6)')
+    parser.add_argument('--max_span',
+                        default=None,
+                        type=int,
+                        help='Maximum distance between paired start and end soft-clips; a limit such as 2000 only aligns the pairs inside '
+                             'that window, which is much faster on large contigs but drops longer candidates (default: no limit)')
+    parser.add_argument('--min_read_score',
+                        default=MIN_READ_SCORE,
+                        type=float,
+                        help='Soft-clip alignment score a pair must exceed to be aligned with the reference; with --anchor_len it can reach '
+                             'at most 4 * anchor_len, so short anchors need a lower cutoff (default: %(default)s)')
+    parser.add_argument('--seed_k',
+                        default=None,
+                        type=int,
+                        help='Length of the k-mer seeds a soft-clip pair must share before it is aligned (default: disabled)')
+    parser.add_argument('--min_seeds',
+                        default=1,
+                        type=int,
+                        help='Minimum number of shared k-mer seeds when --seed_k is set (default: 1)')
+
+def add_scoring_args(parser: argparse.ArgumentParser) -> None:
+    """Adds the options controlling how pairs are scored and how many candidates are reported
+
+    Args:
+        parser (argparse.ArgumentParser): the parser to extend
+    """
+    parser.add_argument('--workers',
+                        default=1,
+                        type=int,
+                        help='Number of worker processes used to scan the BAM file and align soft-clips (default: 1)')
+    parser.add_argument('--packed_reference',
+                        action='store_true',
+                        help='Memory-map 2-bit packed copies of the reference contigs, built next to the FASTA file on first use, instead of fetching windows from the FASTA file')
+    parser.add_argument('--ref_cache_size',
+                        default=65536,
+                        type=int,
+                        help='Maximum number of cached reference alignments, 0 to disable (default: 65536)')
+    parser.add_argument('--ref_scoring',
+                        default='gapped',
+                        choices=['gapped', 'ungapped', 'compare'],
+                        help='Reference alignment scoring: the gapped aligner for every site, an ungapped NumPy score wherever it is provably optimal '
+                             'with the gapped aligner for the rest, or both paths for every site with disagreements counted (default: gapped)')
+    parser.add_argument('--sc_backend',
+                        default=None,
+                        choices=list(BACKENDS),
+                        help='Aligner backend scoring the soft-clip pairs, overriding --autotune for them; it is checked against Biopython on the first pairs '
+                             'and replaced by Biopython if its scores differ by more than --autotune_tolerance (default: biopython)')
+    parser.add_argument('--ref_backend',
+                        default=None,
+                        choices=list(BACKENDS),
+                        help='Aligner backend scoring the reference windows, overriding --autotune for them, checked like --sc_backend (default: biopython)')
+    parser.add_argument('--autotune',
+                        action='store_true',
+                        help='Time every installed aligner backend on the first pairs of each alignment step and score the rest with the fastest '
+                             'one whose scores agree with Biopython within --autotune_tolerance')
+    parser.add_argument('--autotune_tolerance',
+                        default=0.0,
+                        type=float,
+                        help='Largest score difference from Biopython an autotuned or pinned backend may show on the first pairs; 0 keeps results identical (default: 0)')
+    parser.add_argument('--top_k',
+                        default=None,
+                        type=int,
+                        help='Only keep the K candidates with the highest evidence score (default: keep all)')
+
+def add_pipeline_args(parser: argparse.ArgumentParser) -> None:
+    """Adds the options controlling how a sample is processed, shared by main.py and batch.py
+
+    Args:
+        parser (argparse.ArgumentParser): the parser to extend
+    """
+    add_scan_args(parser)
+    add_pairing_args(parser)
+    add_scoring_args(parser)
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Write candidates as soon as they are scored, in discovery order rather than sorted by evidence score; '
+                             'cannot be combined with --top_k, which needs every candidate before the first is written')
+    parser.add_argument('--online',
+                        action='store_true',
+                        help='Pair and score soft-clip sites while the BAM file is read, as soon as the scan is --max_span past them, '
+                             'so memory is bounded by the span window rather than the contig; bypasses the checkpoint cache')
+    parser.add_argument('--block_size',
+                        default=1_000_000,
+                        type=int,
+                        help='Length in base pairs of the blocks read between two online pairing rounds (default: 1000000)')
+    parser.add_argument('--cache_dir',
+                        default=None,
+                        type=str,
+                        help='Directory of the checkpoint cache of soft-clip tables (default: .micro_dna_cache next to the output file)')
+    parser.add_argument('--no_cache',
+                        action='store_true',
+                        help='Neither read nor write the checkpoint cache')
+    parser.add_argument('--cache_pairs',
+                        action='store_true',
+                        help='Also cache the scored soft-clip pairs, so reruns that only change reference-alignment or reporting options skip pairing')
+
+def check_pipeline_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Rejects combinations of the options added by add_pipeline_args, or by any of its groups, that cannot work together
+
+    Args:
+        parser (argparse.ArgumentParser): the parser, which reports the error and exits
+        args (argparse.Namespace): the parsed options
+    """
+    if getattr(args, 'consensus', False) and args.anchor_len is None:
+        parser.error('--consensus requires --anchor_len')
+    if getattr(args, 'min_span', 1) < 1:
+        parser.error('--min_span must be at least 1, so an end soft-clip lies after the start soft-clip it is paired with')
+    read_score_limit = max_read_score(getattr(args, 'anchor_len', None))
+    if read_score_limit is not None and getattr(args, 'min_read_score', None) is not None and args.min_read_score >= read_score_limit:
+        parser.error(f'--min_read_score {args.min_read_score:g} cannot be reached with --anchor_len {args.anchor_len}, '
+                     f'whose segments score at most {read_score_limit:g}')
+    seed_k = getattr(args, 'seed_k', None)
+    if seed_k is not None and not 1 <= seed_k <= 32:
+        parser.error('--seed_k must be between 1 and 32, as seeds are packed into 64-bit integers')
+    if getattr(args, 'min_seeds', 1) < 1:
+        parser.error('--min_seeds must be at least 1')
+    sketch_width = getattr(args, 'sketch_width', 0)
+    if sketch_width and sketch_width & (sketch_width - 1):
+        parser.error('--sketch_width must be a power of two')
+    if getattr(args, 'sketch_exact', False) and not sketch_width:
+        parser.error('--sketch_exact requires --sketch_width')
+    if getattr(args, 'stream', False) and args.top_k is not None:
+        parser.error('--stream cannot be combined with --top_k, as the best candidates are only known once every contig is scored')
+    if getattr(args, 'online', False) and args.max_span is None:
+        parser.error('--online requires --max_span, which bounds the window of sites it holds')
+    if getattr(args, 'online', False) and args.cache_pairs:
+        parser.error('--online does not use the checkpoint cache, so --cache_pairs has no effect with it')
+    for option, params in (('--sc_backend', SC_ALIGNER_PARAMS), ('--ref_backend', REF_ALIGNER_PARAMS)):
+        name = getattr(args, option[2:], None)
+        if name is not None and name not in usable_backends(params):
+            reason = 'is not installed' if not BACKENDS[name].available() else 'cannot express this scoring scheme'
+            parser.error(f'{option} {name} {reason}')
+
 def get_args():
     """Handles CLI arguments
 
@@ -29,28 +224,240 @@ def get_args():
                         type=str,
                         required=True,
                         help='Output file in txt, tsv, or csv format')
-    return parser.parse_args()
+    add_pipeline_args(parser)
+    parser.add_argument('--progress',
+                        default='plain',
+                        choices=PROGRESS_MODES,
+                        help='Progress output: stage messages with elapsed time, animated dots from a background thread, or nothing (default: plain)')
+    parser.add_argument('--metrics_json',
+                        default=None,
+                        type=str,
+                        help='Write per-stage wall/CPU time, the peak RSS so far and item counts to this JSON file')
+    parser.add_argument('--profile',
+                        default=None,
+                        type=str,
+                        help='Directory to write a cProfile dump of every stage to, as <stage>.prof (worker processes are not profiled)')
+    args = parser.parse_args()
+    check_pipeline_args(parser, args)
+    return args
+
+def load_reference(args: argparse.Namespace, fasta_path: str) -> ReferenceGenome:
+    """Opens the reference, fetching contigs lazily from the FASTA index or mapping their packed copies with --packed_reference
+
+    Args:
+        args (argparse.Namespace): the options added by add_pipeline_args
+        fasta_path (str): path of the indexed FASTA file
+
+    Returns:
+        ReferenceGenome: every contig of the reference, opened on demand
+    """
+    return ReferenceGenome(fasta_path, packed=args.packed_reference)
+
+def describe_backend(engine: AlignmentEngine, params: dict) -> str:
+    """Formats the backend an engine scored a scheme with, for the run summary"""
+    choice = engine.backend_choice(params)
+    if choice is not None:
+        return choice.describe()
+    sampled = engine.sampled_pairs(params)
+    return f"biopython ({sampled} pairs scored, too few to check other backends)" if sampled else "not used"
+
+def run_sample(args: argparse.Namespace, bam_file: str, output_file: str, reference: ReferenceGenome, metrics: RunMetrics) -> dict[str, object]:
+    """Runs the whole pipeline for one BAM file against an already opened reference, one contig at a time,
+    so only the soft-clip tables of a single contig are held in memory
+
+    Args:
+        args (argparse.Namespace): the options added by add_pipeline_args
+        bam_file (str): path of the sorted, indexed BAM file
+        output_file (str): output file in txt, tsv, or csv format
+        reference (ReferenceGenome): the reference genome
+        metrics (RunMetrics): collects the per-stage metrics of the run
+
+    Returns:
+        dict[str, object]: throughput and filtering statistics of the run, for print_summary
+    """
+    bam = load_bam(bam_file, args.bam_threads)
+    clear_file(output_file)
+    contigs = get_sample_contigs(bam, reference)
+    scan_options = ScanOptions(args.anchor_len, args.consensus, args.exclude_flags, args.min_mapq,
+                               sketch_width=args.sketch_width, sketch_min_count=args.min_support, sketch_exact=args.sketch_exact)
+    cache = None
+    if not args.no_cache:
+        cache = CheckpointCache(args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(output_file)), ".micro_dna_cache"))
+    bam_key = bam_identity(bam_file)
+    seed_filter = SeedFilter(args.seed_k, args.min_seeds) if args.seed_k else None
+    ref_cache = ReferenceAlignmentCache(args.ref_cache_size) if args.ref_cache_size > 0 else None
+    ungapped = None
+    if args.ref_scoring != 'gapped':
+        ungapped = UngappedScorer.from_params(REF_ALIGNER_PARAMS, compare=args.ref_scoring == 'compare')
+    # A sketched scan only stores the sites that may reach --min_support, so its tables depend on it
+    sketch_params = [args.sketch_width, args.min_support, args.sketch_exact] if args.sketch_width else None
+    scan_stats = ScanStats()
+    cached_scans = cached_pairs = 0
+    online_batches: list[int] = []
+    peak_sites: list[int] = []
+
+    def process_contig(name: str) -> tuple[Iterator[CandidateTable], SiteTable, SiteTable]:
+        nonlocal cached_scans, cached_pairs
+        # Locate start and end soft-clips in a single pass over the reads of the contig
+        scan_key = cache_key(bam_key, {"anchor_len": args.anchor_len, "consensus": args.consensus, "exclude_flags": args.exclude_flags,
+                                       "min_mapq": args.min_mapq, "contig": name, "sketch": sketch_params})
+        with metrics.stage("scan"):
+            cached_scan = cache.load_soft_clips(scan_key) if cache is not None else None
+            if cached_scan is not None:
+                # No reads are read for a cached contig, so it stays out of the scan totals and throughput
+                start_soft_clips, end_soft_clips, _ = cached_scan
+                cached_scans += 1
+                metrics.count("contigs_from_cache", 1)
+            else:
+                if args.workers > 1:
+                    start_soft_clips, end_soft_clips, contig_stats = find_soft_clips_parallel(bam_file, args.workers, options=scan_options, contig=name,
+                                                                                              threads=args.bam_threads, executor=engine.executor)
+                else:
+                    start_soft_clips, end_soft_clips, contig_stats = find_soft_clips(bam, scan_options, name)
+                if cache is not None:
+                    cache.save_soft_clips(scan_key, start_soft_clips, end_soft_clips, contig_stats)
+                scan_stats.reads += contig_stats.reads
+                scan_stats.seconds += contig_stats.seconds
+                scan_stats.filtered += contig_stats.filtered
+                metrics.count("reads_scanned", contig_stats.reads)
+                metrics.count("reads_filtered", contig_stats.filtered)
+            metrics.count("soft_clip_sites", len(start_soft_clips) + len(end_soft_clips))
+        # Filter high support sites
+        with metrics.stage("filter_sites"):
+            start_hsc = find_high_support_sites(start_soft_clips, args.min_support)
+            end_hsc = find_high_support_sites(end_soft_clips, args.min_support)
+            metrics.count("high_support_sites", len(start_hsc) + len(end_hsc))
+        del start_soft_clips, end_soft_clips
+        # Collapse neighbouring sites of the same breakpoint, so only their representatives are aligned
+        start_members = end_members = None
+        if args.cluster_tolerance:
+            with metrics.stage("cluster_sites"):
+                start_hsc, start_members = cluster_sites(start_hsc, args.cluster_tolerance)
+                end_hsc, end_members = cluster_sites(end_hsc, args.cluster_tolerance)
+                metrics.count("site_clusters", len(start_hsc) + len(end_hsc))
+        start_sites = SiteTable.from_sites(start_hsc, name, start_members)
+        end_sites = SiteTable.from_sites(end_hsc, name, end_members)
+        # Align soft-clips with each other. The alignment stages are generators of candidate tables, so pairs
+        # stream through them chunk by chunk and their work is measured in whichever stage consumes them.
+        # Scored pairs only depend on the soft-clip tables and the pairing parameters, which the key covers
+        # Backends other than Biopython may score within --autotune_tolerance of it, so they are part of the key
+        sc_scoring = [args.sc_backend, args.autotune_tolerance if args.autotune or args.sc_backend else None]
+        pairs_key = cache_key(scan_key, args.min_support, args.cluster_tolerance, args.min_span, args.max_span, args.seed_k, args.min_seeds, SC_ALIGNER_PARAMS, sc_scoring)
+        pairs = cache.load_pairs(pairs_key) if cache is not None and args.cache_pairs else None
+        if pairs is not None:
+            aligned_sc = iter([CandidateTable(pairs, start_sites, end_sites)])
+            cached_pairs += 1
+        else:
+            aligned_sc = align_soft_clips(start_sites, end_sites, args.min_span, args.max_span, seed_filter, engine)
+            if cache is not None and args.cache_pairs:
+                aligned_sc = cache.record_pairs(pairs_key, aligned_sc)
+        aligned_sc = metrics.counted(aligned_sc, "pairs_aligned")
+        # Score the candidates by aligning soft-clips with the contig
+        tables = generate_final_results(aligned_sc, reference.contig(name), ref_cache, engine, ungapped, args.min_read_score)
+        return metrics.counted(tables, "candidates_scored"), start_sites, end_sites
+
+    def online_contig(name: str) -> Iterator[CandidateTable]:
+        detector = OnlineJunctionDetector(args.min_support, args.min_span, args.max_span, scan_options, seed_filter, args.block_size, args.cluster_tolerance,
+                                          args.min_read_score)
+        tables = detector.run(bam, name, reference.contig(name), engine, ref_cache, ungapped)
+        yield from metrics.counted(tables, "candidates_scored")
+        scan_stats.reads += detector.stats.reads
+        scan_stats.seconds += detector.stats.seconds
+        scan_stats.filtered += detector.stats.filtered
+        metrics.count("reads_scanned", detector.stats.reads)
+        metrics.count("reads_filtered", detector.stats.filtered)
+        metrics.count("high_support_sites", detector.high_support_sites)
+        if args.cluster_tolerance:
+            metrics.count("site_clusters", detector.site_clusters)
+        metrics.count("pairs_aligned", detector.pairs_aligned)
+        online_batches.append(detector.batches)
+        peak_sites.append(detector.peak_sites)
+
+    def stream_contigs() -> Iterator[dict]:
+        for name in contigs:
+            tables = online_contig(name) if args.online else process_contig(name)[0]
+            for table in tables:
+                yield from table.records()
+
+    with AlignmentEngine(args.workers, autotune=args.autotune, tolerance=args.autotune_tolerance) as engine:
+        if args.sc_backend is not None:
+            engine.use_backend(SC_ALIGNER_PARAMS, args.sc_backend)
+        if args.ref_backend is not None:
+            engine.use_backend(REF_ALIGNER_PARAMS, args.ref_backend)
+        if args.stream:
+            # Every contig is processed while its candidates are written, in discovery order
+            results = stream_contigs()
+        else:
+            # Each contig is ranked on its own and the rankings merged, which orders candidates like one sort over the genome
+            ranked = []
+            for name in contigs:
+                if len(contigs) > 1:
+                    print_progress(f"Contig {name}")
+                if args.online:
+                    # Every batch of the online detector has its own site tables, so batches are ranked one by one
+                    with metrics.stage("online_scan"):
+                        ranked.extend(rank_each(online_contig(name), args.top_k))
+                    continue
+                tables, start_sites, end_sites = process_contig(name)
+                with metrics.stage("align_and_rank"):
+                    ranked.append(rank_candidates(tables, start_sites, end_sites, args.top_k))
+            n_kept = sum(len(table) for table in ranked)
+            metrics.count("candidates_kept", n_kept if args.top_k is None else min(n_kept, args.top_k))
+            results = merge_ranked(ranked, args.top_k)
+        n_reported = 0
+        with metrics.stage("write"):
+            if output_file.endswith('.tsv') or output_file.endswith('.csv'):
+                n_reported = save_results_sv(results, output_file)
+            elif output_file.endswith('.txt'):
+                n_reported = save_results_txt(materialize_alignments(results, reference), output_file)
+            metrics.count("candidates_reported", n_reported)
+    # Report throughput and filtering statistics for the run
+    summary = {
+        "Contigs processed": len(contigs),
+        "Reads scanned": f"{scan_stats.reads} in {scan_stats.seconds:.2f}s ({scan_stats.reads_per_sec:,.0f} reads/sec)",
+        "Reads filtered by flag or MAPQ": scan_stats.filtered,
+    }
+    if args.cluster_tolerance:
+        summary["Site clusters"] = (f"{metrics.totals.get('high_support_sites', 0)} high-support sites collapsed into "
+                                    f"{metrics.totals.get('site_clusters', 0)} within {args.cluster_tolerance} bp")
+    if args.sketch_width:
+        summary["Count-Min sketch"] = (f"{scan_options.sketch_depth} x {args.sketch_width} counters ({scan_options.sketch_depth * args.sketch_width * 4 / 2**20:.1f} MB per scan), "
+                                       f"{'exact recount' if args.sketch_exact else 'approximate counts'}")
+    if online_batches:
+        summary["Online detection"] = f"{sum(online_batches)} batches, at most {max(peak_sites)} sites held at once"
+    if cached_scans:
+        summary["Soft-clip tables"] = f"{cached_scans} of {len(contigs)} contigs loaded from {cache.cache_dir}, not counted as scanned"
+    if cached_pairs:
+        summary["Scored pairs"] = f"{cached_pairs} of {len(contigs)} contigs loaded from {cache.cache_dir}"
+    if seed_filter is not None:
+        summary["Pairs removed by seed filter"] = f"{seed_filter.removed} of {seed_filter.checked}"
+    if ref_cache is not None:
+        summary["Reference alignment cache"] = (f"{ref_cache.hits} hits, {ref_cache.misses} misses, "
+                                                f"{ref_cache.chunk_repeats} sites repeated within a chunk")
+    if ungapped is not None:
+        summary["Ungapped reference scores"] = f"{ungapped.exact} of {ungapped.scored} provably optimal, {ungapped.fallback} aligned with gaps"
+        if ungapped.compare:
+            summary["Ungapped reference scores"] += f", {ungapped.disagreements} disagreements"
+    if args.autotune or args.sc_backend or args.ref_backend:
+        summary["Aligner backends"] = "; ".join(f"{label} {describe_backend(engine, params)}" for label, params in
+                                                (("soft-clip pairs:", SC_ALIGNER_PARAMS), ("reference windows:", REF_ALIGNER_PARAMS)))
+    summary["Candidates reported"] = n_reported
+    bam.close()
+    return summary
 
 def main():
     args = get_args()
+    set_progress_mode(args.progress)
+    metrics = RunMetrics(args.profile)
     # Load in files for analysis
-    bam = load_bam(args.bam_file)
-    contig = load_fasta(args.fasta_file)
-    clear_file(args.output_file)
-    # Locate start soft-clips and filter high support sites
-    start_soft_clips = find_soft_clips(bam, start=True)
-    start_hsc = find_high_support_sites(start_soft_clips)
-    # Locate end soft-clips and filter high support sites
-    end_soft_clips = find_soft_clips(bam, start=False)
-    end_hsc = find_high_support_sites(end_soft_clips)
-    # Align soft-clips with each other
-    aligned_sc = align_soft_clips(start_hsc, end_hsc)
-    # Generate final results by aligning soft-clips with contig and sorting
-    results = generate_final_results(aligned_sc, contig)
-    if args.output_file.endswith('.tsv') or args.output_file.endswith('.csv'):
-        save_results_sv(results, args.output_file)
-    elif args.output_file.endswith('.txt'):
-        save_results_txt(results, args.output_file)
+    with metrics.stage("load"):
+        reference = load_reference(args, args.fasta_file)
+    summary = run_sample(args, args.bam_file, args.output_file, reference, metrics)
+    if args.metrics_json or args.profile:
+        summary.update(metrics.summary_rows())
+    print_summary("Run summary", summary)
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,147 @@
+import cProfile
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+@dataclass(slots=True)
+class StageMetrics:
+    """Resources used by one stage of a run. CPU time of worker processes is only counted once the
+    pool they belong to has shut down, so it lands in the stage that closes the pool. The OS only reports
+    the peak RSS of the whole process, so max_rss_so_far_mb is the peak reached by the end of the stage,
+    which may have been set by an earlier one"""
+    name: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    child_cpu_seconds: float = 0.0
+    max_rss_so_far_mb: float = 0.0
+    items: dict[str, int] = field(default_factory=dict)
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+def _child_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class RunMetrics:
+    """Collects per-stage wall and CPU time, the process's peak RSS so far and item counts for a run,
+    and optionally dumps a cProfile of every stage. A stage entered several times, e.g. once per contig, accumulates
+    into one record. Stages may be nested; the enclosing stage's time includes the nested one, while
+    item counts and profiles go to the innermost stage.
+
+    Args:
+        profile_dir (str | None, optional): directory for the <stage>.prof cProfile dumps, or None to skip profiling. Defaults to None.
+    """
+    def __init__(self, profile_dir: str | None = None):
+        self.profile_dir = profile_dir
+        self.stages: list[StageMetrics] = []
+        self.totals: dict[str, int] = {}
+        # Time spent in outermost stages, so nested stages are not counted twice
+        self.wall_seconds = 0.0
+        self._records: dict[str, StageMetrics] = {}
+        self._profilers: dict[str, cProfile.Profile] = {}
+        self._active: list[StageMetrics] = []
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """Measures the block as one stage of the run
+
+        Args:
+            name (str): name of the stage, also the file name of its cProfile dump
+
+        Yields:
+            Iterator[StageMetrics]: the metrics of the stage, filled in when the block exits
+        """
+        record = self._records.get(name)
+        if record is None:
+            record = self._records[name] = StageMetrics(name)
+            self.stages.append(record)
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+            if self._active:
+                self._profilers[self._active[-1].name].disable()
+        self._active.append(record)
+        wall, cpu, child_cpu = time.perf_counter(), time.process_time(), _child_cpu_seconds()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+            elapsed = time.perf_counter() - wall
+            record.wall_seconds += elapsed
+            record.cpu_seconds += time.process_time() - cpu
+            record.child_cpu_seconds += _child_cpu_seconds() - child_cpu
+            record.max_rss_so_far_mb = _peak_rss_mb()
+            self._active.pop()
+            if not self._active:
+                self.wall_seconds += elapsed
+            if profiler is not None and self._active:
+                self._profilers[self._active[-1].name].enable()
+
+    def count(self, name: str, amount: int) -> None:
+        """Adds to an item count of the run and of the stage currently running
+
+        Args:
+            name (str): name of the count, e.g. reads_scanned
+            amount (int): number of items to add
+        """
+        self.totals[name] = self.totals.get(name, 0) + amount
+        if self._active:
+            self._active[-1].items[name] = self._active[-1].items.get(name, 0) + amount
+
+    def counted(self, items: Iterable[T], name: str, size: Callable[[T], int] = len) -> Iterator[T]:
+        """Passes items through unchanged while counting them. Lazy stages are counted in whichever
+        stage ends up consuming them
+
+        Args:
+            items (Iterable[T]): the items, e.g. candidate tables yielded by a generator stage
+            name (str): name of the count
+            size (Callable[[T], int], optional): number of items each element stands for. Defaults to len.
+
+        Yields:
+            Iterator[T]: the same items
+        """
+        for item in items:
+            self.count(name, size(item))
+            yield item
+
+    def summary_rows(self) -> dict[str, str]:
+        """Formats one line per stage for print_summary
+
+        Returns:
+            dict[str, str]: stage name to its wall time, CPU time, peak RSS so far and item counts
+        """
+        rows = {}
+        for s in self.stages:
+            counts = "".join(f", {n} {k.replace('_', ' ')}" for k, n in s.items.items())
+            rows[f"Stage {s.name}"] = (f"{s.wall_seconds:.2f}s wall, {s.cpu_seconds + s.child_cpu_seconds:.2f}s CPU, "
+                                       f"max RSS so far {s.max_rss_so_far_mb:.0f} MB{counts}")
+        return rows
+
+    def write_json(self, path: str) -> None:
+        """Writes the per-stage metrics and run totals as JSON
+
+        Args:
+            path (str): output path
+        """
+        with open(path, "w") as f:
+            json.dump({
+                "stages": [asdict(s) for s in self.stages],
+                "totals": self.totals,
+                "wall_seconds": self.wall_seconds,
+                "peak_rss_mb": _peak_rss_mb(),
+            }, f, indent=2)
@@ -0,0 +1,149 @@
+import time
+import pysam
+from collections import deque
+from typing import Iterator
+from alignment_models import AlignmentDetails, ScanOptions, ScanStats, SiteTable, CandidateTable
+from reference_store import FastaContig, PackedReference
+from seeding import SeedFilter
+from ungapped import UngappedScorer
+from utils import _scan_reads, align_soft_clips, generate_final_results, merge_cluster, split_clusters, AlignmentEngine, ReferenceAlignmentCache, MIN_READ_SCORE
+
+# A site of the detector's window: 1-based position, details, and member positions when sites are clustered
+Site = tuple[int, AlignmentDetails, list[int] | None]
+
+class OnlineJunctionDetector:
+    """Finds candidates while a contig of a coordinate-sorted BAM file is being read, instead of after the whole scan.
+    Sites are keyed by the start position of their reads, so a site is complete as soon as the scan has moved past
+    its position, and a starting site has all its partners once the scan is max_span past it. The contig is read
+    block by block; after each block the complete low-support sites are dropped, the starting sites out of reach of
+    any further read are paired, scored and yielded, and the ending sites no pending starting site can reach are
+    dropped. Only the sites of the last max_span bases plus one block are held, whatever the size of the contig.
+    With cluster_tolerance set, sites are clustered like cluster_sites once no later site can join their cluster,
+    and only the representatives enter the window.
+
+    Candidates come out in the same order as from align_soft_clips and generate_final_results over the whole contig,
+    but every batch refers to its own site tables.
+
+    Args:
+        min_support (int): minimum number of reads supporting a site
+        min_span (int): minimum distance between paired start and end soft-clips, inclusive
+        max_span (int): maximum distance between paired start and end soft-clips, inclusive
+        options (ScanOptions | None, optional): what to store for each site and which reads to skip, or None for the defaults of ScanOptions. Defaults to None.
+        seed_filter (SeedFilter | None, optional): k-mer screen applied before aligning each pair, or None to align every pair. Defaults to None.
+        block_size (int, optional): length in base pairs of the blocks the contig is read in. Defaults to 1,000,000.
+        cluster_tolerance (int, optional): largest distance between neighbouring members of a site cluster, or 0 not to cluster. Defaults to 0.
+        min_read_score (float, optional): soft-clip alignment score a pair must exceed to be kept. Defaults to MIN_READ_SCORE.
+    """
+    def __init__(self, min_support: int, min_span: int, max_span: int, options: ScanOptions | None = None,
+                 seed_filter: SeedFilter | None = None, block_size: int = 1_000_000, cluster_tolerance: int = 0, min_read_score: float = MIN_READ_SCORE):
+        if max_span is None:
+            raise ValueError("The online detector needs a maximum span to know when a site is final")
+        self.min_support = min_support
+        self.min_span = min_span
+        self.max_span = max_span
+        self.options = options
+        self.seed_filter = seed_filter
+        self.block_size = block_size
+        self.cluster_tolerance = cluster_tolerance
+        self.min_read_score = min_read_score
+        self.stats = ScanStats()
+        self.high_support_sites = 0
+        self.site_clusters = 0
+        self.pairs_aligned = 0
+        self.batches = 0
+        self.peak_sites = 0
+
+    def run(self, bam: pysam.AlignmentFile, contig: str, reference: str | FastaContig | PackedReference,
+            engine: AlignmentEngine, cache: ReferenceAlignmentCache | None = None, ungapped: UngappedScorer | None = None) -> Iterator[CandidateTable]:
+        """Scans one contig and yields its scored candidates batch by batch, as soon as they are final
+
+        Args:
+            bam (pysam.AlignmentFile): the sorted, indexed alignment file
+            contig (str): name of the contig to scan
+            reference (str | FastaContig | PackedReference): sequence of the contig
+            engine (AlignmentEngine): engine scoring the soft-clip and reference alignments
+            cache (ReferenceAlignmentCache | None, optional): cache of per-site reference alignment scores, or None to align every site. Defaults to None.
+            ungapped (UngappedScorer | None, optional): ungapped scorer tried before the gapped reference aligner, or None to align every site. Defaults to None.
+
+        Yields:
+            Iterator[CandidateTable]: candidate tables with all scores filled in, like generate_final_results
+        """
+        # High-support sites (cluster representatives when clustering) in position order, as (1-based position, details, members)
+        pending_starts: deque[Site] = deque()
+        window_ends: deque[Site] = deque()
+        # High-support sites whose cluster may still grow, in position order
+        unclustered_starts: list[tuple[int, AlignmentDetails]] = []
+        unclustered_ends: list[tuple[int, AlignmentDetails]] = []
+        length = bam.get_reference_length(contig)
+        for block_start in range(0, length, self.block_size):
+            block_end = min(block_start + self.block_size, length)
+            start_scr: dict[int, AlignmentDetails] = {}
+            end_scr: dict[int, AlignmentDetails] = {}
+            t0 = time.perf_counter()
+            # Reads overlapping the block but starting in an earlier one were already scanned with that block
+            fetch = lambda: (read for read in bam.fetch(contig, block_start, block_end) if read.reference_start >= block_start)
+            n_reads, n_filtered = _scan_reads(fetch, start_scr, end_scr, self.options)
+            self.stats.reads += n_reads
+            self.stats.filtered += n_filtered
+            self.stats.seconds += time.perf_counter() - t0
+            # No later read starts at or before block_end, so the support of these sites is final
+            for scr, window, unclustered in ((start_scr, pending_starts, unclustered_starts), (end_scr, window_ends, unclustered_ends)):
+                for pos, details in scr.items():
+                    if details.count >= self.min_support:
+                        self.high_support_sites += 1
+                        if self.cluster_tolerance:
+                            unclustered.append((pos, details))
+                        else:
+                            window.append((pos, details, None))
+                # A later site can only join clusters ending within tolerance of the block end
+                self._take_clusters(unclustered, window, block_end - self.cluster_tolerance)
+            self.peak_sites = max(self.peak_sites, len(pending_starts) + len(window_ends) + len(unclustered_starts) + len(unclustered_ends))
+            # Every ending site a starting site can pair with lies at most max_span after it, and must already be in the window
+            reach = min(block_end, unclustered_ends[0][0] - 1) if unclustered_ends else block_end
+            horizon = unclustered_starts[0][0] if unclustered_starts else block_end + 1
+            yield from self._finalize(pending_starts, window_ends, reach - self.max_span, horizon, contig, reference, engine, cache, ungapped)
+        self._take_clusters(unclustered_starts, pending_starts, length)
+        self._take_clusters(unclustered_ends, window_ends, length)
+        yield from self._finalize(pending_starts, window_ends, length, length + 1, contig, reference, engine, cache, ungapped)
+
+    def _take_clusters(self, unclustered: list[tuple[int, AlignmentDetails]], window: deque[Site], last_member: int) -> None:
+        """Moves the clusters of unclustered sites whose members all lie at or before last_member into the window, as representatives"""
+        if not unclustered:
+            return
+        sites = dict(unclustered)
+        taken = 0
+        for cluster in split_clusters(list(sites), self.cluster_tolerance):
+            if cluster[-1] > last_member:
+                break
+            pos, details = merge_cluster(sites, cluster)
+            window.append((pos, details, cluster))
+            self.site_clusters += 1
+            taken += len(cluster)
+        del unclustered[:taken]
+
+    def _finalize(self, pending_starts: deque[Site], window_ends: deque[Site], limit: int, horizon: int,
+                  contig: str, reference: str | FastaContig | PackedReference, engine: AlignmentEngine,
+                  cache: ReferenceAlignmentCache | None, ungapped: UngappedScorer | None) -> Iterator[CandidateTable]:
+        """Pairs and scores the pending starting sites at or before limit, then drops them and the ending sites only they could reach.
+        Starting sites that have not entered the window yet lie at or after horizon"""
+        starts, start_members = {}, {}
+        while pending_starts and pending_starts[0][0] <= limit:
+            pos, details, members = pending_starts.popleft()
+            starts[pos] = details
+            start_members[pos] = members
+        if starts:
+            last_reach = max(starts) + self.max_span
+            ends = {pos: details for pos, details, _ in window_ends if pos <= last_reach}
+            end_members = {pos: members for pos, _, members in window_ends if pos <= last_reach}
+            clustered = self.cluster_tolerance > 0
+            start_sites = SiteTable.from_sites(starts, contig, start_members if clustered else None)
+            end_sites = SiteTable.from_sites(ends, contig, end_members if clustered else None)
+            self.batches += 1
+            for table in align_soft_clips(start_sites, end_sites, self.min_span, self.max_span, self.seed_filter, engine):
+                self.pairs_aligned += len(table)
+                yield from generate_final_results([table], reference, cache, engine, ungapped, self.min_read_score)
+        # Starting sites still pending lie after limit, those not in the window yet at or after horizon,
+        # and neither reach ending sites before their own position + min_span
+        first_pending = min(pending_starts[0][0], horizon) if pending_starts else min(limit + 1, horizon)
+        while window_ends and window_ends[0][0] < first_pending + self.min_span:
+            window_ends.popleft()
@@ -0,0 +1,245 @@
+import os
+import numpy as np
+import pysam
+
+# Bump whenever the packed layout changes, so stale files are rebuilt
+PACK_VERSION = 1
+
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _CODES[_base] = _code
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+# Each packed byte holds four bases, first base in the high bits
+_UNPACK = np.stack([(np.arange(256) >> shift) & 3 for shift in (6, 4, 2, 0)], axis=1).astype(np.uint8)
+
+def _runs(mask: np.ndarray, values: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Finds the maximal runs of set positions in a mask, split wherever the value changes
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: start, length and value of every run
+    """
+    idx = np.flatnonzero(mask)
+    if not idx.size:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.uint8)
+    run_values = values[idx] if values is not None else np.zeros(idx.size, dtype=np.uint8)
+    breaks = np.flatnonzero((np.diff(idx) != 1) | (np.diff(run_values) != 0)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [idx.size]])
+    return idx[starts].astype(np.int64), (ends - starts).astype(np.int64), run_values[starts]
+
+def _merge_runs(parts: list[tuple[np.ndarray, np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Runs of consecutive chunks are joined when one ends where the next starts with the same value
+    starts = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+    lengths = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+    values = np.concatenate([p[2] for p in parts]) if parts else np.empty(0, dtype=np.uint8)
+    if starts.size < 2:
+        return starts, lengths, values
+    joins = (starts[1:] == starts[:-1] + lengths[:-1]) & (values[1:] == values[:-1])
+    head = np.concatenate([[True], ~joins])
+    group = np.cumsum(head) - 1
+    return starts[head], np.bincount(group, weights=lengths).astype(np.int64), values[head]
+
+def _fasta_identity(fasta_path: str) -> np.ndarray:
+    st = os.stat(fasta_path)
+    return np.array([PACK_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+def _pack_is_current(fasta_path: str, prefix: str) -> bool:
+    try:
+        with np.load(f"{prefix}.runs.npz") as runs:
+            return np.array_equal(runs["identity"], _fasta_identity(fasta_path))
+    except (OSError, KeyError, ValueError):
+        return False
+
+def pack_contig(fasta_path: str, contig: str, prefix: str, chunk_size: int = 1 << 24) -> None:
+    """Packs one contig of a FASTA file into <prefix>.2bit.npy, two bits per base, and <prefix>.runs.npz holding
+    the runs of bases other than A, C, G and T (N and other IUPAC codes) and of lowercase (soft-masked) bases,
+    so the original sequence is restored exactly. The contig is read in chunks, so memory stays bounded. Each process
+    writes its own temporary files, so processes packing the same contig at once do not clash, and a pack finished
+    by another process in the meantime is kept.
+
+    Args:
+        fasta_path (str): path of the indexed FASTA file
+        contig (str): name of the contig to pack
+        prefix (str): path prefix of the two output files
+        chunk_size (int, optional): bases read at a time, a multiple of 4. Defaults to 16 Mb.
+    """
+    tmp_prefix = f"{prefix}.{os.getpid()}"
+    with pysam.FastaFile(fasta_path) as fasta:
+        length = fasta.get_reference_length(contig)
+        packed = np.lib.format.open_memmap(f"{tmp_prefix}.2bit.npy.tmp", mode="w+", dtype=np.uint8, shape=((length + 3) // 4,))
+        exceptions, lowercase = [], []
+        for chunk_start in range(0, length, chunk_size):
+            raw = np.frombuffer(fasta.fetch(contig, chunk_start, min(chunk_start + chunk_size, length)).encode("ascii"), dtype=np.uint8)
+            is_lower = (raw >= ord("a")) & (raw <= ord("z"))
+            upper = np.where(is_lower, raw - 32, raw).astype(np.uint8)
+            codes = _CODES[upper]
+            other = codes == 255
+            starts, lengths, values = _runs(other, upper)
+            exceptions.append((starts + chunk_start, lengths, values))
+            starts, lengths, values = _runs(is_lower)
+            lowercase.append((starts + chunk_start, lengths, values))
+            codes = np.where(other, 0, codes)
+            codes = np.concatenate([codes, np.zeros(-len(codes) % 4, dtype=np.uint8)]).reshape(-1, 4)
+            packed[chunk_start // 4:chunk_start // 4 + len(codes)] = (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+        packed.flush()
+        del packed
+    ex_starts, ex_lengths, ex_values = _merge_runs(exceptions)
+    lo_starts, lo_lengths, _ = _merge_runs(lowercase)
+    with open(f"{tmp_prefix}.runs.npz.tmp", "wb") as f:
+        np.savez(f, identity=_fasta_identity(fasta_path), length=np.array(length),
+                 exception_starts=ex_starts, exception_lengths=ex_lengths, exception_values=ex_values,
+                 lowercase_starts=lo_starts, lowercase_lengths=lo_lengths)
+    if _pack_is_current(fasta_path, prefix):
+        # Another process finished first; its files are identical and may already be mapped
+        os.remove(f"{tmp_prefix}.2bit.npy.tmp")
+        os.remove(f"{tmp_prefix}.runs.npz.tmp")
+        return
+    # The runs file is renamed last, since its presence marks the pack as complete
+    os.replace(f"{tmp_prefix}.2bit.npy.tmp", f"{prefix}.2bit.npy")
+    os.replace(f"{tmp_prefix}.runs.npz.tmp", f"{prefix}.runs.npz")
+
+class PackedReference:
+    """A contig packed by pack_contig and memory-mapped read-only. It is sliced like the str returned by
+    load_fasta, but only the requested window is decoded, and processes mapping the same file share its pages.
+    Pickling sends the file path, so worker processes map the file themselves instead of receiving a copy.
+
+    Args:
+        prefix (str): path prefix of the packed files
+    """
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._packed = np.load(f"{prefix}.2bit.npy", mmap_mode="r")
+        with np.load(f"{prefix}.runs.npz") as runs:
+            self._length = int(runs["length"])
+            self._ex_starts = runs["exception_starts"]
+            self._ex_ends = runs["exception_starts"] + runs["exception_lengths"]
+            self._ex_values = runs["exception_values"]
+            self._lo_starts = runs["lowercase_starts"]
+            self._lo_ends = runs["lowercase_starts"] + runs["lowercase_lengths"]
+
+    def __reduce__(self):
+        return (PackedReference, (self.prefix,))
+
+    def __len__(self) -> int:
+        return self._length
+
+    @staticmethod
+    def _overlapping(starts: np.ndarray, ends: np.ndarray, start: int, stop: int) -> range:
+        # Runs are sorted and disjoint, so the ones overlapping [start, stop) are contiguous
+        return range(int(np.searchsorted(ends, start, side="right")), int(np.searchsorted(starts, stop, side="left")))
+
+    def __getitem__(self, key: int | slice) -> str:
+        if isinstance(key, int):
+            if key < 0:
+                key += self._length
+            if not 0 <= key < self._length:
+                raise IndexError("reference index out of range")
+            return self[key:key + 1]
+        start, stop, step = key.indices(self._length)
+        if step != 1:
+            raise ValueError("PackedReference only supports contiguous slices")
+        if stop <= start:
+            return ""
+        first = start // 4
+        bases = _BASES[_UNPACK[self._packed[first:(stop + 3) // 4]].ravel()][start - 4 * first:stop - 4 * first]
+        for i in self._overlapping(self._ex_starts, self._ex_ends, start, stop):
+            bases[max(self._ex_starts[i], start) - start:min(self._ex_ends[i], stop) - start] = self._ex_values[i]
+        for i in self._overlapping(self._lo_starts, self._lo_ends, start, stop):
+            bases[max(self._lo_starts[i], start) - start:min(self._lo_ends[i], stop) - start] += 32
+        return bases.tobytes().decode("ascii")
+
+def load_packed_reference(fasta_path: str, contig: str | None = None, cache_dir: str | None = None) -> PackedReference:
+    """Maps a packed contig, packing it first if there is no up-to-date pack of the FASTA file
+
+    Args:
+        fasta_path (str): path of the indexed FASTA file
+        contig (str | None, optional): name of the contig, or None for the first one. Defaults to None.
+        cache_dir (str | None, optional): directory of the packed files. Defaults to <fasta_path>.packed.
+
+    Returns:
+        PackedReference: the memory-mapped contig
+    """
+    if contig is None:
+        with pysam.FastaFile(fasta_path) as fasta:
+            contig = fasta.references[0]
+    cache_dir = cache_dir or f"{fasta_path}.packed"
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = os.path.join(cache_dir, contig.replace(os.sep, "_"))
+    if not _pack_is_current(fasta_path, prefix):
+        pack_contig(fasta_path, contig, prefix)
+    return PackedReference(prefix)
+
+class FastaContig:
+    """A contig of an indexed FASTA file, sliced like the str returned by load_fasta but fetched lazily,
+    window by window, with pysam.FastaFile.fetch. Pickling sends the file path and contig name.
+
+    Args:
+        fasta_path (str): path of the indexed FASTA file
+        contig (str): name of the contig
+        fasta (pysam.FastaFile | None, optional): an open handle of the FASTA file to share, or None to open one. Defaults to None.
+    """
+    def __init__(self, fasta_path: str, contig: str, fasta: pysam.FastaFile | None = None):
+        self.fasta_path = fasta_path
+        self.contig = contig
+        self._fasta = fasta or pysam.FastaFile(fasta_path)
+        self._length = self._fasta.get_reference_length(contig)
+
+    def __reduce__(self):
+        return (FastaContig, (self.fasta_path, self.contig))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, key: int | slice) -> str:
+        if isinstance(key, int):
+            if key < 0:
+                key += self._length
+            if not 0 <= key < self._length:
+                raise IndexError("reference index out of range")
+            return self[key:key + 1]
+        start, stop, step = key.indices(self._length)
+        if step != 1:
+            raise ValueError("FastaContig only supports contiguous slices")
+        if stop <= start:
+            return ""
+        return self._fasta.fetch(self.contig, start, stop)
+
+class ReferenceGenome:
+    """All contigs of a reference, opened one at a time and on demand, either lazily through the FASTA index or
+    as memory-mapped packed contigs. Pickling sends only the paths, so worker processes open the contigs themselves.
+
+    Args:
+        fasta_path (str): path of the indexed FASTA file
+        packed (bool, optional): flag to map 2-bit packed contigs, packed on first use, instead of fetching from the FASTA file. Defaults to False.
+    """
+    def __init__(self, fasta_path: str, packed: bool = False):
+        self.fasta_path = fasta_path
+        self.packed = packed
+        self._fasta = pysam.FastaFile(fasta_path)
+        self.names = list(self._fasta.references)
+        self._contigs: dict[str, FastaContig | PackedReference] = {}
+
+    def __reduce__(self):
+        return (ReferenceGenome, (self.fasta_path, self.packed))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def contig(self, name: str) -> FastaContig | PackedReference:
+        """Opens a contig, reusing it if it is already open
+
+        Args:
+            name (str): name of the contig
+
+        Returns:
+            FastaContig | PackedReference: the contig, sliceable like a str
+        """
+        contig = self._contigs.get(name)
+        if contig is None:
+            if self.packed:
+                contig = load_packed_reference(self.fasta_path, name)
+            else:
+                contig = FastaContig(self.fasta_path, name, self._fasta)
+            self._contigs[name] = contig
+        return contig
@@ -0,0 +1,90 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Lookup table from ASCII byte to 2-bit base code. Anything that is not A, C, G or T maps to 4
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _BASE_CODES[_base] = _code
+    _BASE_CODES[_base + 32] = _code
+
+def encode_seq(seq: str | bytes) -> np.ndarray:
+    """Encodes a DNA sequence as an array of 2-bit base codes
+
+    Args:
+        seq (str | bytes): the DNA sequence
+
+    Returns:
+        np.ndarray: uint8 array with A=0, C=1, G=2, T=3 and 4 for any other character
+    """
+    if isinstance(seq, str):
+        seq = seq.encode("ascii")
+    return _BASE_CODES[np.frombuffer(seq, dtype=np.uint8)]
+
+def kmer_set(seq: str, k: int) -> np.ndarray:
+    """Computes the distinct k-mers of a DNA sequence, packed two bits per base. k-mers containing N are dropped
+
+    Args:
+        seq (str): the DNA sequence
+        k (int): length of the k-mers, at most 32
+
+    Returns:
+        np.ndarray: sorted array of distinct uint64 k-mer codes
+    """
+    codes = encode_seq(seq)
+    if codes.size < k:
+        return np.empty(0, dtype=np.uint64)
+    windows = sliding_window_view(codes, k)
+    valid = (windows < 4).all(axis=1)
+    weights = np.uint64(4) ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    kmers = windows[valid].astype(np.uint64) @ weights
+    return np.unique(kmers)
+
+class SeedFilter:
+    """Cheap pre-alignment screen that only lets through soft-clip pairs sharing enough k-mer seeds.
+    The k-mers of every site are computed once, the first time the site is paired.
+
+    Args:
+        k (int): length of the seeds
+        min_hits (int, optional): minimum number of distinct shared seeds for a pair to be aligned. Defaults to 1.
+    """
+    def __init__(self, k: int, min_hits: int = 1):
+        if not 0 < k <= 32:
+            raise ValueError(f"Seed length must be between 1 and 32, got {k}")
+        self.k = k
+        self.min_hits = min_hits
+        self.checked = 0
+        self.removed = 0
+        self._start_kmers: dict[int, np.ndarray] = {}
+        self._end_kmers: dict[int, np.ndarray] = {}
+
+    def clear(self) -> None:
+        """Forgets the cached k-mers, whose keys are only meaningful for the site tables they were computed for"""
+        self._start_kmers.clear()
+        self._end_kmers.clear()
+
+    def _kmers(self, cache: dict[int, np.ndarray], key: int, seq: str) -> np.ndarray:
+        kmers = cache.get(key)
+        if kmers is None:
+            kmers = cache[key] = kmer_set(seq, self.k)
+        return kmers
+
+    def passes(self, start_key: int, start_seq: str, end_key: int, end_seq: str) -> bool:
+        """Checks whether a starting and an ending soft-clip share enough seeds to be worth aligning
+
+        Args:
+            start_key (int): identifier of the starting soft-clip site, used to cache its k-mers
+            start_seq (str): sequence of the starting soft-clip
+            end_key (int): identifier of the ending soft-clip site, used to cache its k-mers
+            end_seq (str): sequence of the ending soft-clip
+
+        Returns:
+            bool: True if the pair should be aligned
+        """
+        start_kmers = self._kmers(self._start_kmers, start_key, start_seq)
+        end_kmers = self._kmers(self._end_kmers, end_key, end_seq)
+        hits = np.intersect1d(start_kmers, end_kmers, assume_unique=True).size
+        self.checked += 1
+        if hits < self.min_hits:
+            self.removed += 1
+            return False
+        return True
@@ -0,0 +1,156 @@
+from main import add_pairing_args, add_scan_args, add_scoring_args, check_pipeline_args, describe_backend, load_reference
+from alignment_models import ScanOptions
+from beautiful_printer import print_progress, print_summary, set_progress_mode, PROGRESS_MODES
+from file_interaction import clear_file, load_bam, save_results_sv, save_results_txt
+from reference_store import ReferenceGenome
+from seeding import SeedFilter
+from shard_store import format_region, merge_shards, pair_shard, parse_region, plan_shards, scan_shard, ShardError
+from ungapped import UngappedScorer
+from utils import materialize_alignments, merge_ranked, AlignmentEngine, ReferenceAlignmentCache, REF_ALIGNER_PARAMS, SC_ALIGNER_PARAMS
+
+import argparse
+import sys
+from colorama import Fore
+
+def get_args():
+    """Handles CLI arguments
+
+    Returns:
+        args: The CLI arguments as key-value pairs
+    """
+    parser = argparse.ArgumentParser(description='Split one run into genomic ranges processed on separate nodes: plan the ranges, '
+                                                 'scan and pair each one on its own, then merge the shard files into the output of a single run')
+    parser.add_argument('--progress',
+                        default='plain',
+                        choices=PROGRESS_MODES,
+                        help='Progress output: stage messages with elapsed time, animated dots from a background thread, or nothing (default: plain)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='Print the ranges of the shards, one contig:start-end region per line')
+    plan.add_argument('-bf', '--bam_file', type=str, required=True, help='BAM file')
+    plan.add_argument('-ff', '--fasta_file', type=str, required=True, help='Fasta file')
+    plan.add_argument('--shards',
+                      default=1,
+                      type=int,
+                      help='Number of shards to aim for; every shard lies within one contig, so short contigs may add some (default: 1)')
+
+    scan = commands.add_parser('scan', help='Scan the reads starting in one range and write its high-support sites to a scan shard file')
+    scan.add_argument('-bf', '--bam_file', type=str, required=True, help='BAM file')
+    scan.add_argument('-ff', '--fasta_file', type=str, required=True, help='Fasta file')
+    scan.add_argument('-r',
+                      '--region',
+                      type=parse_region,
+                      required=True,
+                      help='Range of the shard as contig:start-end, 1-based and inclusive, as printed by plan')
+    scan.add_argument('-of', '--output_file', type=str, required=True, help='Scan shard file')
+    add_scan_args(scan)
+
+    pair = commands.add_parser('pair', help='Pair and score the sites of a scan shard and write the candidates and boundary sites to a pair shard file')
+    pair.add_argument('-sf', '--scan_file', type=str, required=True, help='Scan shard file')
+    pair.add_argument('-ff', '--fasta_file', type=str, required=True, help='Fasta file')
+    pair.add_argument('-of', '--output_file', type=str, required=True, help='Pair shard file')
+    add_pairing_args(pair)
+    add_scoring_args(pair)
+
+    merge = commands.add_parser('merge', help='Score the pairs across shards and write the candidates of all pair shard files, ranked like a single run')
+    merge.add_argument('pair_files', nargs='+', help='Pair shard files of every range of the run, in any order')
+    merge.add_argument('-ff', '--fasta_file', type=str, required=True, help='Fasta file')
+    merge.add_argument('-of', '--output_file', type=str, required=True, help='Output file in txt, tsv, or csv format')
+    add_scoring_args(merge)
+
+    args = parser.parse_args()
+    check_pipeline_args(commands.choices[args.command], args)
+    if args.command == 'scan' and args.sketch_width and not args.sketch_exact:
+        # Approximate counts depend on which sites share the sketch, so they would differ from those of a single run
+        commands.choices['scan'].error('--sketch_width requires --sketch_exact with shards')
+    if args.command == 'plan' and args.shards < 1:
+        commands.choices['plan'].error('--shards must be at least 1')
+    return args
+
+def scoring_setup(args: argparse.Namespace) -> tuple[AlignmentEngine, ReferenceAlignmentCache | None, UngappedScorer | None]:
+    """Builds the engine, reference alignment cache and ungapped scorer of the options added by add_scoring_args, like run_sample"""
+    engine = AlignmentEngine(args.workers, autotune=args.autotune, tolerance=args.autotune_tolerance)
+    if args.sc_backend is not None:
+        engine.use_backend(SC_ALIGNER_PARAMS, args.sc_backend)
+    if args.ref_backend is not None:
+        engine.use_backend(REF_ALIGNER_PARAMS, args.ref_backend)
+    ref_cache = ReferenceAlignmentCache(args.ref_cache_size) if args.ref_cache_size > 0 else None
+    ungapped = None
+    if args.ref_scoring != 'gapped':
+        ungapped = UngappedScorer.from_params(REF_ALIGNER_PARAMS, compare=args.ref_scoring == 'compare')
+    return engine, ref_cache, ungapped
+
+def run_plan(args: argparse.Namespace) -> None:
+    bam = load_bam(args.bam_file)
+    for region in plan_shards(bam, ReferenceGenome(args.fasta_file), args.shards):
+        print(format_region(*region))
+    bam.close()
+
+def run_scan(args: argparse.Namespace) -> None:
+    options = ScanOptions(args.anchor_len, args.consensus, args.exclude_flags, args.min_mapq,
+                          sketch_width=args.sketch_width, sketch_min_count=args.min_support, sketch_exact=args.sketch_exact)
+    meta = scan_shard(args.bam_file, args.fasta_file, args.region, options, args.min_support, args.output_file, args.bam_threads)
+    stats = meta["stats"]
+    print_summary("Scan shard summary", {
+        "Region": format_region(*args.region),
+        "Reads scanned": f"{stats['reads_scanned']} in {stats['seconds']:.2f}s",
+        "Reads filtered by flag or MAPQ": stats["reads_filtered"],
+        "High-support sites": stats["high_support_sites"],
+    })
+
+def run_pair(args: argparse.Namespace) -> None:
+    reference = load_reference(args, args.fasta_file)
+    seed_filter = SeedFilter(args.seed_k, args.min_seeds) if args.seed_k else None
+    engine, ref_cache, ungapped = scoring_setup(args)
+    with engine:
+        meta = pair_shard(args.scan_file, reference, args.output_file, args.cluster_tolerance, args.min_span, args.max_span, seed_filter,
+                          engine, ref_cache, ungapped, args.top_k, [args.seed_k, args.min_seeds] if args.seed_k else None, args.min_read_score)
+    stats = meta["stats"]
+    summary = {
+        "Region": format_region(meta["contig"], meta["start"], meta["end"]),
+        "Pairs aligned": stats["pairs_aligned"],
+        "Candidates kept": stats["candidates"],
+        "Sites left for the merge": f"{stats['boundary_sites']} on the boundary, {stats['open_sites']} in clusters open to the neighbouring shards",
+    }
+    if seed_filter is not None:
+        summary["Pairs removed by seed filter"] = f"{seed_filter.removed} of {seed_filter.checked}"
+    print_summary("Pair shard summary", summary)
+
+def run_merge(args: argparse.Namespace) -> None:
+    reference = load_reference(args, args.fasta_file)
+    engine, ref_cache, ungapped = scoring_setup(args)
+    clear_file(args.output_file)
+    with engine:
+        ranked, stats = merge_shards(args.pair_files, reference, engine, ref_cache, ungapped, args.top_k, print_progress)
+        results = merge_ranked(ranked, args.top_k)
+        if args.output_file.endswith('.tsv') or args.output_file.endswith('.csv'):
+            n_reported = save_results_sv(results, args.output_file)
+        elif args.output_file.endswith('.txt'):
+            n_reported = save_results_txt(materialize_alignments(results, reference), args.output_file)
+        else:
+            n_reported = 0
+    summary = {
+        "Shards merged": f"{stats['shards']} covering {len(ranked)} contigs",
+        "Reads scanned": f"{stats['reads_scanned']} in {stats['seconds']:.2f}s summed over the shards",
+        "Reads filtered by flag or MAPQ": stats["reads_filtered"],
+        "Pairs aligned": f"{stats['pairs_aligned']} by the shards, {stats['cross_pairs_aligned']} across shards by the merge",
+    }
+    if stats["site_clusters"]:
+        summary["Site clusters"] = f"{stats['high_support_sites']} high-support sites collapsed into {stats['site_clusters']}"
+    if args.autotune or args.sc_backend or args.ref_backend:
+        summary["Aligner backends"] = "; ".join(f"{label} {describe_backend(engine, params)}" for label, params in
+                                                (("soft-clip pairs:", SC_ALIGNER_PARAMS), ("reference windows:", REF_ALIGNER_PARAMS)))
+    summary["Candidates reported"] = n_reported
+    print_summary("Merge summary", summary)
+
+def main():
+    args = get_args()
+    set_progress_mode(args.progress)
+    try:
+        {'plan': run_plan, 'scan': run_scan, 'pair': run_pair, 'merge': run_merge}[args.command](args)
+    except ShardError as e:
+        print(f"{Fore.RED}{e}{Fore.RESET}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
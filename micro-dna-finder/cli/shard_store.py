@@ -0,0 +1,383 @@
+import json
+import os
+import time
+import numpy as np
+import pysam
+from typing import Callable, Iterable, Iterator
+from alignment_models import AlignmentDetails, ScanOptions, SiteTable, CandidateTable, CANDIDATE_DTYPE
+from checkpoint import _pack_sites, _unpack_sites
+from reference_store import ReferenceGenome
+from seeding import SeedFilter
+from ungapped import UngappedScorer
+from utils import (_scan_region, align_soft_clips, find_high_support_sites, generate_final_results, get_sample_contigs, get_scan_regions,
+                   max_read_score, merge_cluster, rank_candidates, split_clusters, AlignmentEngine, ReferenceAlignmentCache, MIN_READ_SCORE)
+
+# Bump whenever the layout or the meaning of the shard files changes, so files of another version are rejected
+SHARD_VERSION = 2
+
+class ShardError(ValueError):
+    """Raised when shard files cannot be combined into the result of a single run"""
+
+def parse_region(region: str) -> tuple[str, int, int]:
+    """Parses a samtools-style region, contig:start-end with 1-based inclusive coordinates
+
+    Args:
+        region (str): the region, e.g. chr1:1-5000000
+
+    Returns:
+        tuple[str, int, int]: (contig, 0-based start, 0-based exclusive end)
+    """
+    contig, _, span = region.rpartition(":")
+    start, _, end = span.partition("-")
+    try:
+        start, end = int(start.replace(",", "")), int(end.replace(",", ""))
+    except ValueError:
+        raise ValueError(f"Expected a region like chr1:1-5000000, got {region!r}") from None
+    if not contig or start < 1 or end < start:
+        raise ValueError(f"Expected a region like chr1:1-5000000, got {region!r}")
+    return contig, start - 1, end
+
+def format_region(contig: str, start: int, end: int) -> str:
+    """Formats a (contig, 0-based start, 0-based exclusive end) region as contig:start-end, 1-based inclusive"""
+    return f"{contig}:{start + 1}-{end}"
+
+def plan_shards(bam: pysam.AlignmentFile, reference: ReferenceGenome, shards: int) -> list[tuple[str, int, int]]:
+    """Splits the contigs of a sample into ranges of about equal length, so that about the requested number of shards
+    cover them. Every range lies within one contig, so a contig shorter than the range length is a shard of its own
+
+    Args:
+        bam (pysam.AlignmentFile): the indexed alignment file
+        reference (ReferenceGenome): the reference genome
+        shards (int): number of shards to aim for
+
+    Returns:
+        list[tuple[str, int, int]]: (contig, 0-based start, 0-based exclusive end) ranges, in BAM header order
+    """
+    contigs = get_sample_contigs(bam, reference)
+    total = sum(bam.get_reference_length(name) for name in contigs)
+    chunk_size = max(-(-total // max(shards, 1)), 1)
+    return [region for region in get_scan_regions(bam, chunk_size) if region[0] in contigs]
+
+def _save(path: str, meta: dict, arrays: dict[str, np.ndarray]) -> None:
+    # Written to a temporary file and renamed, like the checkpoint cache, so a node that dies never leaves a partial shard
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+
+def _load(path: str, kind: str) -> tuple[dict, dict[str, np.ndarray]]:
+    with np.load(path) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    meta = json.loads(str(arrays.pop("meta")))
+    if meta.get("version") != SHARD_VERSION or meta.get("kind") != kind:
+        raise ShardError(f"{path} is not a version {SHARD_VERSION} {kind} shard file")
+    return meta, arrays
+
+def _pack_table(prefix: str, table: SiteTable, arrays: dict[str, np.ndarray]) -> None:
+    seqs = [seq.encode("ascii") for seq in table.seqs]
+    arrays[f"{prefix}_positions"] = table.positions
+    arrays[f"{prefix}_sc_lens"] = table.sc_lens
+    arrays[f"{prefix}_ref_starts"] = table.ref_starts
+    arrays[f"{prefix}_seq_lens"] = np.fromiter((len(s) for s in seqs), dtype=np.int64, count=len(seqs))
+    arrays[f"{prefix}_seqs"] = np.frombuffer(b"".join(seqs), dtype=np.uint8)
+    if table.members is not None:
+        arrays[f"{prefix}_member_counts"] = np.fromiter((len(m) for m in table.members), dtype=np.int64, count=len(table.members))
+        arrays[f"{prefix}_members"] = np.array([pos for m in table.members for pos in m], dtype=np.int64)
+
+def _unpack_table(prefix: str, arrays: dict[str, np.ndarray], contig: str) -> SiteTable:
+    offsets = np.concatenate([[0], np.cumsum(arrays[f"{prefix}_seq_lens"])]).tolist()
+    buffer = arrays[f"{prefix}_seqs"].tobytes()
+    members = None
+    if f"{prefix}_members" in arrays:
+        member_offsets = np.concatenate([[0], np.cumsum(arrays[f"{prefix}_member_counts"])]).tolist()
+        flat = arrays[f"{prefix}_members"].tolist()
+        members = [flat[member_offsets[i]:member_offsets[i + 1]] for i in range(len(member_offsets) - 1)]
+    return SiteTable(
+        positions=arrays[f"{prefix}_positions"],
+        sc_lens=arrays[f"{prefix}_sc_lens"],
+        ref_starts=arrays[f"{prefix}_ref_starts"],
+        seqs=[buffer[offsets[i]:offsets[i + 1]].decode("ascii") for i in range(len(offsets) - 1)],
+        contig=contig,
+        members=members,
+    )
+
+def _take_sites(table: SiteTable, index: np.ndarray) -> SiteTable:
+    idx = index.tolist()
+    return SiteTable(table.positions[index], table.sc_lens[index], table.ref_starts[index], [table.seqs[i] for i in idx],
+                     table.contig, [table.members[i] for i in idx] if table.members is not None else None)
+
+def _concat_tables(tables: list[SiteTable], contig: str) -> SiteTable:
+    clustered = all(table.members is not None for table in tables)
+    return SiteTable(
+        positions=np.concatenate([table.positions for table in tables]).astype(np.int64),
+        sc_lens=np.concatenate([table.sc_lens for table in tables]).astype(np.int64),
+        ref_starts=np.concatenate([table.ref_starts for table in tables]).astype(np.int64),
+        seqs=[seq for table in tables for seq in table.seqs],
+        contig=contig,
+        members=[m for table in tables for m in table.members] if clustered else None,
+    )
+
+def scan_shard(bam_path: str, fasta_path: str, region: tuple[str, int, int], options: ScanOptions, min_support: int, output_path: str, threads: int = 1) -> dict:
+    """Scans the reads starting inside one range of a contig and writes its high-support sites to a scan shard file.
+    Sites are keyed by the start of their reads, so every site, and all of its support, belongs to exactly one shard
+
+    Args:
+        bam_path (str): path of the sorted, indexed BAM file
+        fasta_path (str): path of the indexed FASTA file, which decides the contigs the whole run covers
+        region (tuple[str, int, int]): (contig, 0-based start, 0-based exclusive end) range of the shard
+        options (ScanOptions): what to store for each site and which reads to skip
+        min_support (int): minimum number of reads supporting a site
+        output_path (str): path of the scan shard file
+        threads (int, optional): number of htslib decompression threads. Defaults to 1.
+
+    Returns:
+        dict: the metadata written to the file, including the read counts of the scan
+    """
+    contig, start, end = region
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        contigs = get_sample_contigs(bam, ReferenceGenome(fasta_path))
+        if contig not in contigs:
+            raise ShardError(f"Contig {contig} has no reads or is not in the reference")
+        length = bam.get_reference_length(contig)
+    if end > length:
+        raise ShardError(f"Region {format_region(*region)} extends past the end of {contig} ({length} bp)")
+    t0 = time.perf_counter()
+    start_scr, end_scr, n_reads, n_filtered = _scan_region(bam_path, region, options, threads)
+    start_hsc = find_high_support_sites(start_scr, min_support)
+    end_hsc = find_high_support_sites(end_scr, min_support)
+    meta = {
+        "kind": "scan", "version": SHARD_VERSION, "contig": contig, "start": start, "end": end, "contig_length": length, "contigs": contigs,
+        "scan": {"anchor_len": options.anchor_len, "consensus": options.consensus, "exclude_flags": options.exclude_flags, "min_mapq": options.min_mapq,
+                 "sketch": [options.sketch_width, options.sketch_exact] if options.sketch_width else None, "min_support": min_support},
+        "stats": {"reads_scanned": n_reads, "reads_filtered": n_filtered, "seconds": time.perf_counter() - t0, "high_support_sites": len(start_hsc) + len(end_hsc)},
+    }
+    arrays: dict[str, np.ndarray] = {}
+    _pack_sites("start", start_hsc, arrays)
+    _pack_sites("end", end_hsc, arrays)
+    _save(output_path, meta, arrays)
+    return meta
+
+def settle_sites(sites: dict[int, AlignmentDetails], start: int, end: int, length: int, tolerance: int
+                 ) -> tuple[dict[int, AlignmentDetails], dict[int, list[int]] | None, dict[int, AlignmentDetails], tuple[int, int]]:
+    """Clusters the sites of a shard like cluster_sites, except for the clusters at either edge of the shard that a site
+    of the neighbouring shard could still join, which are left open for merge_shards to cluster with the neighbour's
+
+    Args:
+        sites (dict[int, AlignmentDetails]): the high-support sites of the shard, whose details are merged in place
+        start (int): 0-based start of the shard, so its sites lie at 1-based positions start + 1 to end
+        end (int): 0-based exclusive end of the shard
+        length (int): length of the contig
+        tolerance (int): largest distance between neighbouring members of a cluster, or 0 not to cluster
+
+    Returns:
+        tuple[dict[int, AlignmentDetails], dict[int, list[int]] | None, dict[int, AlignmentDetails], tuple[int, int]]: the settled
+        sites (cluster representatives when clustering) in position order, their member positions when clustering, the unmerged
+        sites of the open clusters, and the first and last position between the open clusters, which only settled sites occupy
+    """
+    if not tolerance:
+        return sites, None, {}, (start + 1, end)
+    clusters = split_clusters(sorted(sites), tolerance)
+    # The previous shard's sites lie at or before start, the next one's at or after end + 1
+    open_left = bool(clusters) and start > 0 and clusters[0][0] - start <= tolerance
+    open_right = bool(clusters) and end < length and end + 1 - clusters[-1][-1] <= tolerance
+    low = clusters[0][-1] + 1 if open_left else start + 1
+    high = clusters[-1][0] - 1 if open_right else end
+    settled: dict[int, AlignmentDetails] = {}
+    members: dict[int, list[int]] = {}
+    open_sites: dict[int, AlignmentDetails] = {}
+    for i, cluster in enumerate(clusters):
+        if (i == 0 and open_left) or (i == len(clusters) - 1 and open_right):
+            open_sites.update((pos, sites[pos]) for pos in cluster)
+            continue
+        pos, details = merge_cluster(sites, cluster)
+        settled[pos] = details
+        members[pos] = cluster
+    return settled, members, open_sites, (low, high)
+
+def _counted(tables: Iterable[CandidateTable], counts: dict, name: str) -> Iterator[CandidateTable]:
+    for table in tables:
+        counts[name] += len(table)
+        yield table
+
+def _boundary(positions: np.ndarray, lo_offset: int, hi_offset: int, interior: tuple[int, int]) -> np.ndarray:
+    # A site can pair with positions position + lo_offset to position + hi_offset; it is on the boundary unless all of them
+    # lie in the partner side's settled interior, whose sites are all in this shard
+    return (positions + lo_offset < interior[0]) | (positions + hi_offset > interior[1])
+
+def pair_shard(scan_path: str, reference: ReferenceGenome, output_path: str, cluster_tolerance: int, min_span: int, max_span: int | None,
+               seed_filter: SeedFilter | None, engine: AlignmentEngine, cache: ReferenceAlignmentCache | None = None,
+               ungapped: UngappedScorer | None = None, top_k: int | None = None, seed_params: list | None = None,
+               min_read_score: float = MIN_READ_SCORE) -> dict:
+    """Pairs and scores the sites of a scan shard whose partners all lie in the same shard, and writes a pair shard file
+    holding the scored candidates, the boundary sites that may pair with sites of other shards and the unsettled sites
+    of the open clusters, see settle_sites. merge_shards resolves everything that crosses shards
+
+    Args:
+        scan_path (str): path of the scan shard file
+        reference (ReferenceGenome): the reference genome
+        output_path (str): path of the pair shard file
+        cluster_tolerance (int): largest distance between neighbouring members of a site cluster, or 0 not to cluster
+        min_span (int): minimum distance between paired start and end soft-clips, inclusive
+        max_span (int | None): maximum distance between paired start and end soft-clips, inclusive, or None for no limit
+        seed_filter (SeedFilter | None): k-mer screen applied before aligning each pair, or None to align every pair
+        engine (AlignmentEngine): engine scoring the pairs
+        cache (ReferenceAlignmentCache | None, optional): cache of per-site reference alignment scores. Defaults to None.
+        ungapped (UngappedScorer | None, optional): ungapped scorer tried before the gapped reference aligner. Defaults to None.
+        top_k (int | None, optional): only keep the shard's K best candidates, which is enough for a merged top K. Defaults to None.
+        seed_params (list | None, optional): [seed_k, min_seeds] of the seed filter, recorded for merge_shards. Defaults to None.
+        min_read_score (float, optional): soft-clip alignment score a pair must exceed to be kept. Defaults to MIN_READ_SCORE.
+
+    Returns:
+        dict: the metadata written to the file
+    """
+    meta, arrays = _load(scan_path, "scan")
+    read_score_limit = max_read_score(meta["scan"]["anchor_len"])
+    if read_score_limit is not None and min_read_score >= read_score_limit:
+        raise ShardError(f"{scan_path} was scanned with anchor_len {meta['scan']['anchor_len']}, whose segments score at most "
+                         f"{read_score_limit:g}, so no pair can exceed a minimum read score of {min_read_score:g}")
+    contig, start, end, length = meta["contig"], meta["start"], meta["end"], meta["contig_length"]
+    sides = {}
+    for side in ("start", "end"):
+        sites = _unpack_sites(side, arrays)
+        settled, members, open_sites, interior = settle_sites(sites, start, end, length, cluster_tolerance)
+        sides[side] = (SiteTable.from_sites(settled, contig, members), open_sites, interior)
+    (start_sites, open_starts, start_interior), (end_sites, open_ends, end_interior) = sides["start"], sides["end"]
+    aligned = align_soft_clips(start_sites, end_sites, min_span, max_span, seed_filter, engine)
+    counts = {"pairs_aligned": 0}
+    ranked = rank_candidates(generate_final_results(_counted(aligned, counts, "pairs_aligned"), reference.contig(contig), cache, engine, ungapped, min_read_score),
+                             start_sites, end_sites, top_k)
+    # Only the sites of the kept candidates and of the boundary are stored
+    # Without a maximum span a site may pair with any site of the contig
+    reach = max_span if max_span is not None else length
+    start_boundary = _boundary(start_sites.positions, min_span, reach, end_interior)
+    end_boundary = _boundary(end_sites.positions, -reach, -min_span, start_interior)
+    rows = ranked.rows.copy()
+    out: dict[str, np.ndarray] = {}
+    for side, table, boundary, column in (("start", start_sites, start_boundary, "start_site"), ("end", end_sites, end_boundary, "end_site")):
+        keep = boundary.copy()
+        keep[rows[column]] = True
+        rows[column] = (np.cumsum(keep) - 1)[rows[column]]
+        _pack_table(side, _take_sites(table, np.flatnonzero(keep)), out)
+        out[f"{side}_boundary"] = boundary[keep]
+    out["rows"] = rows
+    _pack_sites("open_start", open_starts, out)
+    _pack_sites("open_end", open_ends, out)
+    meta.update({
+        "kind": "pairs",
+        "pairing": {"cluster_tolerance": cluster_tolerance, "min_span": min_span, "max_span": max_span, "seed": seed_params,
+                    "min_read_score": min_read_score},
+        "top_k": top_k,
+    })
+    # The open sites are counted by merge_shards once they are clustered
+    meta["stats"].update({"site_clusters": len(start_sites) + len(end_sites) if cluster_tolerance else 0,
+                          "pairs_aligned": counts["pairs_aligned"], "candidates": len(rows),
+                          "boundary_sites": int(start_boundary.sum() + end_boundary.sum()), "open_sites": len(open_starts) + len(open_ends)})
+    _save(output_path, meta, out)
+    return meta
+
+def _check_shards(shards: list[tuple[dict, dict]], top_k: int | None) -> tuple[list[str], dict]:
+    """Checks that the pair shards come from one run with the same options and cover every contig of it exactly once
+
+    Returns:
+        tuple[list[str], dict]: the contigs of the run in BAM header order, and the common pairing options
+    """
+    first = shards[0][0]
+    for meta, _ in shards[1:]:
+        for key in ("contigs", "scan", "pairing", "top_k"):
+            if meta[key] != first[key]:
+                raise ShardError(f"Shards were made with different {key} settings: {meta[key]} and {first[key]}")
+    if first["top_k"] is not None and (top_k is None or top_k > first["top_k"]):
+        raise ShardError(f"Shards only kept their {first['top_k']} best candidates, so at most --top_k {first['top_k']} can be merged")
+    for contig in first["contigs"]:
+        ranges = sorted((meta["start"], meta["end"]) for meta, _ in shards if meta["contig"] == contig)
+        covered = 0
+        for start, end in ranges:
+            if start != covered:
+                problem = "overlap" if start < covered else "gap"
+                raise ShardError(f"Shards of {contig} {problem} at position {min(start, covered) + 1}")
+            covered = end
+        length = next((meta["contig_length"] for meta, _ in shards if meta["contig"] == contig), None)
+        if length is None or covered != length:
+            raise ShardError(f"Shards do not cover {contig} up to its end" if length else f"No shard covers {contig}")
+    return first["contigs"], first["pairing"]
+
+def merge_shards(pair_paths: list[str], reference: ReferenceGenome, engine: AlignmentEngine, cache: ReferenceAlignmentCache | None = None,
+                 ungapped: UngappedScorer | None = None, top_k: int | None = None,
+                 progress: Callable[[str], None] | None = None) -> tuple[list[CandidateTable], dict]:
+    """Combines the pair shards of a run. For every contig the open sites of neighbouring shards are clustered together, the
+    pairs involving a boundary or newly clustered site that no shard could score are scored, and all candidates are ranked
+    by evidence score with ties in the order a single run discovers them, by start and then end position
+
+    Args:
+        pair_paths (list[str]): paths of the pair shard files, in any order
+        reference (ReferenceGenome): the reference genome
+        engine (AlignmentEngine): engine scoring the cross-shard pairs
+        cache (ReferenceAlignmentCache | None, optional): cache of per-site reference alignment scores. Defaults to None.
+        ungapped (UngappedScorer | None, optional): ungapped scorer tried before the gapped reference aligner. Defaults to None.
+        top_k (int | None, optional): number of candidates to keep per contig, or None to keep all of them. Defaults to None.
+        progress (Callable[[str], None] | None, optional): called with the name of each contig before it is merged. Defaults to None.
+
+    Returns:
+        tuple[list[CandidateTable], dict]: the ranked candidates of each contig in BAM header order, ready for merge_ranked,
+        and the summed statistics of the shards and of the merge
+    """
+    shards = [_load(path, "pairs") for path in pair_paths]
+    if not shards:
+        raise ShardError("No shard files to merge")
+    contigs, pairing = _check_shards(shards, top_k)
+    tolerance, min_span, max_span = pairing["cluster_tolerance"], pairing["min_span"], pairing["max_span"]
+    seed_filter = SeedFilter(*pairing["seed"]) if pairing["seed"] else None
+    stats = {name: sum(meta["stats"][name] for meta, _ in shards) for name in shards[0][0]["stats"]}
+    stats.update({"shards": len(shards), "cross_pairs_aligned": 0})
+    ranked = []
+    for contig in contigs:
+        if progress is not None and len(contigs) > 1:
+            progress(f"Contig {contig}")
+        parts = sorted((s for s in shards if s[0]["contig"] == contig), key=lambda s: s[0]["start"])
+        tables = {side: [_unpack_table(side, arrays, contig) for _, arrays in parts] for side in ("start", "end")}
+        boundary_tables = {}
+        sources = {}
+        for side in ("start", "end"):
+            # Open sites of neighbouring shards cluster like the sites of a single run, since settled clusters never reach them
+            open_sites: dict[int, AlignmentDetails] = {}
+            for _, arrays in parts:
+                open_sites.update(_unpack_sites(f"open_{side}", arrays))
+            reps: dict[int, AlignmentDetails] = {}
+            members: dict[int, list[int]] = {}
+            for cluster in split_clusters(sorted(open_sites), tolerance) if tolerance else []:
+                pos, details = merge_cluster(open_sites, cluster)
+                reps[pos] = details
+                members[pos] = cluster
+            stats["site_clusters"] += len(reps)
+            pieces = [_take_sites(table, np.flatnonzero(arrays[f"{side}_boundary"])) for table, (_, arrays) in zip(tables[side], parts)]
+            pieces.append(SiteTable.from_sites(reps, contig, members if tolerance else None))
+            boundary_tables[side] = _concat_tables(pieces, contig)
+            # Shard index of every boundary site, -1 for the newly clustered ones
+            sources[side] = np.concatenate([np.full(len(piece), i if i < len(parts) else -1) for i, piece in enumerate(pieces)]).astype(np.int64)
+        start_source, end_source = sources["start"], sources["end"]
+        # Pairs of two settled sites of the same shard were scored by that shard
+        exclude = lambda s, e: (start_source[s] == end_source[e]) & (start_source[s] >= 0)
+        aligned = align_soft_clips(boundary_tables["start"], boundary_tables["end"], min_span, max_span, seed_filter, engine, exclude)
+        cross_rows = []
+        for table in generate_final_results(_counted(aligned, stats, "cross_pairs_aligned"), reference.contig(contig), cache, engine, ungapped,
+                                            pairing["min_read_score"]):
+            cross_rows.append(table.rows)
+        # Every candidate refers to one combined table per side: the shards' tables followed by the boundary tables
+        all_rows = []
+        offsets = {side: np.cumsum([0] + [len(t) for t in tables[side]]) for side in ("start", "end")}
+        for i, (_, arrays) in enumerate(parts):
+            rows = arrays["rows"].astype(CANDIDATE_DTYPE, copy=True)
+            rows["start_site"] += offsets["start"][i]
+            rows["end_site"] += offsets["end"][i]
+            all_rows.append(rows)
+        for rows in cross_rows:
+            rows = rows.copy()
+            rows["start_site"] += offsets["start"][-1]
+            rows["end_site"] += offsets["end"][-1]
+            all_rows.append(rows)
+        rows = np.concatenate(all_rows) if all_rows else np.empty(0, dtype=CANDIDATE_DTYPE)
+        start_all = _concat_tables(tables["start"] + [boundary_tables["start"]], contig)
+        end_all = _concat_tables(tables["end"] + [boundary_tables["end"]], contig)
+        combined = CandidateTable(rows[np.lexsort((rows["end_pos"], rows["start_pos"]))], start_all, end_all)
+        ranked.append(rank_candidates(iter([combined]), start_all, end_all, top_k))
+    return ranked, stats
@@ -0,0 +1,49 @@
+import numpy as np
+
+_MASK64 = (1 << 64) - 1
+
+class CountMinSketch:
+    """Approximate counter of integer keys in a fixed depth x width table of uint32 counters. Every key is hashed to one
+    counter per row with multiply-shift hashing, and its estimate is the smallest of those counters, so estimates never
+    fall below the true count and only exceed it where keys collide. Updates are conservative (only the counters
+    holding the minimum are raised), which keeps the overestimate small.
+
+    Args:
+        width (int): counters per row, a power of two
+        depth (int, optional): number of rows, each with its own hash function. Defaults to 4.
+        seed (int, optional): seed of the hash multipliers. Defaults to 0.
+    """
+    def __init__(self, width: int, depth: int = 4, seed: int = 0):
+        if width < 2 or width & (width - 1):
+            raise ValueError(f"Sketch width must be a power of two, got {width}")
+        self.width = width
+        self.depth = depth
+        self._table = np.zeros(depth * width, dtype=np.uint32)
+        # Scalar updates go through a memoryview of the table, which is much cheaper per access than NumPy indexing
+        self._counters = memoryview(self._table)
+        rng = np.random.default_rng(seed)
+        self._multipliers = [int(m) | 1 for m in rng.integers(0, np.iinfo(np.uint64).max, size=depth, dtype=np.uint64, endpoint=True)]
+        self._offsets = [row * width for row in range(depth)]
+        self._shift = 64 - (width.bit_length() - 1)
+
+    @property
+    def nbytes(self) -> int:
+        return self._table.nbytes
+
+    def add(self, key: int) -> int:
+        """Counts one occurrence of a key
+
+        Args:
+            key (int): non-negative integer key
+
+        Returns:
+            int: the estimated count of the key, including this occurrence
+        """
+        idx = [offset + (((m * key) & _MASK64) >> self._shift) for offset, m in zip(self._offsets, self._multipliers)]
+        values = [self._counters[i] for i in idx]
+        estimate = min(values) + 1
+        for i, value in zip(idx, values):
+            if value < estimate:
+                self._counters[i] = estimate
+        return estimate
+
@@ -0,0 +1,114 @@
+import numpy as np
+
+class UngappedScorer:
+    """Scores equal-length (query, target) pairs without gaps, all pairs of a length at once, as an exact shortcut
+    for a global aligner with large gap penalties. An alignment with x gap positions in each of two equal-length
+    sequences only pairs query position i with target positions i - x to i + x, and pays at least two gap openings,
+    which bounds its score from the matches available in that band. Whenever the ungapped score reaches the bound
+    for every x it is the optimal score; every other pair is left to the gapped aligner.
+
+    Args:
+        match_score (float): score of identical characters
+        mismatch_score (float): score of different characters, at most 0
+        open_gap_score (float): score of the first position of a gap, at most 0
+        extend_gap_score (float): score of every further position of a gap, at most 0
+        compare (bool, optional): flag to score every pair with the gapped aligner too and count disagreements. Defaults to False.
+    """
+    def __init__(self, match_score: float, mismatch_score: float, open_gap_score: float, extend_gap_score: float, compare: bool = False):
+        if match_score <= 0 or mismatch_score > 0 or open_gap_score > 0 or extend_gap_score > 0:
+            raise ValueError("Ungapped scoring needs a positive match score and non-positive mismatch and gap scores")
+        self.match_score = match_score
+        self.mismatch_score = mismatch_score
+        self.open_gap_score = open_gap_score
+        self.extend_gap_score = extend_gap_score
+        self.compare = compare
+        self.scored = 0
+        self.exact = 0
+        self.disagreements = 0
+
+    @classmethod
+    def from_params(cls, params: dict, compare: bool = False) -> "UngappedScorer":
+        """Builds the scorer for a set of aligner_init parameters
+
+        Args:
+            params (dict): keyword arguments to aligner_init, which must describe a global aligner with uniform end gaps
+            compare (bool, optional): flag to score every pair with the gapped aligner too. Defaults to False.
+
+        Returns:
+            UngappedScorer: the scorer
+        """
+        if params.get("mode", "global") != "global" or params.get("sc"):
+            raise ValueError("Ungapped scoring is only exact for global aligners whose end gaps are scored like inner gaps")
+        return cls(params["match_score"], params["mismatch_score"], params["open_gap_score"], params["extend_gap_score"], compare)
+
+    @property
+    def fallback(self) -> int:
+        return self.scored - self.exact
+
+    def score(self, queries: list[str], targets: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Scores the pairs without gaps
+
+        Args:
+            queries (list[str]): the query sequences, e.g. reference windows
+            targets (list[str]): the target sequences, e.g. soft-clipped reads
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: the ungapped score of each pair (-inf for pairs of different lengths),
+            and a mask of the pairs whose ungapped score is provably the optimal gapped score
+        """
+        n = len(queries)
+        scores = np.full(n, -np.inf)
+        exact = np.zeros(n, dtype=bool)
+        q_lens = np.fromiter(map(len, queries), dtype=np.int64, count=n)
+        t_lens = np.fromiter(map(len, targets), dtype=np.int64, count=n)
+        same = (q_lens == t_lens) & (q_lens > 0)
+        for length in np.unique(q_lens[same]).tolist():
+            idx = np.flatnonzero(same & (q_lens == length))
+            q = np.frombuffer("".join(queries[i] for i in idx).encode("ascii"), dtype=np.uint8).reshape(len(idx), length)
+            t = np.frombuffer("".join(targets[i] for i in idx).encode("ascii"), dtype=np.uint8).reshape(len(idx), length)
+            band = q == t
+            matches = band.sum(axis=1)
+            group_scores = matches * self.match_score + (length - matches) * self.mismatch_score
+            scores[idx] = group_scores
+            exact[idx] = self._beats_gapped(q, t, band, group_scores)
+        self.scored += n
+        self.exact += int(exact.sum())
+        return scores, exact
+
+    def _beats_gapped(self, q: np.ndarray, t: np.ndarray, band: np.ndarray, ungapped: np.ndarray) -> np.ndarray:
+        """Checks that no alignment with gaps can outscore the ungapped one
+
+        Args:
+            q (np.ndarray): encoded queries, one row per pair
+            t (np.ndarray): encoded targets of the same length
+            band (np.ndarray): q == t, widened in place to the diagonals within each gap length
+            ungapped (np.ndarray): the ungapped score of each pair
+
+        Returns:
+            np.ndarray: mask of the pairs whose ungapped score is optimal
+        """
+        length = q.shape[1]
+        # Any further gap position scores at most the larger of the two gap scores
+        gap_step = max(self.open_gap_score, self.extend_gap_score)
+        exact = np.ones(len(q), dtype=bool)
+        for x in range(1, length + 1):
+            if x < length:
+                band[:, :-x] |= q[:, :-x] == t[:, x:]
+                band[:, x:] |= q[:, x:] == t[:, :-x]
+            gaps = 2 * (self.open_gap_score + (x - 1) * gap_step)
+            matches = np.minimum(band.sum(axis=1), length - x)
+            exact &= ungapped >= matches * self.match_score + (length - x - matches) * self.mismatch_score + gaps
+            # Longer gaps leave fewer aligned columns, so once the best case is out of reach for every pair, stop
+            if (~exact).all() or (ungapped[exact] >= (length - x - 1) * self.match_score + 2 * (self.open_gap_score + x * gap_step)).all():
+                break
+        return exact
+
+    def record_comparison(self, scores: np.ndarray, exact: np.ndarray, gapped: np.ndarray) -> None:
+        """Counts the pairs accepted by the ungapped path whose gapped score differs, in compare mode
+
+        Args:
+            scores (np.ndarray): the ungapped scores returned by score
+            exact (np.ndarray): the mask returned by score
+            gapped (np.ndarray): the gapped aligner's scores of the same pairs
+        """
+        self.disagreements += int((scores[exact] != gapped[exact]).sum())
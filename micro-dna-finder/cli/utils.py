@@ -1,42 +1,301 @@
 import pysam
-from Bio import Align
-from alignment_models import AlignmentDetails, AlignerDetails
-from colorama import Fore
+from alignment_models import AlignmentDetails, ScanOptions, ScanStats, SiteTable, CandidateTable, CANDIDATE_DTYPE
 import logging
+import numpy as np
+import time
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress, islice, repeat
+from typing import Callable, Iterable, Iterator, TypeVar
+from collections import OrderedDict, deque
 from beautiful_printer import status_message
+from seeding import SeedFilter
+from reference_store import ReferenceGenome
+from ungapped import UngappedScorer
+from sketch import CountMinSketch
+from aligners import autotune_backend, get_backend, BackendChoice, BiopythonBackend
 logger = logging.getLogger(__name__)
 
-@status_message("Locating Soft-Clips")
-def find_soft_clips(bam: pysam.AlignmentFile, start: bool) -> dict[int, AlignmentDetails]:
-    """Finds soft-clipped reads in a BAM file
+T = TypeVar("T")
+
+def _collect_soft_clips(reads, start_scr: dict[int, AlignmentDetails], end_scr: dict[int, AlignmentDetails], options: ScanOptions | None = None,
+                        admit: Callable[[int], int] | None = None) -> tuple[int, int]:
+    """Records the start and end soft-clips of an iterable of reads into the given dictionaries
 
     Args:
-        bam (pysam.AlignmentFile): the alignment file to find soft-clips in
-        start (bool): flag to indicate if the soft-clip is at the start or end of the read
+        reads (Iterable[pysam.AlignedSegment]): the reads to inspect
+        start_scr (dict[int, AlignmentDetails]): dictionary of starting soft-clips, updated in place
+        end_scr (dict[int, AlignmentDetails]): dictionary of ending soft-clips, updated in place
+        options (ScanOptions | None, optional): what to store for each site and which reads to skip, or None for the defaults of ScanOptions. Defaults to None.
+        admit (Callable[[int], int] | None, optional): called with the site key (2 * position, plus 1 for end soft-clips) of every read
+            at a position without a record yet; returns the count the new record starts with, or 0 to skip the read.
+            None creates a record for every site. Defaults to None.
 
     Returns:
-        dict[int, AlignmentDetails]: 1-based position of the soft-clip in the reference genome and the corresponding sequence, support count, and length of the soft-clip for start soft-clips
+        tuple[int, int]: number of reads inspected, and how many of them were skipped for their flags or mapping quality
     """
-    # In the format {position: [clipped_seq]}
-    scr: dict[int, AlignmentDetails] = {} 
-    # Iterate through each read in the BAM file, resetting the iterator every time
-    for read in bam.fetch():
+    options = options if options is not None else ScanOptions()
+    anchor_len = options.anchor_len
+    consensus = options.consensus
+    exclude_flags = options.exclude_flags
+    min_mapq = options.min_mapq
+    n_reads = 0
+    n_filtered = 0
+    for read in reads:
+        n_reads += 1
+        # Flag and mapping quality are plain fields of the record, so rejected reads cost no CIGAR decoding
+        if read.flag & exclude_flags or (min_mapq and read.mapping_quality < min_mapq):
+            n_filtered += 1
+            continue
+        # Most reads have no soft-clip at all, which htslib tells from the aligned length without building the
+        # CIGAR tuples. Reads without a CIGAR, e.g. unmapped ones if exclude_flags lets them through, also stop here
+        if read.query_alignment_length == read.query_length:
+            continue
         cigars = read.cigartuples
-        seq = read.query_sequence
-        pos = read.reference_start + 1
+        first_op = cigars[0][0]
+        last_op = cigars[-1][0]
         # Soft-clip at start
-        if cigars[0][0] == 4 and cigars[-1][0] == 0 and start:
-            if pos not in scr:
-                scr[pos] = AlignmentDetails(seq, sc_len=cigars[0][1])
+        if first_op == 4 and last_op == 0:
+            pos = read.reference_start + 1
+            details = start_scr.get(pos)
+            if details is not None and not consensus:
+                details.update_count()
+                continue
+            count = 1
+            if details is None and admit is not None:
+                count = admit(2 * pos)
+                if not count:
+                    continue
+            # Reads stored without their sequence, like many secondary alignments, only add support to known sites
+            seq = read.query_sequence
+            if seq is None:
+                if details is not None:
+                    details.update_count()
+                continue
+            clip_len = cigars[0][1]
+            if anchor_len is None:
+                start_scr[pos] = AlignmentDetails(seq, sc_len=clip_len, count=count)
+                continue
+            # Keep the clipped bases and the first anchor_len aligned bases
+            segment = seq[:clip_len + anchor_len].encode("ascii")
+            if details is None:
+                details = start_scr[pos] = AlignmentDetails(segment, sc_len=clip_len, count=count, junction=clip_len, ref_start=max(read.reference_start - clip_len, 0))
             else:
-                scr[pos].update_count()   
+                details.update_count()
+            # Every start soft-clip at this position shares the same junction
+            if consensus:
+                details.add_to_profile(segment, clip_len)
         # Soft-clip at end
-        elif cigars[0][0] == 0 and cigars[-1][0] == 4 and not start:
-            if pos not in scr:
-                scr[pos] = AlignmentDetails(seq)
+        elif first_op == 0 and last_op == 4:
+            pos = read.reference_start + 1
+            details = end_scr.get(pos)
+            if details is not None and not consensus:
+                details.update_count()
+                continue
+            count = 1
+            if details is None and admit is not None:
+                count = admit(2 * pos + 1)
+                if not count:
+                    continue
+            seq = read.query_sequence
+            if seq is None:
+                if details is not None:
+                    details.update_count()
+                continue
+            if anchor_len is None:
+                end_scr[pos] = AlignmentDetails(seq, count=count)
+                continue
+            # Keep the last anchor_len aligned bases and the clipped bases
+            aligned_end = len(seq) - cigars[-1][1]
+            anchor_start = max(aligned_end - anchor_len, 0)
+            segment = seq[anchor_start:].encode("ascii")
+            junction = aligned_end - anchor_start
+            if details is None:
+                details = end_scr[pos] = AlignmentDetails(segment, count=count, junction=junction, ref_start=read.reference_end - junction)
             else:
-                scr[pos].update_count()
-    return scr
+                details.update_count()
+            # End soft-clips are keyed by the read start, so only reads ending at the same junction can vote
+            if consensus and read.reference_end == details.ref_start + details.junction:
+                details.add_to_profile(segment, junction)
+    return n_reads, n_filtered
+
+def _scan_reads(fetch: Callable[[], Iterable], start_scr: dict[int, AlignmentDetails], end_scr: dict[int, AlignmentDetails], options: ScanOptions | None = None) -> tuple[int, int]:
+    """Records the soft-clips of the reads returned by fetch, through a Count-Min sketch when options.sketch_width is set.
+    A site then only gets a record, sequence included, once its estimated count reaches options.sketch_min_count, so the
+    many sites that never reach the support threshold cost a few counters instead of a record. Its count starts from the
+    estimate, which can be too high where sites collide in the sketch, and the reads before it are not stored. With
+    options.sketch_exact the reads are fetched again and only the sites that got a record are counted, exactly, which
+    gives the same high-support sites as a scan without the sketch.
+
+    Args:
+        fetch (Callable[[], Iterable]): returns the reads to scan, called a second time with options.sketch_exact
+        start_scr (dict[int, AlignmentDetails]): dictionary of starting soft-clips, updated in place
+        end_scr (dict[int, AlignmentDetails]): dictionary of ending soft-clips, updated in place
+        options (ScanOptions | None, optional): what to store for each site and which reads to skip, or None for the defaults of ScanOptions. Defaults to None.
+
+    Returns:
+        tuple[int, int]: number of reads inspected, and how many of them were skipped for their flags or mapping quality
+    """
+    options = options if options is not None else ScanOptions()
+    if not options.sketch_width:
+        return _collect_soft_clips(fetch(), start_scr, end_scr, options)
+    sketch = CountMinSketch(options.sketch_width, options.sketch_depth)
+    min_count = options.sketch_min_count
+
+    def admit(key: int) -> int:
+        count = sketch.add(key)
+        return count if count >= min_count else 0
+
+    if not options.sketch_exact:
+        return _collect_soft_clips(fetch(), start_scr, end_scr, options, admit)
+    candidate_starts: dict[int, AlignmentDetails] = {}
+    candidate_ends: dict[int, AlignmentDetails] = {}
+    n_reads, n_filtered = _collect_soft_clips(fetch(), candidate_starts, candidate_ends, options, admit)
+    candidates = {2 * pos for pos in candidate_starts} | {2 * pos + 1 for pos in candidate_ends}
+    del sketch, candidate_starts, candidate_ends
+    _collect_soft_clips(fetch(), start_scr, end_scr, options, lambda key: 1 if key in candidates else 0)
+    return n_reads, n_filtered
+
+@status_message("Locating Soft-Clips")
+def find_soft_clips(bam: pysam.AlignmentFile, options: ScanOptions | None = None, contig: str | None = None) -> tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], ScanStats]:
+    """Finds start and end soft-clipped reads in a BAM file in a single traversal
+
+    Args:
+        bam (pysam.AlignmentFile): the alignment file to find soft-clips in
+        options (ScanOptions | None, optional): what to store for each site and which reads to skip, or None for the defaults of ScanOptions. Defaults to None.
+        contig (str | None, optional): contig to scan, or None to scan every read, in which case positions of different contigs share one table. Defaults to None.
+
+    Returns:
+        tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], ScanStats]: the start and end soft-clip dictionaries,
+        each mapping the 1-based position of the soft-clip in the reference genome to the corresponding sequence, support count,
+        and length of the soft-clip (start soft-clips only), followed by the read throughput of the scan
+    """
+    # In the format {position: [clipped_seq]}
+    start_scr: dict[int, AlignmentDetails] = {}
+    end_scr: dict[int, AlignmentDetails] = {}
+    t0 = time.perf_counter()
+    # Iterate through each read in the BAM file once, filling both tables
+    n_reads, n_filtered = _scan_reads(lambda: bam.fetch(contig), start_scr, end_scr, options)
+    return start_scr, end_scr, ScanStats(n_reads, time.perf_counter() - t0, n_filtered)
+
+def get_scan_regions(bam: pysam.AlignmentFile, chunk_size: int = 5_000_000, contig: str | None = None) -> list[tuple[str, int, int]]:
+    """Splits the contigs of an indexed BAM file into fixed-size regions, skipping contigs without reads
+
+    Args:
+        bam (pysam.AlignmentFile): the indexed alignment file
+        chunk_size (int, optional): maximum length of a region in base pairs. Defaults to 5,000,000.
+        contig (str | None, optional): only split this contig, or None to split all of them. Defaults to None.
+
+    Returns:
+        list[tuple[str, int, int]]: (contig, 0-based start, 0-based exclusive end) regions in BAM header order
+    """
+    populated = {s.contig for s in bam.get_index_statistics() if s.total > 0}
+    regions = []
+    for name, length in zip(bam.references, bam.lengths):
+        if name not in populated or (contig is not None and name != contig):
+            continue
+        for chunk_start in range(0, length, chunk_size):
+            regions.append((name, chunk_start, min(chunk_start + chunk_size, length)))
+    return regions
+
+def get_sample_contigs(bam: pysam.AlignmentFile, reference: ReferenceGenome) -> list[str]:
+    """Lists the contigs of a BAM file that hold reads and are present in the reference, in BAM header order.
+    Contigs missing from the reference are skipped with a warning
+
+    Args:
+        bam (pysam.AlignmentFile): the indexed alignment file
+        reference (ReferenceGenome): the reference genome
+
+    Returns:
+        list[str]: names of the contigs to process
+    """
+    populated = {s.contig for s in bam.get_index_statistics() if s.total > 0}
+    contigs = []
+    for name in bam.references:
+        if name not in populated:
+            continue
+        if name not in reference:
+            logger.warning("Skipping contig %s: it has reads but is not in the reference", name)
+            continue
+        contigs.append(name)
+    return contigs
+
+def _scan_region(bam_path: str, region: tuple[str, int, int], options: ScanOptions | None = None, threads: int = 1) -> tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], int, int]:
+    """Worker entry point that collects the soft-clips of reads starting inside a single region
+
+    Args:
+        bam_path (str): path of the indexed BAM file, opened separately by every worker
+        region (tuple[str, int, int]): (contig, 0-based start, 0-based exclusive end) region to scan
+        options (ScanOptions | None, optional): what to store for each site and which reads to skip, or None for the defaults of ScanOptions. Defaults to None.
+        threads (int, optional): number of htslib decompression threads of the worker. Defaults to 1.
+
+    Returns:
+        tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], int, int]: the start and end soft-clips of the region,
+        the number of reads inspected and how many of them were skipped for their flags or mapping quality
+    """
+    contig, region_start, region_end = region
+    start_scr: dict[int, AlignmentDetails] = {}
+    end_scr: dict[int, AlignmentDetails] = {}
+    with pysam.AlignmentFile(bam_path, "rb", threads=threads) as bam:
+        # fetch() returns every read overlapping the region. Reads that begin in an earlier region are
+        # skipped so that each read is counted exactly once, by the region holding its start position
+        fetch = lambda: (read for read in bam.fetch(contig, region_start, region_end) if read.reference_start >= region_start)
+        n_reads, n_filtered = _scan_reads(fetch, start_scr, end_scr, options)
+    return start_scr, end_scr, n_reads, n_filtered
+
+def _merge_soft_clips(merged: dict[int, AlignmentDetails], part: dict[int, AlignmentDetails]) -> None:
+    """Merges the soft-clips of a region into the running dictionary, keeping the first sequence seen at each position
+
+    Args:
+        merged (dict[int, AlignmentDetails]): the running dictionary of soft-clips, updated in place
+        part (dict[int, AlignmentDetails]): the soft-clips of the next region
+    """
+    for pos, details in part.items():
+        if pos not in merged:
+            merged[pos] = details
+        else:
+            merged[pos].merge(details)
+
+@status_message("Locating Soft-Clips")
+def find_soft_clips_parallel(bam_path: str, workers: int, chunk_size: int = 5_000_000, options: ScanOptions | None = None, contig: str | None = None, threads: int = 1,
+                             executor: ProcessPoolExecutor | None = None) -> tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], ScanStats]:
+    """Finds start and end soft-clipped reads in a sorted, indexed BAM file using a pool of worker processes.
+    The genome is split into contig/chunk regions, and the per-region results are merged in region order,
+    so the output is identical to find_soft_clips. A run scanning contig by contig should pass the same
+    executor every time, e.g. AlignmentEngine.executor, so the pool is started once and shared with the alignment.
+
+    Args:
+        bam_path (str): path of the sorted, indexed BAM file
+        workers (int): number of worker processes
+        chunk_size (int, optional): maximum length of a region in base pairs. Defaults to 5,000,000.
+        options (ScanOptions | None, optional): what to store for each site and which reads to skip, or None for the defaults of ScanOptions. Defaults to None.
+        contig (str | None, optional): contig to scan, or None to scan every contig into shared tables. Defaults to None.
+        threads (int, optional): number of htslib decompression threads of each worker. Defaults to 1.
+        executor (ProcessPoolExecutor | None, optional): pool to scan the regions in, or None to start one of workers processes for this call. Defaults to None.
+
+    Returns:
+        tuple[dict[int, AlignmentDetails], dict[int, AlignmentDetails], ScanStats]: the start and end soft-clip dictionaries and the read throughput of the scan
+    """
+    start_scr: dict[int, AlignmentDetails] = {}
+    end_scr: dict[int, AlignmentDetails] = {}
+    n_reads = n_filtered = 0
+    t0 = time.perf_counter()
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        regions = get_scan_regions(bam, chunk_size, contig)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # map() yields in submission order, which keeps the merge deterministic
+        for region_start_scr, region_end_scr, region_reads, region_filtered in executor.map(_scan_region, repeat(bam_path), regions, repeat(options), repeat(threads)):
+            _merge_soft_clips(start_scr, region_start_scr)
+            _merge_soft_clips(end_scr, region_end_scr)
+            n_reads += region_reads
+            n_filtered += region_filtered
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return start_scr, end_scr, ScanStats(n_reads, time.perf_counter() - t0, n_filtered)
 
 @status_message("Filtering high-support soft-clips")
 def find_high_support_sites(soft_clips_dict: dict[int, AlignmentDetails], min_support: int = 10) -> dict[int, AlignmentDetails]:
@@ -55,6 +314,63 @@ def find_high_support_sites(soft_clips_dict: dict[int, AlignmentDetails], min_su
             hi_supp[key] = val
     return hi_supp
 
+def split_clusters(positions: list[int], tolerance: int) -> list[list[int]]:
+    """Groups sorted positions into clusters, starting a new cluster wherever two neighbours are more than tolerance apart
+
+    Args:
+        positions (list[int]): the positions, in ascending order
+        tolerance (int): largest distance in base pairs between neighbouring members of a cluster
+
+    Returns:
+        list[list[int]]: the clusters in ascending order, each listing its member positions
+    """
+    clusters: list[list[int]] = []
+    for pos in positions:
+        if clusters and pos - clusters[-1][-1] <= tolerance:
+            clusters[-1].append(pos)
+        else:
+            clusters.append([pos])
+    return clusters
+
+def merge_cluster(sites: dict[int, AlignmentDetails], members: list[int]) -> tuple[int, AlignmentDetails]:
+    """Merges the sites of a cluster into its representative, the member with the most support (the leftmost on ties),
+    which keeps its own sequence and takes the summed support of all members
+
+    Args:
+        sites (dict[int, AlignmentDetails]): the sites, by position
+        members (list[int]): positions of the members of the cluster
+
+    Returns:
+        tuple[int, AlignmentDetails]: position and details of the representative
+    """
+    rep = max(members, key=lambda pos: (sites[pos].count, -pos))
+    details = sites[rep]
+    for pos in members:
+        if pos != rep:
+            details.merge(sites[pos])
+    return rep, details
+
+@status_message("Clustering nearby soft-clip sites")
+def cluster_sites(sites: dict[int, AlignmentDetails], tolerance: int) -> tuple[dict[int, AlignmentDetails], dict[int, list[int]]]:
+    """Collapses sites lying within tolerance of each other into one representative per cluster, see merge_cluster,
+    so neighbouring clip positions of the same breakpoint are only aligned once
+
+    Args:
+        sites (dict[int, AlignmentDetails]): the high-support sites, whose details are merged in place
+        tolerance (int): largest distance in base pairs between neighbouring members of a cluster
+
+    Returns:
+        tuple[dict[int, AlignmentDetails], dict[int, list[int]]]: the representatives in position order,
+        and the member positions of each representative
+    """
+    representatives: dict[int, AlignmentDetails] = {}
+    members: dict[int, list[int]] = {}
+    for cluster in split_clusters(sorted(sites), tolerance):
+        pos, details = merge_cluster(sites, cluster)
+        representatives[pos] = details
+        members[pos] = cluster
+    return representatives, members
+
 def get_seq_from_pos(start_pos: int, end_post: int, contig: str) -> str:
     """Gets the sequence from a contig at specified positions
 
@@ -69,108 +385,327 @@ def get_seq_from_pos(start_pos: int, end_post: int, contig: str) -> str:
     seq = contig[start_pos:end_post]
     return seq
 
-def aligner_init(match_score: int = 2, mismatch_score: int = -1, open_gap_score: int = -0.5, extend_gap_score: int = -0.1, mode: str = 'global', sc: bool = False) -> Align.PairwiseAligner:
-    """Initializes the pairwise aligner with the specified parameters
+# Scoring schemes of the two alignment steps, as keyword arguments to aligner_init
+SC_ALIGNER_PARAMS = {"match_score": 2, "mismatch_score": -2, "open_gap_score": -1, "extend_gap_score": -0.5, "sc": True}
+REF_ALIGNER_PARAMS = {"match_score": 2, "mismatch_score": -3, "open_gap_score": -25, "extend_gap_score": -6, "mode": "global"}
+# Soft-clip alignment score a pair must exceed to be aligned with the reference
+MIN_READ_SCORE = 50
+
+def max_read_score(anchor_len: int | None) -> float | None:
+    """Gets the highest soft-clip alignment score a pair of clipped segments can reach. Both segments of a junction
+    cover it from anchor_len bases before to anchor_len bases after at most, so they share at most 2 * anchor_len bases
 
     Args:
-        match_score (int, optional): match score defined in BioPython. Defaults to 2.
-        mismatch_score (int, optional): mismatch score defined in BioPython. Defaults to -1.
-        open_gap_score (int, optional): open gap score defined in BioPython. Defaults to -0.5.
-        extend_gap_score (int, optional): extend gap score defined in BioPython. Defaults to -0.1.
-        mode (str, optional): 'global' or 'local' mode which determines the aligner methods. Defaults to 'global'.
-        sc (bool, optional): flag to determine if the alignment is on two soft-clips. Defaults to False.
+        anchor_len (int | None): number of aligned bases kept next to each soft-clip, or None for whole reads
 
     Returns:
-        Align.PairwiseAligner: the initialized pairwise aligner
+        float | None: the highest score, or None for whole reads, whose score is only bounded by the read length
     """
-    aligner = Align.PairwiseAligner()
-    aligner.mode = mode
-    aligner.match_score = match_score
-    aligner.mismatch_score = mismatch_score
-    aligner.open_gap_score = open_gap_score
-    aligner.extend_gap_score = extend_gap_score
-    if sc:
-        aligner.query_left_open_gap_score = -0.1
-        aligner.query_right_open_gap_score = -0.1
-        aligner.query_left_extend_gap_score = -0.1
-        aligner.query_right_extend_gap_score = -0.1 
-    # logger.info(f"Pairwise sequence alignment initialized using the {Fore.BLUE}{aligner.algorithm}{Fore.RESET} with {Fore.BLUE}{aligner.mode}{Fore.RESET} mode.")
-    return aligner
+    if anchor_len is None:
+        return None
+    return 2 * anchor_len * SC_ALIGNER_PARAMS["match_score"]
 
-def align_strs(aligner: Align.PairwiseAligner, query: str, target: str) -> AlignerDetails:
-    """Aligns two sequences in string format using the specified aligner
+# Aligners built in this process are cached by aligners.get_backend. Worker processes fill their own copy
+def _score_batch(backend: str, params_key: tuple, pairs: list[tuple[str, str]]) -> list[float]:
+    """Worker entry point that scores a batch of (query, target) pairs
 
     Args:
-        aligner (Align.PairwiseAligner): the pairwise aligner
-        query (str): the query sequence
-        target (str): the target sequence (another soft-clip or the reference genome)
+        backend (str): name of the aligner backend
+        params_key (tuple): the aligner_init parameters as a tuple of (name, value) items
+        pairs (list[tuple[str, str]]): the sequences to score
 
     Returns:
-        AlignerDetails: the alignment details including the alignment sequence and score
+        list[float]: the alignment scores, in the order of the pairs
     """
-    alignments = aligner.align(query, target)
-    # If no alignments are found, return None and a score of -inf to make evidence score calculation alter
-    if not alignments:
-        return AlignerDetails(None, float("-inf"))
-    alignment = alignments[0]
-    score = alignment.score
-    return AlignerDetails(alignment, score)
+    return get_backend(backend, params_key).score_batch(pairs)
 
-@status_message("Aligning starting soft-clips with ending soft-clips")
-def align_soft_clips(start_hsc: dict, end_hsc: dict) -> list[dict]:
-    """Brute-force aligns all starting soft-clips with all ending soft-clips
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
+class AlignmentEngine:
+    """Scores sequence pairs with aligner backends built from aligner_init parameters, either in this process or in batches
+    across a pool of worker processes. Workers build each backend once and only send scores back, and batches are
+    returned in submission order, so both modes produce identical results.
+
+    Every scheme is scored with Biopython unless another backend is pinned for it with use_backend. With autotune, the
+    first sample_size pairs of each scheme are scored with Biopython and then used to time every usable backend, and the
+    fastest one whose scores are all within tolerance of Biopython's scores the rest, see aligners.autotune_backend.
+    A pinned backend is checked on the same sample and only scores the rest if it agrees with Biopython, so a backend
+    never changes the results by more than tolerance.
 
     Args:
-        start_hsc (dict): dictionary of starting soft-clips
-        end_hsc (dict): dictionary of ending soft-clips
+        workers (int, optional): number of worker processes, 1 to score in this process. Defaults to 1.
+        batch_size (int, optional): number of pairs scored or sent to a worker at a time. Defaults to 1024.
+        autotune (bool, optional): flag to pick the fastest agreeing backend per scheme on the run's own pairs. Defaults to False.
+        tolerance (float, optional): largest accepted absolute score difference from Biopython of an autotuned or pinned backend. Defaults to 0.0.
+        sample_size (int, optional): number of pairs of each scheme autotuning and the check of pinned backends run on. Defaults to 512.
+    """
+    def __init__(self, workers: int = 1, batch_size: int = 1024, autotune: bool = False, tolerance: float = 0.0, sample_size: int = 512):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.autotune = autotune
+        self.tolerance = tolerance
+        self.sample_size = sample_size
+        self._choices: dict[tuple, BackendChoice] = {}
+        self._pinned: dict[tuple, str] = {}
+        self._samples: dict[tuple, list[tuple[str, str]]] = {}
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
 
-    Returns:
-        list[dict]: list of dictionaries containing the alignment details for each pair of starting and ending soft-clips
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor | None:
+        """The worker pool of the engine, or None when it scores in this process. Other stages of a run, e.g.
+        find_soft_clips_parallel, can submit their work to it, so the run starts at most workers processes"""
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def use_backend(self, params: dict, name: str) -> None:
+        """Pins the backend a scheme is scored with, which is then never autotuned. Unless it is Biopython, it is first
+        checked on the scheme's first sample_size pairs, and Biopython scores the rest if the check fails
+
+        Args:
+            params (dict): keyword arguments for aligner_init
+            name (str): name of a registered backend
+        """
+        params_key = tuple(params.items())
+        if name == BiopythonBackend.name:
+            self._choices[params_key] = BackendChoice(name)
+        else:
+            self._pinned[params_key] = name
+
+    def backend_choice(self, params: dict) -> BackendChoice | None:
+        """Returns the backend scoring a scheme, or None while autotuning has not seen enough of its pairs
+
+        Args:
+            params (dict): keyword arguments for aligner_init
+
+        Returns:
+            BackendChoice | None: the backend, with the timings behind the choice when it was autotuned
+        """
+        return self._choices.get(tuple(params.items()))
+
+    def sampled_pairs(self, params: dict) -> int:
+        """Returns how many pairs of a scheme have been collected for autotuning so far"""
+        return len(self._samples.get(tuple(params.items()), ()))
+
+    def _tune(self, params: dict, params_key: tuple, items: Iterator[T], seqs: Callable[[T], tuple[str, str]]) -> Iterator[tuple[T, float]]:
+        # Sampled pairs are scored with Biopython, the reference every candidate backend has to agree with
+        sample = self._samples.setdefault(params_key, [])
+        reference = get_backend(BiopythonBackend.name, params_key)
+        for item in items:
+            pair = seqs(item)
+            sample.append(pair)
+            yield item, reference.score(*pair)
+            if len(sample) >= self.sample_size:
+                pinned = self._pinned.get(params_key)
+                choice = autotune_backend(params, sample, [pinned] if pinned else None, tolerance=self.tolerance)
+                if pinned in choice.rejected:
+                    logger.warning("Scoring with biopython instead of %s: %s", pinned, choice.rejected[pinned])
+                self._choices[params_key] = choice
+                del self._samples[params_key]
+                return
+
+    def score(self, params: dict, items: Iterable[T], seqs: Callable[[T], tuple[str, str]]) -> Iterator[tuple[T, float]]:
+        """Scores the sequence pair of every item. Items stay in this process and only their sequences are sent to the workers
+
+        Args:
+            params (dict): keyword arguments for aligner_init
+            items (Iterable[T]): the items to score
+            seqs (Callable[[T], tuple[str, str]]): function returning the (query, target) sequences of an item
+
+        Yields:
+            Iterator[tuple[T, float]]: each item with its alignment score, in input order
+        """
+        params_key = tuple(params.items())
+        items = iter(items)
+        if params_key not in self._choices:
+            if not self.autotune and params_key not in self._pinned:
+                self._choices[params_key] = BackendChoice(BiopythonBackend.name)
+            else:
+                yield from self._tune(params, params_key, items, seqs)
+                if params_key not in self._choices:
+                    return
+        name = self._choices[params_key].name
+        if self._executor is None:
+            backend = get_backend(name, params_key)
+            for batch in _batched(items, self.batch_size):
+                yield from zip(batch, backend.score_batch([seqs(item) for item in batch]))
+            return
+        # Keep a bounded number of batches in flight so large inputs are never fully materialized
+        in_flight = deque()
+        for batch in _batched(items, self.batch_size):
+            in_flight.append((batch, self._executor.submit(_score_batch, name, params_key, [seqs(item) for item in batch])))
+            if len(in_flight) >= 2 * self.workers:
+                batch, future = in_flight.popleft()
+                yield from zip(batch, future.result())
+        while in_flight:
+            batch, future = in_flight.popleft()
+            yield from zip(batch, future.result())
+
+def pair_sites(start_sites: SiteTable, end_sites: SiteTable, min_span: int = 6, max_span: int | None = None, chunk_size: int = 65536) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Pairs every starting soft-clip with the ending soft-clips that lie inside the [min_span, max_span] window after it.
+    The ending positions are sorted once and each window is located by binary search, so the number of pairs
+    grows with the local density of sites rather than with the product of both table sizes.
+
+    Args:
+        start_sites (SiteTable): table of starting soft-clips
+        end_sites (SiteTable): table of ending soft-clips
+        min_span (int, optional): minimum distance between the start and end positions, inclusive. Defaults to 6.
+        max_span (int | None, optional): maximum distance between the start and end positions, inclusive, or None for no limit. Defaults to None.
+        chunk_size (int, optional): maximum number of pairs yielded at a time. Defaults to 65536.
+
+    Yields:
+        Iterator[tuple[np.ndarray, np.ndarray]]: (start site index, end site index) arrays, ordered by start site and then by end position
     """
-    results = []
-    a = aligner_init(2, -2, -1, -0.5, sc=True)
-    for start_pos, start_value in start_hsc.items():
-        start_seq = start_value.seq
-        for end_pos, end_value in end_hsc.items():
-            end_seq = end_value.seq
-            # Get best alignment
-            res = align_strs(a, start_seq, end_seq)
-            results.append({
-                "start_pos": start_pos,
-                "end_pos": end_pos,
-                "score": res.score,
-                "alignment": res.alignment,
-                "start_seq":start_seq,
-                "end_seq":end_seq,
-                "start_len": start_value.sc_len,
-            })
-    
-    return results
+    end_order = np.argsort(end_sites.positions, kind="stable")
+    end_positions = end_sites.positions[end_order]
+    lo = np.searchsorted(end_positions, start_sites.positions + min_span, side="left")
+    if max_span is None:
+        hi = np.full_like(lo, len(end_positions))
+    else:
+        hi = np.searchsorted(end_positions, start_sites.positions + max_span, side="right")
+    counts = np.maximum(hi - lo, 0)
+    offsets = np.cumsum(counts)
+    total = int(offsets[-1]) if len(offsets) else 0
+    # Number the pairs 0..total-1 and recover the start site and window offset of each from the running counts
+    for chunk_start in range(0, total, chunk_size):
+        k = np.arange(chunk_start, min(chunk_start + chunk_size, total), dtype=np.int64)
+        start_idx = np.searchsorted(offsets, k, side="right")
+        end_idx = end_order[lo[start_idx] + k - (offsets[start_idx] - counts[start_idx])]
+        yield start_idx, end_idx
 
-def align_with_reference(reference: str, position: int, short_clip: str, aligner: Align.PairwiseAligner, start_len: int = 0) -> dict:
-    """Aligns a soft-clip with the reference genome at a specified position
+def align_soft_clips(start_sites: SiteTable, end_sites: SiteTable, min_span: int = 6, max_span: int | None = None, seed_filter: SeedFilter | None = None, engine: AlignmentEngine | None = None,
+                     exclude: Callable[[np.ndarray, np.ndarray], np.ndarray] | None = None) -> Iterator[CandidateTable]:
+    """Aligns each starting soft-clip with the ending soft-clips inside its span window, yielding the pairs chunk by chunk as they are scored
+
+    Args:
+        start_sites (SiteTable): table of starting soft-clips
+        end_sites (SiteTable): table of ending soft-clips
+        min_span (int, optional): minimum distance between the start and end positions, inclusive. Defaults to 6.
+        max_span (int | None, optional): maximum distance between the start and end positions, inclusive, or None for no limit. Defaults to None.
+        seed_filter (SeedFilter | None, optional): k-mer screen applied before aligning each pair, or None to align every pair. Defaults to None.
+        engine (AlignmentEngine | None, optional): engine scoring the pairs, or None to score them in this process. Defaults to None.
+        exclude (Callable[[np.ndarray, np.ndarray], np.ndarray] | None, optional): returns a mask of the (start site index, end site index)
+            pairs to leave out, e.g. the pairs a shard has already scored, or None to keep every pair. Defaults to None.
+
+    Yields:
+        Iterator[CandidateTable]: candidate pairs with their positions, site indices and soft-clip alignment score.
+        The alignments themselves are only built for the reported candidates by materialize_alignments
+    """
+    engine = engine or AlignmentEngine()
+    # The seed filter caches k-mers by site index, which only identifies a site within these tables
+    if seed_filter is not None:
+        seed_filter.clear()
+    for start_idx, end_idx in pair_sites(start_sites, end_sites, min_span, max_span):
+        if exclude is not None:
+            keep = ~exclude(start_idx, end_idx)
+            start_idx, end_idx = start_idx[keep], end_idx[keep]
+        # Skip pairs that do not share enough seeds to reach a useful alignment score
+        if seed_filter is not None:
+            keep = np.fromiter(
+                (seed_filter.passes(s, start_sites.seqs[s], e, end_sites.seqs[e]) for s, e in zip(start_idx.tolist(), end_idx.tolist())),
+                dtype=bool,
+                count=len(start_idx),
+            )
+            start_idx, end_idx = start_idx[keep], end_idx[keep]
+        rows = np.zeros(len(start_idx), dtype=CANDIDATE_DTYPE)
+        rows["start_pos"] = start_sites.positions[start_idx]
+        rows["end_pos"] = end_sites.positions[end_idx]
+        rows["start_site"] = start_idx
+        rows["end_site"] = end_idx
+        # Get best alignment score
+        pairs = zip(start_idx.tolist(), end_idx.tolist())
+        scored = engine.score(SC_ALIGNER_PARAMS, pairs, lambda pair: (start_sites.seqs[pair[0]], end_sites.seqs[pair[1]]))
+        rows["read_read_score"] = np.fromiter((score for _, score in scored), dtype=np.float64, count=len(rows))
+        yield CandidateTable(rows, start_sites, end_sites)
+
+def get_site_window(reference: str, position: int, short_clip: str, start_len: int = 0, ref_start: int = -1) -> str:
+    """Gets the reference sequence a site's soft-clip is aligned against. Clipped segments (ref_start >= 0)
+    are compared with a window of their own length, whole reads with the fixed 42 bp window
 
     Args:
         reference (str): the reference genome sequence
         position (int): the position of the soft-clip in the reference genome
         short_clip (str): the soft-clip sequence
-        aligner (Align.PairwiseAligner): the pairwise aligner
+        start_len (int, optional): the length of the soft-clip if it is a start soft-clip. Defaults to 0.
+        ref_start (int, optional): 0-based start of the window of a clipped segment, or -1 for a whole read. Defaults to -1.
+
+    Returns:
+        str: the reference sequence to align against
+    """
+    if ref_start < 0:
+        return get_reference_window(reference, position, start_len)
+    return reference[ref_start:ref_start + len(short_clip)]
+
+def get_reference_window(reference: str, position: int, start_len: int = 0) -> str:
+    """Gets the 42 bp reference window a soft-clip is aligned against
+
+    Args:
+        reference (str): the reference genome sequence
+        position (int): the position of the soft-clip in the reference genome
         start_len (int, optional): the length of the soft-clip if it is a start soft-clip. Defaults to 0.
 
     Returns:
-        dict: a dictionary containing the alignment details including the alignment sequence and score
+        str: the reference sequence starting at the first base covered by the read
     """
     position = position - 1 - start_len
-    ref_start_seq = reference[position:min(position + 42, len(reference) - 1)]
-    # Align soft-clip with reference start sequence
-    start_alignment = align_strs(aligner, ref_start_seq, short_clip)
-    # Align soft-clip with reference end sequence
-    result = {
-        "alignment": str(start_alignment.alignment),
-        "score": start_alignment.score,
-        "reference_sequence": ref_start_seq
-    }
-    return result
+    return reference[position:min(position + 42, len(reference) - 1)]
+
+class ReferenceAlignmentCache:
+    """Bounded least-recently-used cache of per-site reference alignment scores. A start position is often paired
+    with many nearby end positions, so the same reference window would otherwise be aligned against the same clip repeatedly.
+    hits and misses count lookups of the cache itself; chunk_repeats counts the candidates that reused the score of
+    the same site earlier in their chunk, which never reach the cache.
+
+    Args:
+        maxsize (int, optional): maximum number of cached scores. Defaults to 65536.
+    """
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.chunk_repeats = 0
+        self._entries: OrderedDict[tuple, float] = OrderedDict()
+
+    def get(self, key: tuple) -> float | None:
+        """Returns the cached score for a key, or None on a miss
+
+        Args:
+            key (tuple): (contig, position, clip sequence, start_len, window start, scoring parameters) of the reference alignment
+
+        Returns:
+            float | None: the reference alignment score
+        """
+        score = self._entries.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return score
+
+    def put(self, key: tuple, score: float) -> None:
+        """Stores a score, evicting the least recently used entry when the cache is full
+
+        Args:
+            key (tuple): (contig, position, clip sequence, start_len, window start, scoring parameters) of the reference alignment
+            score (float): the reference alignment score
+        """
+        self._entries[key] = score
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
 
 def create_evidence_score(sc_alignment: dict, start_ref_alignment: dict, end_ref_alignment: dict, ideal: int = 200) -> float:
     """Creates a score for the evidence based on the alignment scores of the soft-clip and the reference genome using weighted scoring and a quadratic penalty for the span of the soft-clip.
@@ -180,6 +715,7 @@ def create_evidence_score(sc_alignment: dict, start_ref_alignment: dict, end_ref
     The penalty is calculated as:
     penalty = ((span - ideal) / ideal) ** 2 + 1
     where span is the length of the soft-clip and ideal is the (arbitrary) ideal length of the soft-clip.
+    The values may also be NumPy columns, in which case the scores of a whole candidate table are computed at once.
 
     Args:
         sc_alignment (dict): dictionary containing the alignment details of the soft-clip
@@ -188,7 +724,7 @@ def create_evidence_score(sc_alignment: dict, start_ref_alignment: dict, end_ref
         ideal (int, optional): the ideal length of the soft-clip. Defaults to 200.
 
     Returns:
-        float: _description_
+        float: the evidence score, or an array of scores for column inputs
     """
     span = sc_alignment["end_pos"] - sc_alignment["start_pos"]
     # Quadratic function where the minimum penalty is at the ideal length and the penalty increases as the span deviates from the ideal length
@@ -200,50 +736,165 @@ def create_evidence_score(sc_alignment: dict, start_ref_alignment: dict, end_ref
     ) / penalty
     return score
 
-@status_message("Aligning soft-clips with reference genome")
-def generate_final_results(aligned_sc:list[dict], contig: str) -> list[dict]:
-    """Aligns soft-clips with the reference genome and filters out low-scoring alignments
-    and short soft-clips. The alignments are sorted by the evidence score in descending order.
+def _reference_scores(site_idx: np.ndarray, sites: SiteTable, contig: str, start_clips: bool, cache: ReferenceAlignmentCache | None, engine: AlignmentEngine, ungapped: UngappedScorer | None = None) -> np.ndarray:
+    """Scores the soft-clips of a column of sites against their reference windows, aligning each distinct site once
+
+    Args:
+        site_idx (np.ndarray): site indices of the candidates
+        sites (SiteTable): the table the indices refer to
+        contig (str): the reference genome sequence
+        start_clips (bool): flag to indicate the sites are start soft-clips, whose window is shifted by the clip length
+        cache (ReferenceAlignmentCache | None): cache of per-site reference alignment scores
+        engine (AlignmentEngine): engine scoring the reference alignments
+        ungapped (UngappedScorer | None, optional): scorer settling the sites whose ungapped score is provably optimal before the engine is used. Defaults to None.
+
+    Returns:
+        np.ndarray: the reference alignment score of each candidate
+    """
+    params_key = tuple(REF_ALIGNER_PARAMS.items())
+    unique_sites, inverse = np.unique(site_idx, return_inverse=True)
+    scores = np.empty(len(unique_sites), dtype=np.float64)
+    pending: list[tuple[int, tuple, str, str]] = []
+    for i, site in enumerate(unique_sites.tolist()):
+        position = int(sites.positions[site])
+        start_len = int(sites.sc_lens[site]) if start_clips else 0
+        ref_start = int(sites.ref_starts[site])
+        short_clip = sites.seqs[site]
+        key = (sites.contig, position, short_clip, start_len, ref_start, params_key)
+        score = cache.get(key) if cache is not None else None
+        if score is None:
+            pending.append((i, key, get_site_window(contig, position, short_clip, start_len, ref_start), short_clip))
+        else:
+            scores[i] = score
+    if ungapped is not None and pending:
+        ungapped_scores, exact = ungapped.score([site[2] for site in pending], [site[3] for site in pending])
+        if ungapped.compare:
+            compared = pending
+        else:
+            for (i, key, _, _), score in zip(compress(pending, exact), ungapped_scores[exact].tolist()):
+                scores[i] = score
+                if cache is not None:
+                    cache.put(key, score)
+            pending = list(compress(pending, ~exact))
+    for (i, key, _, _), score in engine.score(REF_ALIGNER_PARAMS, pending, lambda site: (site[2], site[3])):
+        scores[i] = score
+        if cache is not None:
+            cache.put(key, score)
+    if ungapped is not None and ungapped.compare and pending:
+        ungapped.record_comparison(ungapped_scores, exact, scores[[site[0] for site in compared]])
+    # Repeated sites within the chunk reuse the score computed above without a cache lookup
+    if cache is not None:
+        cache.chunk_repeats += len(site_idx) - len(unique_sites)
+    return scores[inverse]
+
+def generate_final_results(aligned_sc: Iterable[CandidateTable], contig: str, cache: ReferenceAlignmentCache | None = None, engine: AlignmentEngine | None = None, ungapped: UngappedScorer | None = None,
+                           min_read_score: float = MIN_READ_SCORE) -> Iterator[CandidateTable]:
+    """Aligns soft-clips with the reference genome and filters out low-scoring alignments.
+    Candidates are yielded chunk by chunk in discovery order; rank_candidates sorts them.
 
     Args:
-        aligned_sc (list[dict]): A list of dictionaries containing the alignment details of the soft-clips
+        aligned_sc (Iterable[CandidateTable]): candidate tables containing the soft-clip alignment scores
         contig (str): The reference genome sequence
+        cache (ReferenceAlignmentCache | None, optional): cache of per-site reference alignment scores, or None to align every site. Defaults to None.
+        engine (AlignmentEngine | None, optional): engine scoring the reference alignments, or None to score them in this process. Defaults to None.
+        ungapped (UngappedScorer | None, optional): ungapped scorer tried before the gapped reference aligner, or None to align every site. Defaults to None.
+        min_read_score (float, optional): soft-clip alignment score a pair must exceed to be kept. Defaults to MIN_READ_SCORE.
+
+    Yields:
+        Iterator[CandidateTable]: candidate tables with the reference and evidence scores filled in. The alignments
+        themselves are only needed by the txt report and are added by materialize_alignments
+    """
+    engine = engine or AlignmentEngine()
+    for table in aligned_sc:
+        rows = table.rows
+        # Filter out low-scoring alignments. pair_sites has already left out pairs closer than min_span
+        rows = rows[rows["read_read_score"] > min_read_score]
+        if not len(rows):
+            continue
+        # Align the start and end soft-clips with the reference genome
+        rows["start_ref_score"] = _reference_scores(rows["start_site"], table.start_sites, contig, True, cache, engine, ungapped)
+        rows["end_ref_score"] = _reference_scores(rows["end_site"], table.end_sites, contig, False, cache, engine, ungapped)
+        rows["evidence_score"] = create_evidence_score(
+            {"start_pos": rows["start_pos"], "end_pos": rows["end_pos"], "score": rows["read_read_score"]},
+            {"score": rows["start_ref_score"]},
+            {"score": rows["end_ref_score"]},
+        )
+        yield CandidateTable(rows, table.start_sites, table.end_sites)
+
+def _rank_order(table: CandidateTable) -> np.ndarray:
+    # Stable sort on the negated score keeps ties in discovery order, like sorted(..., reverse=True)
+    return np.argsort(-table.rows["evidence_score"], kind="stable")
+
+@status_message("Aligning soft-clips and ranking candidates")
+def rank_candidates(candidates: Iterable[CandidateTable], start_sites: SiteTable, end_sites: SiteTable, top_k: int | None = None) -> CandidateTable:
+    """Sorts the candidates by evidence score in descending order. With top_k, only the best top_k rows are kept
+    after each chunk, so memory depends on top_k rather than on the number of candidates.
+
+    Args:
+        candidates (Iterable[CandidateTable]): the candidate tables yielded by generate_final_results
+        start_sites (SiteTable): table of starting soft-clips the candidates refer to
+        end_sites (SiteTable): table of ending soft-clips the candidates refer to
+        top_k (int | None, optional): number of candidates to keep, or None to keep all of them. Defaults to None.
 
     Returns:
-        list[dict]: the filtered and sorted list of dictionaries containing the final alignment details
-    """
-    results = []
-    # Initialize the aligner for aligning soft-clips with the reference genome
-    aligner = aligner_init(2, -3, -25, -6, 'global')
-    for aligned in aligned_sc:
-        # Filter out low-scoring alignments and short soft-clips
-        if aligned['score'] > 50 and aligned['end_pos'] - aligned['start_pos'] > 5:
-            # Align the start and end soft-clips with the reference genome
-            ssc = align_with_reference(
-                reference=contig,
-                position=aligned['start_pos'],
-                short_clip=aligned['start_seq'],
-                aligner=aligner,
-                start_len = aligned['start_len']
-            )
-            esc = align_with_reference(
-                reference=contig,
-                position=aligned['end_pos'],
-                short_clip=aligned['end_seq'],
-                aligner=aligner
-            )
-            results.append({
-                "start_pos": aligned['start_pos'],
-                "end_pos": aligned['end_pos'],
-                "read_read_score": aligned['score'],
-                "read_read_alignment": str(aligned['alignment']),
-                "start_ref_score": ssc['score'],
-                "start_ref_alignment": ssc['alignment'],
-                "end_ref_score": esc['score'],
-                "end_ref_alignment": esc['alignment'],
-                "evidence_score": create_evidence_score(aligned, ssc, esc)
-            })
-    # Sort the results by the evidence score in descending order
-    results = sorted(results, key=lambda x: x["evidence_score"], reverse=True)
-    return results
+        CandidateTable: the best candidates, highest evidence score first. Ties keep their discovery order
+    """
+    if top_k is None:
+        tables = [table.rows for table in candidates]
+        kept = CandidateTable(np.concatenate(tables) if tables else np.empty(0, dtype=CANDIDATE_DTYPE), start_sites, end_sites)
+        return kept.take(_rank_order(kept))
+    kept = CandidateTable.empty(start_sites, end_sites)
+    for table in candidates:
+        kept = CandidateTable(np.concatenate([kept.rows, table.rows]), start_sites, end_sites)
+        kept = kept.take(_rank_order(kept)[:top_k])
+    return kept
+
+def rank_each(candidates: Iterable[CandidateTable], top_k: int | None = None) -> list[CandidateTable]:
+    """Sorts every candidate table on its own by evidence score, for tables referring to different site tables,
+    e.g. the batches of OnlineJunctionDetector. merge_ranked then combines them into one ranking
+
+    Args:
+        candidates (Iterable[CandidateTable]): the candidate tables
+        top_k (int | None, optional): number of candidates to keep per table, or None to keep all of them. Defaults to None.
+
+    Returns:
+        list[CandidateTable]: the sorted tables, highest evidence score first. Ties keep their discovery order
+    """
+    return [table.take(_rank_order(table)[:top_k]) for table in candidates]
 
+def merge_ranked(tables: list[CandidateTable], top_k: int | None = None) -> Iterator[dict]:
+    """Merges candidate tables that are each sorted by evidence score, e.g. one per contig, into one ranking.
+    Ties keep the order of the tables, so the result matches a single stable sort over all candidates
+
+    Args:
+        tables (list[CandidateTable]): the tables returned by rank_candidates
+        top_k (int | None, optional): number of candidates to yield, or None to yield all of them. Defaults to None.
+
+    Yields:
+        Iterator[dict]: the candidates as CandidateTable.records, highest evidence score first
+    """
+    merged = heapq.merge(*(table.records() for table in tables), key=lambda r: -r["evidence_score"])
+    return islice(merged, top_k)
+
+def materialize_alignments(results: Iterable[dict], reference: ReferenceGenome) -> Iterator[dict]:
+    """Builds the read-read and reference alignments of the final candidates, which the score-only
+    stages skip. Only the txt report needs them.
+
+    Args:
+        results (Iterable[dict]): the final candidates, as yielded by CandidateTable.records
+        reference (ReferenceGenome): the reference genome holding each candidate's contig
+
+    Yields:
+        Iterator[dict]: the same candidates with read_read_alignment, start_ref_alignment and end_ref_alignment filled in
+    """
+    # The report shows Biopython's formatting of the alignments, whichever backend scored them
+    sc_aligner = get_backend(BiopythonBackend.name, SC_ALIGNER_PARAMS)
+    ref_aligner = get_backend(BiopythonBackend.name, REF_ALIGNER_PARAMS)
+    for r in results:
+        contig = reference.contig(r["contig"])
+        start_ref_seq = get_site_window(contig, r["start_pos"], r["start_seq"], r["start_len"], r["start_ref_start"])
+        end_ref_seq = get_site_window(contig, r["end_pos"], r["end_seq"], ref_start=r["end_ref_start"])
+        r["read_read_alignment"] = str(sc_aligner.align(r["start_seq"], r["end_seq"]).alignment)
+        r["start_ref_alignment"] = str(ref_aligner.align(start_ref_seq, r["start_seq"]).alignment)
+        r["end_ref_alignment"] = str(ref_aligner.align(end_ref_seq, r["end_seq"]).alignment)
+        yield r
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli'))
+
+from batch import read_manifest, ManifestError
+
+def write_manifest(path, lines: list[str]) -> str:
+    path.write_text("".join(f"{line}\n" for line in lines))
+    return str(path)
+
+def test_default_outputs_are_named_after_the_bam_files(tmp_path):
+    manifest = write_manifest(tmp_path / "samples.tsv", ["# sample list", "a/one.bam", "", "b/two.bam\tnamed.csv"])
+    assert read_manifest(manifest, "out") == [
+        (str(tmp_path / "a" / "one.bam"), os.path.join("out", "one.csv")),
+        (str(tmp_path / "b" / "two.bam"), str(tmp_path / "named.csv")),
+    ]
+
+@pytest.mark.parametrize("lines", [
+    ["run1/sample.bam", "run2/sample.bam"],
+    ["run1/sample.bam", "other.bam\tout/sample.csv"],
+])
+def test_samples_writing_the_same_output_are_rejected(tmp_path, lines):
+    manifest = write_manifest(tmp_path / "samples.tsv", lines)
+    with pytest.raises(ManifestError, match="lines 1 and 2"):
+        read_manifest(manifest, str(tmp_path / "out"))
+
+def test_same_bam_name_with_explicit_outputs_is_accepted(tmp_path):
+    manifest = write_manifest(tmp_path / "samples.tsv", ["run1/sample.bam\trun1.csv", "run2/sample.bam"])
+    assert len(read_manifest(manifest, str(tmp_path / "out"))) == 2
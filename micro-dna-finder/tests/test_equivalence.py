@@ -0,0 +1,160 @@
+import argparse
+import csv
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+
+from main import add_pipeline_args, run_sample
+from alignment_models import ScanOptions
+from aligners import get_backend
+from beautiful_printer import set_progress_mode
+from file_interaction import load_bam, save_results_sv
+from metrics import RunMetrics
+from reference_store import ReferenceGenome
+from seeding import SeedFilter
+from shard_store import merge_shards, pair_shard, plan_shards, scan_shard
+from ungapped import UngappedScorer
+from utils import cluster_sites, find_high_support_sites, find_soft_clips, merge_ranked, AlignmentEngine, ReferenceAlignmentCache, REF_ALIGNER_PARAMS
+from synthetic_data import simulate_dataset
+
+# Low enough for background soft-clips to form sites, so pairing sees far more than the planted junctions
+MIN_SUPPORT = 2
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    set_progress_mode("none")
+    prefix = tmp_path_factory.mktemp("synthetic") / "sample"
+    return simulate_dataset(str(prefix), n_reads=12000, contig_length=60000, n_contigs=2, n_junctions=60, clip_rate=0.3, seed=3)
+
+def run_pipeline(dataset: dict, output_file: str, options: list[str]) -> bytes:
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    args = parser.parse_args(["--no_cache", "--min_support", str(MIN_SUPPORT), *options])
+    run_sample(args, dataset["bam"], output_file, ReferenceGenome(dataset["fasta"]), RunMetrics())
+    with open(output_file, "rb") as f:
+        return f.read()
+
+def _scan_and_pair(job: tuple) -> None:
+    # One node of a sharded run
+    set_progress_mode("none")
+    i, region, dataset, shard_dir, tolerance, max_span, seed_k = job
+    scan_path = os.path.join(shard_dir, f"scan_{i}.npz")
+    scan_shard(dataset["bam"], dataset["fasta"], region, ScanOptions(), MIN_SUPPORT, scan_path)
+    seed_filter = SeedFilter(seed_k) if seed_k else None
+    with AlignmentEngine() as engine:
+        pair_shard(scan_path, ReferenceGenome(dataset["fasta"]), os.path.join(shard_dir, f"pairs_{i}.npz"), tolerance, 6, max_span,
+                   seed_filter, engine, ReferenceAlignmentCache(), seed_params=[seed_k, 1] if seed_k else None)
+
+@pytest.mark.parametrize("options, baseline", [
+    (["--online", "--max_span", "700", "--block_size", "5000"], ["--max_span", "700"]),
+    (["--sketch_width", "1024", "--sketch_exact"], []),
+    (["--ref_scoring", "ungapped"], []),
+    (["--workers", "2"], []),
+])
+def test_option_matches_plain_run(dataset, tmp_path, options, baseline):
+    expected = run_pipeline(dataset, str(tmp_path / "plain.csv"), baseline)
+    assert expected.count(b"\n") > 20
+    assert run_pipeline(dataset, str(tmp_path / "option.csv"), options) == expected
+
+@pytest.mark.parametrize("shards, tolerance, max_span, seed_k", [
+    (3, 0, None, None),
+    (40, 0, 700, None),
+    (40, 10, 700, 8),
+])
+def test_sharded_run_matches_plain_run(dataset, tmp_path, shards, tolerance, max_span, seed_k):
+    options = ["--cluster_tolerance", str(tolerance)]
+    options += ["--max_span", str(max_span)] if max_span is not None else []
+    options += ["--seed_k", str(seed_k)] if seed_k else []
+    expected = run_pipeline(dataset, str(tmp_path / "plain.csv"), options)
+    assert expected.count(b"\n") > 20
+
+    regions = plan_shards(load_bam(dataset["bam"]), ReferenceGenome(dataset["fasta"]), shards)
+    # Shards are given less than max_span each, so pairs reach across several of them
+    assert len(regions) >= shards
+    jobs = [(i, region, dataset, str(tmp_path), tolerance, max_span, seed_k) for i, region in enumerate(regions)]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        list(executor.map(_scan_and_pair, jobs))
+    pair_paths = [str(tmp_path / f"pairs_{i}.npz") for i in reversed(range(len(regions)))]
+    output_file = str(tmp_path / "merged.csv")
+    with AlignmentEngine() as engine:
+        ranked, _ = merge_shards(pair_paths, ReferenceGenome(dataset["fasta"]), engine, ReferenceAlignmentCache())
+        save_results_sv(merge_ranked(ranked), output_file)
+    with open(output_file, "rb") as f:
+        assert f.read() == expected
+
+def _expected_clusters(counts: dict[int, int], tolerance: int) -> dict[int, tuple[list[int], int]]:
+    # Neighbours at most tolerance apart share a cluster, whose best-supported (then leftmost) member takes the summed support
+    clusters: list[list[int]] = []
+    for pos in sorted(counts):
+        if clusters and pos - clusters[-1][-1] <= tolerance:
+            clusters[-1].append(pos)
+        else:
+            clusters.append([pos])
+    expected = {}
+    for cluster in clusters:
+        best = max(counts[pos] for pos in cluster)
+        rep = min(pos for pos in cluster if counts[pos] == best)
+        expected[rep] = (cluster, sum(counts[pos] for pos in cluster))
+    return expected
+
+def test_clustering_sums_support_and_lists_members(dataset, tmp_path):
+    tolerance = 50
+    expected = {}
+    bam = load_bam(dataset["bam"])
+    for contig in ReferenceGenome(dataset["fasta"]).names:
+        start_clips, end_clips, _ = find_soft_clips(bam, ScanOptions(), contig)
+        for side, clips in (("start", start_clips), ("end", end_clips)):
+            sites = find_high_support_sites(clips, MIN_SUPPORT)
+            expected[contig, side] = _expected_clusters({pos: details.count for pos, details in sites.items()}, tolerance)
+            representatives, members = cluster_sites(sites, tolerance)
+            assert {pos: (members[pos], details.count) for pos, details in representatives.items()} == expected[contig, side]
+    bam.close()
+    assert sum(len(cluster) > 1 for clusters in expected.values() for cluster, _ in clusters.values()) >= 5
+
+    output_file = str(tmp_path / "clustered.csv")
+    run_pipeline(dataset, output_file, ["--cluster_tolerance", str(tolerance)])
+    with open(output_file, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) > 20
+    multi_member = 0
+    for row in rows:
+        for side in ("start", "end"):
+            cluster, _ = expected[row["contig"], side][int(row[f"{side}_pos"])]
+            assert row[f"{side}_members"] == ";".join(map(str, cluster))
+            multi_member += len(cluster) > 1
+    assert multi_member
+
+def _mutate(rng: random.Random, seq: str) -> str:
+    bases = list(seq)
+    for _ in range(rng.randint(0, 6)):
+        i = rng.randrange(len(bases))
+        kind = rng.random()
+        if kind < 0.6:
+            bases[i] = rng.choice("ACGTN")
+        elif kind < 0.8:
+            # An insertion and a deletion keep the length, so the pair is still scored without gaps
+            del bases[i]
+            bases.insert(rng.randrange(len(bases) + 1), rng.choice("ACGT"))
+        else:
+            bases = bases[i:] + bases[:i]
+    return "".join(bases)
+
+def test_ungapped_bound_is_never_beaten_by_gapped_aligner():
+    rng = random.Random(7)
+    queries, targets = [], []
+    for _ in range(5000):
+        query = "".join(rng.choices("ACGT", k=rng.choice([8, 20, 42])))
+        queries.append(query)
+        targets.append(_mutate(rng, query) if rng.random() < 0.9 else "".join(rng.choices("ACGT", k=len(query))))
+    scorer = UngappedScorer.from_params(REF_ALIGNER_PARAMS)
+    scores, exact = scorer.score(queries, targets)
+    assert exact.any() and not exact.all()
+    gapped = get_backend("biopython", REF_ALIGNER_PARAMS)
+    for i in exact.nonzero()[0].tolist():
+        assert gapped.score(queries[i], targets[i]) == scores[i]
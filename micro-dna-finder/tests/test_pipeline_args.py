@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli'))
+
+from main import add_pipeline_args, check_pipeline_args
+
+def parse(options: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    args = parser.parse_args(options)
+    check_pipeline_args(parser, args)
+    return args
+
+@pytest.mark.parametrize("options", [
+    ["--stream", "--top_k", "5"],
+    ["--seed_k", "33"],
+    ["--min_seeds", "0"],
+    ["--online"],
+    ["--min_span", "0"],
+    ["--anchor_len", "10"],
+    ["--anchor_len", "20", "--min_read_score", "80"],
+])
+def test_rejected_combinations(options, capsys):
+    with pytest.raises(SystemExit):
+        parse(options)
+    assert "error:" in capsys.readouterr().err
+
+@pytest.mark.parametrize("options", [
+    ["--stream"],
+    ["--top_k", "5"],
+    ["--online", "--max_span", "700", "--stream"],
+    ["--anchor_len", "10", "--min_read_score", "30"],
+    ["--anchor_len", "20"],
+])
+def test_accepted_combinations(options):
+    parse(options)
@@ -0,0 +1,50 @@
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pysam
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli'))
+
+from reference_store import load_packed_reference
+
+def _write_fasta(path: str, contigs: dict[str, str]) -> None:
+    with open(path, "w") as f:
+        for name, seq in contigs.items():
+            f.write(f">{name}\n")
+            f.writelines(seq[i:i + 60] + "\n" for i in range(0, len(seq), 60))
+    pysam.faidx(path)
+
+def _random_contig(rng: random.Random, length: int) -> str:
+    bases = list("".join(rng.choices("ACGT", k=length)))
+    # Runs of N, other IUPAC codes and soft-masked bases, which the pack stores apart from the 2-bit codes
+    for _ in range(40):
+        start = rng.randrange(length - 500)
+        end = start + rng.randint(1, 500)
+        kind = rng.random()
+        if kind < 0.4:
+            bases[start:end] = "N" * (end - start)
+        elif kind < 0.5:
+            bases[start:end] = rng.choices("RYKM", k=end - start)
+        else:
+            bases[start:end] = [b.lower() for b in bases[start:end]]
+    return "".join(bases)
+
+def _pack_and_read(job: tuple) -> dict[str, str]:
+    fasta_path, names = job
+    return {name: load_packed_reference(fasta_path, name)[:] for name in names}
+
+def test_concurrent_first_use_packs_without_failing(tmp_path):
+    rng = random.Random(5)
+    contigs = {f"chr{i}": _random_contig(rng, 400000 + i) for i in range(3)}
+    fasta_path = str(tmp_path / "reference.fa")
+    _write_fasta(fasta_path, contigs)
+
+    # Every process finds no pack and packs the contigs itself, at the same time as the others
+    jobs = [(fasta_path, list(contigs) if i % 2 else list(reversed(contigs))) for i in range(8)]
+    with ProcessPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(_pack_and_read, jobs))
+    assert all(result == contigs for result in results)
+    assert not [name for name in os.listdir(f"{fasta_path}.packed") if name.endswith(".tmp")]
+    assert {name: load_packed_reference(fasta_path, name)[:] for name in contigs} == contigs
@@ -1,62 +1,204 @@
-import time
+import argparse
+import csv
+import importlib
+import json
+import platform
 import random
-import subprocess
+import statistics
+import sys
+import time
+import tracemalloc
 import matplotlib.pyplot as plt
 
-def generate_random_sequence(length):
-    return ''.join(random.choices('ACGT', k=length))
-
-def measure_execution_time_results(script_path, query, target):
-    start = time.monotonic_ns()
-    process = subprocess.run(
-        ['python', script_path, '--A', query, '--B', target],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stop = time.monotonic_ns()
-    if process.returncode != 0:
-        print(f"Error running {script_path}: {process.stderr.decode()}")
-    return stop - start
+# (label, module, function building the (query, target) callable from the imported module)
+ALIGNERS = [
+    ("Ryan Layer's Provided Smith-Waterman Algorithm", 'sw_ryan_layer',
+     lambda m: lambda A, B: m.sw_traceback(m.sw_fill_matrix(A, B, -2, -1, 1), A, B, -2, -1, 1)),
+    ("Vincent Bowen's Rudimentary Smith-Waterman Algorithm", 'sw_vincent_bowen',
+     lambda m: lambda A, B: m.sw(A, B, -2, -1, 1)),
+    ("Biopython Pairwise Sequence Alignment", 'pwa_biopython',
+     lambda m: m.align_sequences),
+    ("SciKit-Bio Striped Smith-Waterman", 'sw_skbio',
+     lambda m: m.align_sequences),
+    ("NumPy Vectorized Smith-Waterman", 'sw_numpy',
+     lambda m: lambda A, B: m.sw(A, B, -2, -1, 1)),
+]
 
-def main():
-    query_length = 42
-    target_sizes = [100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000]
-    query = generate_random_sequence(query_length)
+FIELDNAMES = ['aligner', 'query_length', 'target_length', 'repeats', 'median_ns', 'q1_ns', 'q3_ns', 'iqr_ns', 'peak_bytes']
+
+def get_args():
+    parser = argparse.ArgumentParser(description='In-process benchmark of the pairwise aligners')
+    parser.add_argument('--query_lengths',
+                        type=int,
+                        nargs='+',
+                        default=[42],
+                        help='Query lengths to benchmark (default: 42)')
+    parser.add_argument('--target_sizes',
+                        type=int,
+                        nargs='+',
+                        default=[100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000],
+                        help='Target lengths to benchmark')
+    parser.add_argument('--repeats',
+                        type=int,
+                        default=5,
+                        help='Timed runs per aligner and size (default: 5)')
+    parser.add_argument('--warmup',
+                        type=int,
+                        default=1,
+                        help='Untimed runs before timing (default: 1)')
+    parser.add_argument('--max_seconds',
+                        type=float,
+                        default=2.0,
+                        help='Skip larger targets for an aligner once its median exceeds this (default: 2.0)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the generated sequences (default: 0)')
+    parser.add_argument('--output',
+                        type=str,
+                        default='results',
+                        help='Output prefix for the .csv, .json and .png files (default: results)')
+    parser.add_argument('--baseline',
+                        type=str,
+                        default=None,
+                        help='JSON results of an earlier run to check for regressions against')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.25,
+                        help='Allowed relative slowdown of the median before a regression is reported (default: 0.25)')
+    return parser.parse_args()
+
+def generate_random_sequence(length, rng=random):
+    return ''.join(rng.choices('ACGT', k=length))
 
-    ryan_script = 'sw_ryan_layer.py'
-    vincent_script = 'sw_vincent_bowen.py'
-    biopython_script = 'sw_biopython.py'
-    sci_kit_script = 'sw_skbio.py'
+def load_aligners():
+    aligners = {}
+    for label, module_name, build in ALIGNERS:
+        try:
+            aligners[label] = build(importlib.import_module(module_name))
+        except ImportError as e:
+            print(f"Skipping {label}: {e}")
+    return aligners
 
-    ryan_times = []
-    vincent_times = []
-    biopython_times = []
-    sci_kit_times = []
+def measure_execution_time_results(align, query, target, repeats, warmup):
+    """Times an aligner in this process, after warm-up runs, and measures its peak Python heap usage in a separate run
 
-    for target_size in target_sizes:
-        target = generate_random_sequence(target_size)
+    Returns:
+        dict: median, quartiles and interquartile range of the run times in nanoseconds, and the peak traced memory in bytes
+    """
+    for _ in range(warmup):
+        align(query, target)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        align(query, target)
+        times.append(time.perf_counter_ns() - start)
+    # tracemalloc slows allocation down, so memory is measured outside of the timed runs
+    tracemalloc.start()
+    align(query, target)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    q1, median, q3 = statistics.quantiles(times, n=4, method='inclusive') if len(times) > 1 else (times[0],) * 3
+    return {
+        'repeats': repeats,
+        'median_ns': median,
+        'q1_ns': q1,
+        'q3_ns': q3,
+        'iqr_ns': q3 - q1,
+        'peak_bytes': peak,
+    }
 
-        ryan_time = measure_execution_time_results(ryan_script, query, target)
-        vincent_time = measure_execution_time_results(vincent_script, query, target)
-        biopython_time = measure_execution_time_results(biopython_script, query, target)
-        sci_kit_time = measure_execution_time_results(sci_kit_script, query, target)
+def run_benchmarks(args, aligners):
+    rng = random.Random(args.seed)
+    results = []
+    for query_length in args.query_lengths:
+        query = generate_random_sequence(query_length, rng)
+        targets = {size: generate_random_sequence(size, rng) for size in args.target_sizes}
+        for label, align in aligners.items():
+            for target_size in args.target_sizes:
+                row = measure_execution_time_results(align, query, targets[target_size], args.repeats, args.warmup)
+                row.update(aligner=label, query_length=query_length, target_length=target_size)
+                results.append(row)
+                print(f"{label} | query {query_length} | target {target_size}: "
+                      f"median {row['median_ns'] / 1e6:.3f} ms (IQR {row['iqr_ns'] / 1e6:.3f} ms), peak {row['peak_bytes'] / 1024:.1f} KiB")
+                if row['median_ns'] / 1e9 > args.max_seconds:
+                    print(f"{label} exceeded {args.max_seconds}s, skipping larger targets")
+                    break
+    return results
 
-        ryan_times.append(ryan_time)
-        vincent_times.append(vincent_time)
-        biopython_times.append(biopython_time)
-        sci_kit_times.append(sci_kit_time)
+def save_results(results, prefix):
+    with open(f"{prefix}.csv", 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for r in results:
+            writer.writerow({field: r[field] for field in FIELDNAMES})
+    with open(f"{prefix}.json", 'w') as f:
+        json.dump({
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2)
 
+def load_baseline(baseline_path):
+    with open(baseline_path) as f:
+        return {
+            (r['aligner'], r['query_length'], r['target_length']): r
+            for r in json.load(f)['results']
+        }
+
+def check_regressions(results, baseline, tolerance):
+    """Compares the medians against an earlier run
+
+    Returns:
+        list[str]: a description of every aligner and size whose median grew by more than the tolerance
+    """
+    regressions = []
+    for r in results:
+        base = baseline.get((r['aligner'], r['query_length'], r['target_length']))
+        if base is None:
+            continue
+        ratio = r['median_ns'] / base['median_ns']
+        if ratio > 1 + tolerance:
+            regressions.append(f"{r['aligner']} | query {r['query_length']} | target {r['target_length']}: "
+                               f"{base['median_ns'] / 1e6:.3f} ms -> {r['median_ns'] / 1e6:.3f} ms ({ratio:.2f}x)")
+    return regressions
+
+def plot_results(results, filename):
     plt.figure(figsize=(10, 6))
-    plt.plot(target_sizes, ryan_times, label="Ryan Layer's Provided Smith-Waterman Algorithm")
-    plt.plot(target_sizes, vincent_times, label="Vincent Bowen's Rudimentary Smith-Waterman Algorithm")
-    plt.plot(target_sizes, biopython_times, label="Biopython Pairwise Sequence Alignment")
-    plt.plot(target_sizes, sci_kit_times, label="SciKit-Bio Striped Smith-Waterman")
+    series = {}
+    for r in results:
+        series.setdefault((r['aligner'], r['query_length']), []).append(r)
+    multiple_queries = len({r['query_length'] for r in results}) > 1
+    for (label, query_length), rows in series.items():
+        sizes = [r['target_length'] for r in rows]
+        medians = [r['median_ns'] for r in rows]
+        if multiple_queries:
+            label = f"{label} (query {query_length})"
+        plt.plot(sizes, medians, marker='o', label=label)
+        plt.fill_between(sizes, [r['q1_ns'] for r in rows], [r['q3_ns'] for r in rows], alpha=0.2)
+    plt.xscale('log')
+    plt.yscale('log')
     plt.xlabel('Target Size')
-    plt.ylabel('Execution Time (nanoseconds)')
+    plt.ylabel('Median Alignment Time (nanoseconds)')
     plt.title('Sequence Alignment Algorithm Speed Comparison')
     plt.legend()
     plt.grid(True)
-    plt.savefig('results.png')
+    plt.savefig(filename)
+
+def main():
+    args = get_args()
+    # Read the baseline first, since it may be the file this run overwrites
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    aligners = load_aligners()
+    results = run_benchmarks(args, aligners)
+    save_results(results, args.output)
+    plot_results(results, f"{args.output}.png")
+    if baseline is not None:
+        regressions = check_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import numpy as np
+
+# Target padding byte for batches; never equal to a query base
+PAD = 0
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--A',
+                        type=str,
+                        required=True,
+                        help='Sequence A')
+    parser.add_argument('--B',
+                        type=str,
+                        required=True,
+                        help='Sequence B')
+    parser.add_argument('--gap',
+                        type=int,
+                        default=-2,
+                        help='Gap penalty (default: -2)')
+    parser.add_argument('--miss',
+                        type=int,
+                        default=-1,
+                        help='Mismatch penalty (default: -1)')
+    parser.add_argument('--match',
+                        type=int,
+                        default=1,
+                        help='Match score (default: 1)')
+    return parser.parse_args()
+
+
+def encode(seq):
+    return np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+
+def score_dtype(*scores):
+    return np.result_type(*(type(s) for s in scores), np.int64)
+
+def sw_fill_row(prev, sub, gap):
+    """Fills one row of the linear-gap Smith-Waterman matrix for every column (and every target of a batch) at once.
+    The diagonal and vertical moves only need the previous row. The chain of horizontal gaps,
+    H[j] = max(D[j], H[j-1] + gap), unrolls to max_{k<=j}(D[k] + gap * (j - k)), which is a running maximum.
+
+    Args:
+        prev: previous row of H, shape (..., n + 1)
+        sub: substitution scores of this query base against every target base, shape (..., n)
+        gap: gap penalty
+
+    Returns:
+        the new row of H, shape (..., n + 1)
+    """
+    row = np.zeros_like(prev)
+    row[..., 1:] = np.maximum(np.maximum(prev[..., :-1] + sub, prev[..., 1:] + gap), 0)
+    ramp = gap * np.arange(prev.shape[-1], dtype=prev.dtype)
+    return np.maximum.accumulate(row - ramp, axis=-1) + ramp
+
+def sw_fill_matrix(A, B, gap, miss, match):
+    a, b = encode(A), encode(B)
+    H = np.zeros((len(A) + 1, len(B) + 1), dtype=score_dtype(gap, miss, match))
+    for i in range(1, len(A) + 1):
+        H[i] = sw_fill_row(H[i-1], np.where(b == a[i-1], match, miss), gap)
+    return H
+
+def sw_traceback(H, A, B, gap, miss, match):
+    # argmax returns the first maximum in row-major order, the same cell the nested-loop scan picks
+    i, j = np.unravel_index(np.argmax(H), H.shape)
+    score = H[i][j]
+    align_A = []
+    align_B = []
+    while H[i][j] > 0:
+        if H[i][j] == H[i-1][j-1] + (match if A[i-1] == B[j-1] else miss):
+            align_A.append(A[i-1])
+            align_B.append(B[j-1])
+            i -= 1
+            j -= 1
+        elif H[i][j] == H[i-1][j] + gap:
+            align_A.append(A[i-1])
+            align_B.append('-')
+            i -= 1
+        elif H[i][j] == H[i][j-1] + gap:
+            align_A.append('-')
+            align_B.append(B[j-1])
+            j -= 1
+        else:
+            break
+    return ''.join(align_A[::-1]), ''.join(align_B[::-1]), score.item()
+
+def sw(A, B, gap, miss, match):
+    H = sw_fill_matrix(A, B, gap, miss, match)
+    A, B, score = sw_traceback(H, A, B, gap, miss, match)
+    match = ['|' if A[i] == B[i] else ' ' for i in range(len(A))]
+    return score, A, B, ''.join(match)
+
+def sw_score_batch(query, targets, gap, miss, match, extend=None):
+    """Scores one query against a batch of targets without building tracebacks. Targets are padded to a common
+    length and filled row by row together, so the per-row NumPy overhead is shared by the whole batch.
+
+    Args:
+        query: the query sequence, e.g. one start soft-clip
+        targets: the target sequences, e.g. the end soft-clips it is paired with
+        gap: gap penalty, or the gap opening penalty when extend is given
+        miss: mismatch penalty
+        match: match score
+        extend: gap extension penalty for affine (Gotoh) gaps, or None for linear gaps. Defaults to None.
+
+    Returns:
+        array with the best local alignment score of the query against each target
+    """
+    dtype = score_dtype(gap, miss, match) if extend is None else np.float64
+    q = encode(query)
+    lengths = np.array([len(t) for t in targets], dtype=np.int64)
+    n = int(lengths.max()) if len(targets) else 0
+    padded = np.full((len(targets), n), PAD, dtype=np.uint8)
+    for row, t in enumerate(targets):
+        padded[row, :len(t)] = encode(t)
+    # Cells past the end of a shorter target only feed cells further right, so they just need masking out of the maximum
+    valid = np.arange(1, n + 1) <= lengths[:, None]
+    H = np.zeros((len(targets), n + 1), dtype=dtype)
+    best = np.zeros(len(targets), dtype=dtype)
+    if extend is None:
+        for base in q:
+            H = sw_fill_row(H, np.where(padded == base, match, miss), gap)
+            best = np.maximum(best, np.where(valid, H[:, 1:], 0).max(axis=1, initial=0))
+        return best
+    # Gotoh: F holds vertical gaps, carried between rows. Horizontal gaps are resolved with the same running
+    # maximum as above, E[j] = max_{k<j}(D[k] + gap + extend * (j - 1 - k)); reopening a gap from E is never
+    # better than extending it as long as gap <= extend
+    F = np.full_like(H, -np.inf)
+    ramp = extend * np.arange(n + 1, dtype=dtype)
+    for base in q:
+        F = np.maximum(H + gap, F + extend)
+        D = np.zeros_like(H)
+        D[:, 1:] = np.maximum(np.maximum(H[:, :-1] + np.where(padded == base, match, miss), F[:, 1:]), 0)
+        E = np.full_like(H, -np.inf)
+        E[:, 1:] = np.maximum.accumulate(D - ramp, axis=1)[:, :-1] + ramp[1:] - extend + gap
+        H = np.maximum(D, E)
+        best = np.maximum(best, np.where(valid, H[:, 1:], 0).max(axis=1, initial=0))
+    return best
+
+def main():
+    args = get_args()
+
+    score, align_A, align_B, match = sw(args.A,
+                                        args.B,
+                                        args.gap,
+                                        args.miss,
+                                        args.match)
+    print(score)
+    print(align_A)
+    print(match)
+    print(align_B)
+
+
+if __name__ == '__main__':
+    main()